@@ -0,0 +1,200 @@
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+
+
+def _normalize(text):
+    return " ".join(str(text or "").lower().split())
+
+
+# Words whose presence or absence doesn't change what the note says
+STOPWORDS = frozenset("a an and the of to for with in on at is are was were be has have had".split())
+
+
+def _content_words(text):
+    # Negations ("no", "not", "without") are deliberately not stopwords
+    return set(re.findall(r"[a-z0-9]+", _normalize(text))) - STOPWORDS
+
+
+def _normalize_dosage(text):
+    # "10 MG  daily" and "10mg daily" describe the same dose
+    return re.sub(r"(\d)\s+([a-z])", r"\1\2", _normalize(text))
+
+
+def canonical_profile(current_meds, allergies, conditions, new_meds, patient_info):
+    """Reduce the structured form inputs to an order- and formatting-independent dict."""
+    def meds(items):
+        return sorted(
+            [_normalize(med.get("name")), _normalize_dosage(med.get("dosage"))]
+            # Like format_medical_query, a medication without a dosage is left out of the patient section
+            for med in items or [] if med.get("name") and med.get("dosage")
+        )
+
+    def undosed(items):
+        return sorted(_normalize(med.get("name")) for med in items or [] if med.get("name") and not med.get("dosage"))
+
+    patient_info = patient_info or {}
+    return {
+        "current_meds": meds(current_meds),
+        "new_meds": meds(new_meds),
+        # ...but its name is still looked up, so it changes the retrieved context
+        "undosed_meds": [undosed(current_meds), undosed(new_meds)],
+        "allergies": sorted(
+            [_normalize(a.get("name")), _normalize(a.get("reaction"))]
+            for a in allergies or [] if a.get("name")
+        ),
+        "conditions": sorted(_normalize(c) for c in conditions or [] if c),
+        "patient": {
+            "age": _normalize(patient_info.get("age")),
+            "gender": _normalize(patient_info.get("gender")),
+            "bp": re.sub(r"\s+", "", str(patient_info.get("bp") or "")),
+        },
+    }
+
+
+def _digest(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class AnswerCache:
+    """Persistent TTL + LRU cache of analysis responses keyed on canonical inputs.
+
+    Exact lookups use a hash of the canonical profile plus the normalized
+    ``additional_info``. Opt-in: if that misses and both ``embed_fn`` and
+    ``similarity_threshold`` are set, a cached answer for the same profile is
+    reused when its ``additional_info`` embedding is within the threshold
+    (cosine) and the two texts differ only in stopwords, so "pregnant" and
+    "not pregnant" never share an answer.
+    """
+
+    def __init__(self, path, ttl_seconds=24 * 3600, max_entries=1000,
+                 embed_fn=None, similarity_threshold=None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self.counters = {"hits": 0, "similar_hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._last_embedding = (None, None)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Server workers share this file; wait for another process's write instead of failing
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, base_key TEXT, additional_info TEXT,"
+            " info_embedding BLOB, response TEXT, created REAL, last_access REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_base_key ON answers (base_key)")
+        self._conn.commit()
+
+    def _keys(self, namespace, profile, additional_info):
+        base_key = _digest({"namespace": namespace, "profile": profile})
+        key = _digest({"base": base_key, "additional_info": _normalize(additional_info)})
+        return key, base_key
+
+    def _embed(self, text):
+        text = _normalize(text)
+        if not text or self.embed_fn is None or not self.similarity_threshold:
+            return None
+        if self._last_embedding[0] != text:
+            self._last_embedding = (text, self.embed_fn(text))
+        return self._last_embedding[1]
+
+    def get(self, namespace, profile, additional_info=""):
+        """Return a cached response dict, or None on a miss."""
+        key, base_key = self._keys(namespace, profile, additional_info)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                self._conn.commit()
+                self.counters["expired"] += 1
+                row = None
+            if row:
+                self._touch(key, now)
+                self.counters["hits"] += 1
+                return json.loads(row[0])
+
+            candidates = []
+            if self.embed_fn is not None and self.similarity_threshold and _normalize(additional_info):
+                candidates = self._conn.execute(
+                    "SELECT key, response, info_embedding, additional_info FROM answers"
+                    " WHERE base_key = ? AND created >= ? AND info_embedding IS NOT NULL",
+                    (base_key, now - self.ttl_seconds),
+                ).fetchall()
+
+        if candidates:
+            query = self._embed(additional_info)
+            best_key, best_response, best_score = None, None, self.similarity_threshold
+            words = _content_words(additional_info)
+            for cand_key, response, blob, cand_info in candidates:
+                if _content_words(cand_info) != words:
+                    continue
+                score = _cosine(query, array("f", blob))
+                if score >= best_score:
+                    best_key, best_response, best_score = cand_key, response, score
+            if best_key is not None:
+                with self._lock:
+                    self._touch(best_key, now)
+                    self.counters["similar_hits"] += 1
+                return json.loads(best_response)
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, namespace, profile, additional_info, response):
+        """Store a response and evict least-recently-used entries beyond ``max_entries``."""
+        key, base_key = self._keys(namespace, profile, additional_info)
+        vector = self._embed(additional_info)
+        blob = array("f", vector).tobytes() if vector is not None else None
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, base_key, _normalize(additional_info), blob, json.dumps(response), now, now),
+            )
+            overflow = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE key IN"
+                    " (SELECT key FROM answers ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self.counters["evictions"] += overflow
+            self._conn.commit()
+
+    def _touch(self, key, now):
+        self._conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+
+    def invalidate(self):
+        """Drop every cached answer, e.g. because the reference corpus changed."""
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def stats(self):
+        """Return hit/miss counters and the current size of the cache."""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        lookups = self.counters["hits"] + self.counters["similar_hits"] + self.counters["misses"]
+        hit_rate = (self.counters["hits"] + self.counters["similar_hits"]) / lookups if lookups else 0.0
+        return dict(self.counters, size=size, hit_rate=round(hit_rate, 3))
@@ -1,36 +1,247 @@
-from model import MedicalInteractionModel
-from data_loader import MedicalDataLoader
+import asyncio
+import os
+import resource
+import threading
+import time
+from manifest import IngestionManifest
+from tracing import tracer
+
+
+def process_memory_mb():
+    """Return (current RSS, peak RSS) of this process in megabytes."""
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    try:
+        with open("/proc/self/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        rss_mb = rss_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        rss_mb = peak_mb
+    return round(rss_mb, 1), round(peak_mb, 1)
+
 
 class MedicalInteractionApp:
     """Main application class for the Medical Interaction Checker system."""
     
-    def __init__(self, model_name="llama3", data_dir="data"):
-        self.model = MedicalInteractionModel(model_name=model_name)
-        self.data_loader = MedicalDataLoader(data_dir=data_dir)
+    def __init__(self, model_name="llama3", data_dir="data", chunk_size=1000, chunk_overlap=200, splitter=None,
+                 **model_kwargs):
+        self.model_name = model_name
+        self.data_dir = data_dir
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.splitter = splitter
+        self.model_kwargs = model_kwargs
+        self._model = None
+        self._data_loader = None
         self.is_initialized = False
+        self.init_seconds = None
+        self.init_memory_mb = None
+        # "cold" -> "warming" -> "ready" (or "failed"); polled by the UI
+        self.state = "cold"
+        self.status_message = "Not initialized yet"
+        self._init_lock = threading.Lock()
+        self._lazy_lock = threading.Lock()
+        self._warmup_thread = None
+    
+    @property
+    def model(self):
+        """The RAG model; langchain and the vector store stack are only imported on first access."""
+        if self._model is None:
+            with self._lazy_lock:
+                if self._model is None:
+                    from model import MedicalInteractionModel
+                    self._model = MedicalInteractionModel(model_name=self.model_name, **self.model_kwargs)
+        return self._model
+    
+    @property
+    def data_loader(self):
+        """The PDF loader, created on first access for the same reason as ``model``."""
+        if self._data_loader is None:
+            with self._lazy_lock:
+                if self._data_loader is None:
+                    from data_loader import MedicalDataLoader
+                    self._data_loader = MedicalDataLoader(data_dir=self.data_dir, splitter=self.splitter)
+        return self._data_loader
         
     def initialize(self):
-        """Initialize the system by loading documents and setting up the model."""
+        """Initialize the system by loading documents and setting up the model.
+        
+        Safe to call from several threads: only the first caller does the work,
+        the others wait for it and then return immediately.
+        """
+        with self._init_lock:
+            if self.is_initialized:
+                return True, "System already initialized."
+            
+            self.state = "warming"
+            self.status_message = "Loading the embedding model and vector store..."
+            start = time.perf_counter()
+            rss_before, _ = process_memory_mb()
+            with tracer.span("initialize") as span:
+                success, message = self._initialize()
+                span.set(success=success)
+            if success:
+                self.init_seconds = round(time.perf_counter() - start, 2)
+                self.init_memory_mb = round(process_memory_mb()[0] - rss_before, 1)
+            self.state = "ready" if success else "failed"
+            self.status_message = message
+            return success, message
+    
+    def start_warmup(self):
+        """Initialize in a background thread so the caller (e.g. the UI) can render meanwhile.
+        
+        Does nothing if the engine is ready or already warming up; after a
+        failure it tries again.
+        """
+        with self._lazy_lock:
+            if self.is_initialized or (self._warmup_thread and self._warmup_thread.is_alive()):
+                return
+            self.state = "warming"
+            self.status_message = "Starting up..."
+            self._warmup_thread = threading.Thread(target=self.initialize, name="engine-warmup", daemon=True)
+            self._warmup_thread.start()
+    
+    def status(self):
+        """Readiness for polling: {"state": cold|warming|ready|failed, "message": ...}."""
+        return {"state": self.state, "message": self.status_message, "init_seconds": self.init_seconds}
+    
+    def _initialize(self):
         try:
-            # Load and split documents
-            chunks = self.data_loader.load_and_split()
+            if self.model.snapshot_dir:
+                # A prebuilt snapshot needs no PDFs, parsing or embedding
+                self.model.initialize(None)
+                self.is_initialized = True
+                return True, f"System initialized from index snapshot {self.model.snapshot.version}!"
             
-            if not chunks:
+            if self.model.read_only:
+                # Serve what another process ingested; the PDFs are not even hashed
+                self.model.initialize(None)
+                self.is_initialized = True
+                return True, "System initialized from the ingested index!"
+            
+            # Only load and split PDFs that changed since the last ingestion
+            manifest = IngestionManifest(self.model.manifest_path)
+            # Without a manifest nothing says which stored chunks are current, so start over
+            reset = not manifest.exists
+            if not self.data_loader.list_pdf_files() and not manifest.files:
                 return False, "No document chunks available. Please add PDF files to the data directory."
+            # Runs even when every PDF was deleted, so their chunks are removed from the store
+            chunks, stale_ids = self.data_loader.sync(
+                manifest, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
+            )
+            
+            # Initialize the model; new chunks are embedded while PDFs are still parsing
+            self.model.initialize(chunks, stale_ids=stale_ids, reset=reset)
+            manifest.save()
             
-            # Initialize the model with the chunks
-            self.model.initialize(chunks)
+            if not manifest.files:
+                return False, "No document chunks available. Please add PDF files to the data directory."
             self.is_initialized = True
             
             return True, "System initialized successfully!"
         except Exception as e:
             return False, f"Error initializing system: {str(e)}"
             
-    def analyze_interactions(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info=""):
-        """Analyze potential drug interactions."""
+    def switch_snapshot(self):
+        """Pick up a newly activated index snapshot without downtime; returns (switched, message)."""
         if not self.is_initialized:
-            self.initialize()
+            return False, "Engine is not initialized"
+        switched, message = self.model.switch_snapshot()
+        if switched:
+            self.status_message = message
+        return switched, message
+    
+    def create_session(self):
+        """A prefetch session for one patient form; pass it to ``prefetch`` and the analysis."""
+        from retrieval import PrefetchSession
+        return PrefetchSession()
+    
+    def prefetch(self, session, current_meds, allergies, conditions, new_meds):
+        """Start retrieval for the form entries entered so far; a no-op until the engine is ready.
+        
+        Returns {"started": n, "cancelled": n}; see MedicalInteractionModel.prefetch.
+        """
+        if not self.is_initialized:
+            return {"started": 0, "cancelled": 0}
+        return self.model.prefetch(session, current_meds, allergies, conditions, new_meds)
+    
+    def analyze_interactions(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info="",
+                             session=None, priority="interactive", output_format="prose"):
+        """Analyze potential drug interactions; ``priority`` is "interactive" or "batch".
+        
+        ``output_format="structured"`` returns a per-pair severity list in
+        "interactions" and a short summary; see MedicalInteractionModel.analyze_interactions.
+        """
+        if not self.is_initialized:
+            success, message = self.initialize()
+            if not success:
+                return {"error": message}
             
         return self.model.analyze_interactions(
-            current_meds, allergies, conditions, new_meds, patient_info, additional_info
-        )
\ No newline at end of file
+            current_meds, allergies, conditions, new_meds, patient_info, additional_info,
+            session=session, priority=priority, output_format=output_format
+        )
+    
+    async def aanalyze_interactions(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info="",
+                                    session=None, priority="interactive", output_format="prose"):
+        """Analyze potential drug interactions without blocking the event loop."""
+        if not self.is_initialized:
+            success, message = await asyncio.to_thread(self.initialize)
+            if not success:
+                return {"error": message}
+        
+        return await self.model.aanalyze_interactions(
+            current_meds, allergies, conditions, new_meds, patient_info, additional_info,
+            session=session, priority=priority, output_format=output_format
+        )
+    
+    def stream_analysis(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info="",
+                        session=None, priority="interactive"):
+        """Stream potential drug interactions as they are generated; see MedicalInteractionModel.stream_analysis."""
+        if not self.is_initialized:
+            success, message = self.initialize()
+            if not success:
+                yield {"type": "error", "error": message}
+                return
+        
+        yield from self.model.stream_analysis(
+            current_meds, allergies, conditions, new_meds, patient_info, additional_info,
+            session=session, priority=priority
+        )
+    
+    def stats(self):
+        """Report initialization time and memory held by this engine."""
+        rss_mb, peak_mb = process_memory_mb()
+        return {
+            "initialized": self.is_initialized,
+            "state": self.state,
+            "init_seconds": self.init_seconds,
+            "init_memory_mb": self.init_memory_mb,
+            "rss_mb": rss_mb,
+            "peak_rss_mb": peak_mb,
+            # Reporting stats must not be what loads the model
+            "embedding": self._model.embedding_stats if self._model else {},
+            "answer_cache": self._model.answer_cache.stats() if self._model else None,
+            "index_snapshot": self._model.snapshot.version if self._model and self._model.snapshot else None,
+            "scheduler": self._model.scheduler.stats() if self._model else None,
+            "embedding_cache": (
+                self._model.embedding_cache.stats() if self._model and self._model.embedding_cache else None
+            ),
+        }
+
+
+_shared_app = None
+_shared_app_lock = threading.Lock()
+
+
+def get_shared_app(**kwargs):
+    """Return the process-wide MedicalInteractionApp, creating it on first use.
+    
+    All UI sessions share this one engine (embedder, Chroma client and LLM
+    client); it is initialized lazily by the first caller of ``initialize``.
+    """
+    global _shared_app
+    if _shared_app is None:
+        with _shared_app_lock:
+            if _shared_app is None:
+                _shared_app = MedicalInteractionApp(**kwargs)
+    return _shared_app
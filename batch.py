@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from app import MedicalInteractionApp
+from embedding_pipeline import batched
+from tracing import percentile
+
+
+def read_profiles(path):
+    """Yield (profile_id, profile) from a JSONL file, one patient profile per line.
+
+    Each line holds the keyword arguments of ``analyze_interactions``
+    (current_meds, allergies, conditions, new_meds, patient_info,
+    additional_info) plus an optional "id"; the line number is used otherwise.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            profile = json.loads(line)
+            yield str(profile.get("id", line_number)), profile
+
+
+def completed_ids(path):
+    """Return the IDs already written successfully to an output JSONL file."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn final line from a crash; the profile is simply re-run
+                continue
+            # Structured answers that failed to parse are re-run as well
+            if "error" not in record and not record.get("parse_error"):
+                done.add(record["id"])
+    return done
+
+
+class BatchRunner:
+    """Screens many patient profiles, streaming results to a JSONL file.
+
+    Profiles are processed in blocks: retrieval for a whole block is warmed
+    with one batched embedding call, then generations go to Ollama with at
+    most ``concurrency`` requests in flight. Every result is appended and
+    flushed as soon as it finishes, so a crashed run resumes where it stopped.
+    Generations run at "batch" priority, so interactive requests to the same
+    engine are served first. With ``output_format="structured"`` each result
+    carries a per-pair severity list instead of a conversational answer.
+    """
+
+    def __init__(self, app, concurrency=4, block_size=16, output_format="structured"):
+        self.app = app
+        self.concurrency = concurrency
+        self.block_size = block_size
+        self.output_format = output_format
+        self._write_lock = threading.Lock()
+
+    def _analyze(self, profile):
+        start = time.perf_counter()
+        result = self.app.analyze_interactions(
+            profile.get("current_meds", []),
+            profile.get("allergies", []),
+            profile.get("conditions", []),
+            profile.get("new_meds", []),
+            profile.get("patient_info", {}),
+            profile.get("additional_info", ""),
+            priority="batch",
+            output_format=self.output_format,
+        )
+        return result, time.perf_counter() - start
+
+    def run(self, input_path, output_path):
+        """Process every profile not already in ``output_path`` and return a throughput report."""
+        success, message = self.app.initialize()
+        if not success:
+            raise RuntimeError(message)
+
+        done = completed_ids(output_path)
+        pending = ((pid, p) for pid, p in read_profiles(input_path) if pid not in done)
+        latencies = []
+        errors = 0
+        start = time.perf_counter()
+
+        with open(output_path, "a", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            if out.tell() > 0:
+                # Terminate a line torn by a crash before appending
+                with open(output_path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        out.write("\n")
+            in_flight = {}
+            # Outstanding profiles per prefetched block; the block's cache entries are released at zero
+            blocks = {}
+            retriever = self.app.model.retriever
+
+            def lookup_inputs(block):
+                return [(p.get("current_meds", []), p.get("allergies", []),
+                         p.get("conditions", []), p.get("new_meds", [])) for _, p in block]
+
+            def collect(futures):
+                nonlocal errors
+                for future in futures:
+                    profile_id, block_id = in_flight.pop(future)
+                    blocks[block_id][1] -= 1
+                    if not blocks[block_id][1]:
+                        retriever.release(blocks.pop(block_id)[0])
+                    result, latency = future.result()
+                    record = dict(result, id=profile_id, latency_seconds=round(latency, 3))
+                    if "error" in result:
+                        errors += 1
+                    else:
+                        latencies.append(latency)
+                    with self._write_lock:
+                        out.write(json.dumps(record) + "\n")
+                        out.flush()
+
+            for block_id, block in enumerate(batched(pending, self.block_size)):
+                inputs = lookup_inputs(block)
+                retriever.prefetch(inputs)
+                blocks[block_id] = [inputs, len(block)]
+                for profile_id, profile in block:
+                    in_flight[pool.submit(self._analyze, profile)] = profile_id, block_id
+                    if len(in_flight) >= self.concurrency * 2:
+                        finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                        collect(finished)
+            collect(list(in_flight))
+
+        elapsed = time.perf_counter() - start
+        processed = len(latencies) + errors
+        return {
+            "processed": processed,
+            "errors": errors,
+            "skipped": len(done),
+            "seconds": round(elapsed, 2),
+            "profiles_per_second": round(processed / elapsed, 3) if elapsed > 0 else 0.0,
+            "p50_seconds": percentile(latencies, 50),
+            "p95_seconds": percentile(latencies, 95),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-screen patient medication lists for interactions.")
+    parser.add_argument("input", help="JSONL file with one patient profile per line")
+    parser.add_argument("output", help="JSONL file to append results to (resumes if it exists)")
+    parser.add_argument("--model", default="llama3", help="Ollama model name")
+    parser.add_argument("--data-dir", default="data", help="Directory with the reference PDFs")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum concurrent Ollama generations")
+    parser.add_argument("--block-size", type=int, default=16, help="Profiles per batched retrieval block")
+    parser.add_argument("--format", default="structured", choices=["structured", "prose"],
+                        help="structured: JSON severity list per pair; prose: conversational answer")
+    args = parser.parse_args()
+
+    app = MedicalInteractionApp(model_name=args.model, data_dir=args.data_dir)
+    runner = BatchRunner(app, concurrency=args.concurrency, block_size=args.block_size, output_format=args.format)
+    report = runner.run(args.input, args.output)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
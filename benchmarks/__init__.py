@@ -0,0 +1 @@
+"""Offline benchmarks for ingestion, retrieval and end-to-end analysis (see run.py)."""
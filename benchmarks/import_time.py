@@ -0,0 +1,64 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Importing the app and constructing the engine must not pull these in;
+# they are loaded by initialize(), normally on the background warmup thread
+HEAVY_MODULES = ("torch", "sentence_transformers", "onnxruntime", "chromadb", "langchain", "langchain_community", "pypdf")
+
+DEFAULT_BUDGET_MS = 300
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+app.MedicalInteractionApp().stats()
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure_import(repeat=3):
+    """Time ``import app`` plus engine construction in fresh interpreters.
+
+    Returns the best of ``repeat`` runs in milliseconds and the heavy
+    modules that were imported along the way.
+    """
+    timings = []
+    loaded = set()
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["ms"])
+        loaded = {m.split(".")[0] for m in result["modules"]} & set(HEAVY_MODULES)
+    return {"ms": round(min(timings), 1), "heavy_modules": sorted(loaded)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that importing the app stays within its time budget.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    result = measure_import(args.repeat)
+    print(f"import app + engine construction: {result['ms']} ms (budget {args.budget_ms:g} ms)")
+    failures = []
+    if result["ms"] > args.budget_ms:
+        failures.append(f"over budget by {result['ms'] - args.budget_ms:.1f} ms")
+    if result["heavy_modules"]:
+        failures.append("heavy modules imported eagerly: " + ", ".join(result["heavy_modules"]))
+    for failure in failures:
+        print(f"✗ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✓ Within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import asyncio
+import re
+import socket
+import threading
+from aiohttp import web
+from benchmarks.stub_llm import STUB_RESPONSE, STUB_STRUCTURED_RESPONSE
+
+TOKEN_RE = re.compile(r"\S+|\s+")
+
+
+class MockOllamaServer:
+    """A local stand-in for Ollama's /api/generate that counts prompt evaluation.
+
+    Text is split into word and whitespace tokens. Like Ollama's runner the
+    mock keeps the token sequence of its last request in each of ``slots``
+    slots and only evaluates what follows the longest common prefix with one
+    of them, so ``prompt_eval_count`` reports the tokens actually evaluated.
+    ``prompt_cache=False`` evaluates every prompt in full. Prefill takes
+    ``prefill_ms_per_token`` per evaluated token.
+    """
+
+    def __init__(self, slots=4, prompt_cache=True, prefill_ms_per_token=0.0):
+        self.slots = [[] for _ in range(slots)]
+        self.prompt_cache = prompt_cache
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.vocabulary = {}
+        self.words = []
+        self.requests = []
+        self.url = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def tokenize(self, text):
+        tokens = []
+        for piece in TOKEN_RE.findall(text):
+            if piece not in self.vocabulary:
+                self.vocabulary[piece] = len(self.words)
+                self.words.append(piece)
+            tokens.append(self.vocabulary[piece])
+        return tokens
+
+    def _evaluate(self, sequence):
+        """Tokens to evaluate for ``sequence``; claims the best matching slot."""
+        best, shared = 0, 0
+        for i, cached in enumerate(self.slots):
+            common = 0
+            for a, b in zip(cached, sequence):
+                if a != b:
+                    break
+                common += 1
+            if common > shared:
+                best, shared = i, common
+        if not self.prompt_cache:
+            shared = 0
+        self.slots[best] = list(sequence)
+        # Like llama.cpp, the last prompt token is always evaluated to get logits
+        return max(1, len(sequence) - shared)
+
+    async def _generate(self, request):
+        body = await request.json()
+        options = body.get("options") or {}
+        sequence = self.tokenize(body.get("prompt", ""))
+        evaluated = self._evaluate(sequence)
+        self.requests.append({"prompt": body.get("prompt", ""), "prompt_tokens": len(sequence),
+                              "prompt_eval_count": evaluated})
+        prefill = evaluated * self.prefill_ms_per_token / 1000
+        await asyncio.sleep(prefill)
+
+        text = STUB_STRUCTURED_RESPONSE if body.get("format") == "json" else STUB_RESPONSE
+        words = text.split(" ")[:options.get("num_predict") or None]
+        text = " ".join(words)
+        response_tokens = self.tokenize(text)
+        return web.json_response({
+            "model": body.get("model"),
+            "response": text,
+            "done": True,
+            "context": sequence + response_tokens,
+            "prompt_eval_count": evaluated,
+            "prompt_eval_duration": int(prefill * 1e9),
+            "eval_count": len(response_tokens),
+            "eval_duration": 0,
+        })
+
+    def start(self):
+        """Serve on a free local port from a background thread; returns the base URL."""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        ready = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            app = web.Application()
+            app.router.add_post("/api/generate", self._generate)
+            self._runner = web.AppRunner(app)
+            self._loop.run_until_complete(self._runner.setup())
+            self._loop.run_until_complete(web.TCPSite(self._runner, "127.0.0.1", port).start())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        ready.wait(10)
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(10)
+            self._loop = None
+
+    def reset(self):
+        """Forget cached slots and recorded requests."""
+        self.slots = [[] for _ in self.slots]
+        self.requests = []
+
+    def stats(self):
+        requests = self.requests
+        evaluated = [entry["prompt_eval_count"] for entry in requests]
+        prompt = [entry["prompt_tokens"] for entry in requests]
+        return {
+            "requests": len(requests),
+            "prompt_tokens": sum(prompt),
+            "prompt_eval_tokens": sum(evaluated),
+            "mean_prompt_eval_tokens": round(sum(evaluated) / len(evaluated), 1) if evaluated else None,
+        }
@@ -0,0 +1,49 @@
+import random
+from interaction_index import SEED_LEXICON
+
+CONDITIONS = [
+    "hypertension", "type 2 diabetes", "asthma", "chronic kidney disease", "heart failure",
+    "atrial fibrillation", "epilepsy", "peptic ulcer", "hypothyroidism", "liver cirrhosis",
+    "depression", "gout", "pregnancy", "glaucoma", "benign prostatic hyperplasia",
+]
+
+ALLERGENS = ["penicillin", "sulfonamides", "aspirin", "iodine contrast", "codeine", "latex"]
+REACTIONS = ["rash", "hives", "swelling", "anaphylaxis", "wheezing", ""]
+DOSAGES = ["5 mg", "10 mg", "25 mg", "50 mg", "250 mg", "500 mg", "1 g"]
+
+
+def _meds(rng, drugs, count):
+    meds = []
+    for name in rng.sample(drugs, count):
+        # Brand names exercise alias resolution as real forms would
+        brands = SEED_LEXICON[name]
+        if brands and rng.random() < 0.3:
+            name = rng.choice(brands)
+        meds.append({"name": name.title(), "dosage": rng.choice(DOSAGES)})
+    return meds
+
+
+def synthetic_profiles(count, seed=0):
+    """Return ``count`` reproducible patient profiles in analyze_interactions' keyword form."""
+    rng = random.Random(seed)
+    drugs = sorted(SEED_LEXICON)
+    profiles = []
+    for i in range(count):
+        allergy_count = rng.randint(0, 2)
+        profiles.append({
+            "id": f"synthetic-{i}",
+            "current_meds": _meds(rng, drugs, rng.randint(1, 4)),
+            "allergies": [
+                {"name": name, "reaction": rng.choice(REACTIONS)}
+                for name in rng.sample(ALLERGENS, allergy_count)
+            ],
+            "conditions": rng.sample(CONDITIONS, rng.randint(0, 3)),
+            "new_meds": _meds(rng, drugs, rng.randint(1, 2)),
+            "patient_info": {
+                "age": str(rng.randint(18, 90)),
+                "gender": rng.choice(["Male", "Female"]),
+                "bp": f"{rng.randint(100, 170)}/{rng.randint(60, 100)}",
+            },
+            "additional_info": "",
+        })
+    return profiles
@@ -0,0 +1,447 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from app import MedicalInteractionApp, process_memory_mb
+from benchmarks.import_time import measure_import
+from benchmarks.mock_ollama import MockOllamaServer
+from benchmarks.profiles import synthetic_profiles
+from benchmarks.stub_llm import StubLLM
+from ollama_pool import OllamaEndpointPool
+from structured_output import OUTPUT_FORMATS
+from tokens import count_tokens
+from tracing import percentile
+
+
+def _seconds(values):
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 2) if values else None,
+        "p99_ms": round(percentile(values, 99) * 1000, 2) if values else None,
+        "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _peak_rss_mb():
+    # Children covers the PDF parsing worker processes
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {"self": process_memory_mb()[1], "children": round(children, 1)}
+
+
+class BenchmarkSuite:
+    """Times ingestion, retrieval and analysis against a throwaway vector store.
+
+    The LLM is a ``StubLLM``, so generation costs only what it is told to
+    simulate and nothing needs a running Ollama server. With
+    ``fake_embeddings`` the embedding model is replaced as well, which
+    isolates parsing, storage and retrieval overhead.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.persist_dir = args.persist_dir or tempfile.mkdtemp(prefix="medinteract-bench-")
+        self.profiles = synthetic_profiles(args.profiles, seed=args.seed)
+
+    def _make_app(self):
+        embeddings = None
+        if self.args.fake_embeddings:
+            from langchain_community.embeddings import DeterministicFakeEmbedding
+            embeddings = DeterministicFakeEmbedding(size=768)
+        llm = StubLLM(
+            prefill_ms_per_1k_tokens=self.args.prefill_ms_per_1k_tokens,
+            decode_ms_per_token=self.args.decode_ms_per_token,
+            response_words=self.args.response_words,
+        )
+        return MedicalInteractionApp(
+            model_name="stub",
+            data_dir=self.args.data_dir,
+            chunk_size=self.args.chunk_size,
+            chunk_overlap=self.args.chunk_overlap,
+            splitter=self.args.splitter,
+            persist_dir=self.persist_dir,
+            embedding_model=self.args.embedding_model,
+            embedding_backend=self.args.embedding_backend,
+            onnx_model_dir=self.args.onnx_dir,
+            vector_store=self.args.vector_store,
+            embedding_batch_size=self.args.embedding_batch_size,
+            retrieval_k_per_lookup=self.args.k_per_lookup,
+            per_endpoint_concurrency=self.args.llm_slots,
+            embeddings=embeddings,
+            llm=llm,
+        )
+
+    def _initialize(self, app):
+        start = time.perf_counter()
+        success, message = app.initialize()
+        if not success:
+            raise RuntimeError(message)
+        return round(time.perf_counter() - start, 3)
+
+    def cold_init(self):
+        """Ingest the corpus into an empty store."""
+        shutil.rmtree(self.persist_dir, ignore_errors=True)
+        app = self._make_app()
+        seconds = self._initialize(app)
+        stats = app.model.embedding_stats
+        return {
+            "seconds": seconds,
+            "chunks": stats.get("chunks"),
+            "chunks_per_second": stats.get("chunks_per_second"),
+            "embedding": stats,
+        }
+
+    def warm_init(self):
+        """Reopen the store built by ``cold_init``; nothing should be re-embedded."""
+        app = self._make_app()
+        seconds = self._initialize(app)
+        return app, {"seconds": seconds, "chunks_embedded": app.model.embedding_stats.get("chunks", 0)}
+
+    def retrieval(self, app):
+        """Per-profile retrieval latency with an empty lookup cache."""
+        retriever = app.model.retriever
+        retriever.clear_cache()
+        latencies = []
+        chunks = 0
+        start = time.perf_counter()
+        for profile in self.profiles:
+            lookup_start = time.perf_counter()
+            docs = retriever.retrieve(
+                profile["current_meds"], profile["allergies"], profile["conditions"], profile["new_meds"]
+            )
+            latencies.append(time.perf_counter() - lookup_start)
+            chunks += len(docs)
+        elapsed = time.perf_counter() - start
+        return dict(
+            queries=len(latencies),
+            qps=round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+            mean_chunks=round(chunks / len(latencies), 2) if latencies else None,
+            **_seconds(latencies),
+        )
+
+    def prefetched_retrieval(self, app):
+        """Retrieval latency left after the click when the form's entries were prefetched.
+
+        Entries are added one at a time as in the form, and each prefetch is
+        allowed to finish (the user is still typing) before the timed retrieve.
+        """
+        retriever = app.model.retriever
+        retriever.clear_cache()
+        latencies = []
+        for profile in self.profiles:
+            session = app.create_session()
+            entries = {"current_meds": [], "allergies": [], "conditions": [], "new_meds": []}
+            for field in entries:
+                for entry in profile[field]:
+                    entries[field].append(entry)
+                    app.prefetch(session, entries["current_meds"], entries["allergies"],
+                                 entries["conditions"], entries["new_meds"])
+            for future in list(session.futures.values()):
+                future.result()
+            start = time.perf_counter()
+            retriever.retrieve(profile["current_meds"], profile["allergies"], profile["conditions"],
+                               profile["new_meds"], session=session)
+            latencies.append(time.perf_counter() - start)
+        return dict(queries=len(latencies), **_seconds(latencies))
+
+    def end_to_end(self, app):
+        """analyze_interactions throughput with ``concurrency`` requests in flight."""
+        app.model.answer_cache.invalidate()
+        app.model.retriever.clear_cache()
+
+        def analyze(profile):
+            start = time.perf_counter()
+            result = app.analyze_interactions(
+                profile["current_meds"], profile["allergies"], profile["conditions"],
+                profile["new_meds"], profile["patient_info"], profile["additional_info"],
+                output_format=self.args.output_format,
+            )
+            return result, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            results = list(pool.map(analyze, self.profiles))
+        elapsed = time.perf_counter() - start
+
+        latencies = [latency for result, latency in results if "error" not in result]
+        stage_ms = defaultdict(list)
+        decode_tokens = []
+        tiers = defaultdict(int)
+        for result, _ in results:
+            for span in result.get("timings", {}).get("spans", []):
+                stage_ms[span["name"]].append(span["ms"])
+                if span["name"] == "llm_decode":
+                    decode_tokens.append(span.get("tokens", 0))
+            if "route" in result:
+                tiers[result["route"]["tier"]] += 1
+        return dict(
+            requests=len(results),
+            errors=len(results) - len(latencies),
+            concurrency=self.args.concurrency,
+            requests_per_second=round(len(results) / elapsed, 2) if elapsed > 0 else None,
+            **_seconds(latencies),
+            stage_mean_ms={
+                name: round(sum(values) / len(values), 2) for name, values in sorted(stage_ms.items())
+            },
+            output_format=self.args.output_format,
+            mean_decode_tokens=round(sum(decode_tokens) / len(decode_tokens), 1) if decode_tokens else None,
+            tiers=dict(tiers),
+        )
+
+    def mixed_load(self, app):
+        """Interactive latency while ``batch_load`` threads keep batch-priority requests queued.
+
+        Every request carries distinct ``additional_info`` so nothing is
+        answered from the cache or coalesced; only the scheduler's priority
+        ordering separates the two classes.
+        """
+        app.model.answer_cache.invalidate()
+        stop = threading.Event()
+        batch_latencies = []
+
+        def batch_worker(worker):
+            i = worker
+            while not stop.is_set():
+                profile = self.profiles[i % len(self.profiles)]
+                start = time.perf_counter()
+                app.analyze_interactions(
+                    profile["current_meds"], profile["allergies"], profile["conditions"],
+                    profile["new_meds"], profile["patient_info"], f"batch request {i}", priority="batch",
+                )
+                batch_latencies.append(time.perf_counter() - start)
+                i += self.args.batch_load
+
+        def interactive(indexed):
+            i, profile = indexed
+            start = time.perf_counter()
+            result = app.analyze_interactions(
+                profile["current_meds"], profile["allergies"], profile["conditions"],
+                profile["new_meds"], profile["patient_info"], f"interactive request {i}",
+            )
+            return result, time.perf_counter() - start
+
+        workers = [threading.Thread(target=batch_worker, args=(i,), daemon=True) for i in range(self.args.batch_load)]
+        for worker in workers:
+            worker.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+                results = list(pool.map(interactive, enumerate(self.profiles)))
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+        latencies = [latency for result, latency in results if "error" not in result]
+        scheduler = app.model.scheduler.stats()
+        return dict(
+            interactive=dict(requests=len(results), errors=len(results) - len(latencies), **_seconds(latencies)),
+            batch=dict(requests=len(batch_latencies), threads=self.args.batch_load, **_seconds(batch_latencies)),
+            llm_slots=self.args.llm_slots,
+            queue_wait_ms=scheduler["wait_ms"],
+        )
+
+    def prefix_reuse(self, app):
+        """Prompt tokens Ollama evaluates per request on the async path, against ``MockOllamaServer``.
+
+        Two passes over the profiles: the server re-evaluates every prompt
+        ("no_cache"), or it reuses the longest start of the prompt it has
+        already evaluated ("prompt_cache"), which the fixed prefix makes
+        common to every request. A last pass runs the profiles in every output
+        format and fails unless each format's prompts start with the same bytes,
+        its fixed prefix.
+        """
+        server = MockOllamaServer(slots=self.args.llm_slots)
+        server.start()
+        model = app.model
+        original_pool = model.ollama_pool
+        passes = {}
+
+        async def analyze_all(output_format):
+            for profile in self.profiles:
+                await model.aanalyze_interactions(
+                    profile["current_meds"], profile["allergies"], profile["conditions"],
+                    profile["new_meds"], profile["patient_info"], output_format=output_format,
+                )
+            await model.ollama_pool.aclose()
+
+        def run_pass(prompt_cache, output_format):
+            server.reset()
+            server.prompt_cache = prompt_cache
+            model.answer_cache.invalidate()
+            model.ollama_pool = OllamaEndpointPool(
+                [server.url], model.model_name, per_endpoint_concurrency=self.args.llm_slots
+            )
+            asyncio.run(analyze_all(output_format))
+
+        shared_prefix_bytes = {}
+        try:
+            for name, prompt_cache in (("no_cache", False), ("prompt_cache", True)):
+                run_pass(prompt_cache, self.args.output_format)
+                passes[name] = server.stats()
+            for output_format in OUTPUT_FORMATS:
+                run_pass(True, output_format)
+                prompts = [entry["prompt"].encode("utf-8") for entry in server.requests]
+                prefix = model.prompt_prefixes[output_format].encode("utf-8")
+                shared = os.path.commonprefix(prompts) if prompts else b""
+                if not shared.startswith(prefix):
+                    raise RuntimeError(
+                        f"{output_format} prompts share only {len(shared)} leading bytes, "
+                        f"not the {len(prefix)}-byte fixed prefix"
+                    )
+                shared_prefix_bytes[output_format] = len(shared)
+        finally:
+            model.ollama_pool = original_pool
+            server.stop()
+
+        baseline = passes["no_cache"]["prompt_eval_tokens"]
+        for stats in passes.values():
+            saved = baseline - stats["prompt_eval_tokens"]
+            stats["prefill_tokens_saved"] = saved
+            stats["saved_pct"] = round(saved / baseline * 100, 1) if baseline else None
+        return dict(passes, prefix_tokens=count_tokens(model.prompt_prefixes[self.args.output_format]),
+                    shared_prefix_bytes=shared_prefix_bytes)
+
+    def run(self):
+        """Run every phase and return the report."""
+        print("Import time...")
+        import_time = measure_import()
+        try:
+            print("Cold initialize...")
+            cold = self.cold_init()
+            print("Warm initialize...")
+            app, warm = self.warm_init()
+            print(f"Retrieval over {len(self.profiles)} profiles...")
+            retrieval = self.retrieval(app)
+            print("Prefetched retrieval...")
+            prefetched = self.prefetched_retrieval(app)
+            print("End-to-end analysis...")
+            end_to_end = self.end_to_end(app)
+            mixed = None
+            if self.args.batch_load:
+                print(f"Interactive analysis under {self.args.batch_load} batch threads...")
+                mixed = self.mixed_load(app)
+            prefix = None
+            if self.args.mock_ollama:
+                print("Prompt prefix reuse against a mock Ollama server...")
+                prefix = self.prefix_reuse(app)
+        finally:
+            if not self.args.persist_dir:
+                shutil.rmtree(self.persist_dir, ignore_errors=True)
+
+        config = {
+            key: value for key, value in vars(self.args).items()
+            if key not in ("output", "baseline", "persist_dir")
+        }
+        return {
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "git_commit": _git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "config": config,
+            "results": {
+                "import": import_time,
+                "cold_init": cold,
+                "warm_init": warm,
+                "retrieval": retrieval,
+                "prefetched_retrieval": prefetched,
+                "end_to_end": end_to_end,
+                "mixed_load": mixed,
+                "prefix_reuse": prefix,
+                "peak_rss_mb": _peak_rss_mb(),
+            },
+        }
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(report, baseline):
+    """Print every numeric result next to the baseline run's value."""
+    current = _flatten(report["results"])
+    previous = _flatten(baseline["results"])
+    print(f"{'metric':<45} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name in sorted(current):
+        if name not in previous:
+            continue
+        before, after = previous[name], current[name]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{name:<45} {before:>12g} {after:>12g} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, retrieval and analysis offline.")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the report to")
+    parser.add_argument("--baseline", help="Earlier report to compare this run against")
+    parser.add_argument("--data-dir", default="data", help="Directory with the reference PDFs")
+    parser.add_argument("--persist-dir", help="Keep the benchmark store here instead of a temporary directory")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--splitter", default="recursive", choices=["recursive", "monograph"],
+                        help="Fixed-size overlapping windows or section-aligned monograph chunks")
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--k-per-lookup", type=int, default=2, help="Chunks retrieved per drug/pair lookup")
+    parser.add_argument("--embedding-model", default="pritamdeka/S-PubMedBert-MS-MARCO")
+    parser.add_argument("--embedding-backend", default="huggingface", choices=["huggingface", "onnx"])
+    parser.add_argument("--onnx-dir", help="Exported ONNX model directory for --embedding-backend onnx")
+    parser.add_argument("--vector-store", default="chroma", choices=["chroma", "compact"])
+    parser.add_argument("--embedding-batch-size", type=int, default=64)
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="Use deterministic fake embeddings instead of the embedding model")
+    parser.add_argument("--profiles", type=int, default=50, help="Number of synthetic patient profiles")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic profiles")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent end-to-end requests")
+    parser.add_argument("--output-format", default="prose", choices=["prose", "structured"],
+                        help="Answer format requested in the end-to-end phase")
+    parser.add_argument("--response-words", type=int, default=0,
+                        help="Pad the stub's prose answers to this many words (a verbose model)")
+    parser.add_argument("--llm-slots", type=int, default=4, help="Generations the scheduler runs at once")
+    parser.add_argument("--batch-load", type=int, default=0,
+                        help="Batch-priority threads running alongside a second interactive pass (0 skips it)")
+    parser.add_argument("--mock-ollama", action="store_true",
+                        help="Measure prompt prefix reuse against a local mock Ollama server")
+    parser.add_argument("--prefill-ms-per-1k-tokens", type=float, default=0.0,
+                        help="Simulated LLM prefill time per 1000 prompt tokens")
+    parser.add_argument("--decode-ms-per-token", type=float, default=0.0,
+                        help="Simulated LLM decode time per generated token")
+    args = parser.parse_args()
+
+    report = BenchmarkSuite(args).run()
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["results"], indent=2))
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import time
+from typing import Any, Iterator, List, Optional
+from langchain_community.llms.fake import FakeListLLM
+from langchain_core.outputs import Generation, GenerationChunk, LLMResult
+from tokens import count_tokens
+
+STUB_RESPONSE = (
+    "Taking these medicines together may raise the risk of side effects, so the "
+    "combination is worth discussing with a pharmacist. Some of the listed conditions "
+    "can also change how these drugs are handled by the body. I am NOT a doctor and "
+    "this analysis is for informational purposes only."
+)
+STUB_STRUCTURED_RESPONSE = (
+    '{"summary": "One combination may raise the risk of side effects and is worth discussing with a '
+    'pharmacist.", "interactions": [{"items": ["first drug", "second drug"], "type": "drug-drug", '
+    '"severity": "moderate", "note": "May raise the risk of side effects."}]}'
+)
+
+
+class StubLLM(FakeListLLM):
+    """Stand-in for Ollama that answers instantly or with a simulated latency.
+
+    Prefill time scales with the prompt's token count and decode time with
+    the number of response words, and the generation info carries the same
+    prompt_eval/eval fields Ollama reports, so tracing spans look realistic.
+    """
+
+    responses: List[str] = [STUB_RESPONSE]
+    prefill_ms_per_1k_tokens: float = 0.0
+    decode_ms_per_token: float = 0.0
+    # Pad prose answers to this many words, as a verbose model would; the
+    # num_predict passed per call (the routed token budget) cuts them off
+    response_words: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _timings(self, prompt, response):
+        prompt_tokens = count_tokens(prompt)
+        response_tokens = len(response.split())
+        prefill = prompt_tokens / 1000 * self.prefill_ms_per_1k_tokens / 1000
+        decode = response_tokens * self.decode_ms_per_token / 1000
+        return prompt_tokens, response_tokens, prefill, decode
+
+    def _next_response(self, **kwargs):
+        if kwargs.get("format") == "json":
+            return STUB_STRUCTURED_RESPONSE
+        response = self.responses[self.i % len(self.responses)]
+        self.i += 1
+        words = response.split(" ")
+        if self.response_words > len(words):
+            words = (words * (self.response_words // len(words) + 1))[:self.response_words]
+        if kwargs.get("num_predict"):
+            words = words[:kwargs["num_predict"]]
+        return " ".join(words)
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> LLMResult:
+        generations = []
+        for prompt in prompts:
+            response = self._next_response(**kwargs)
+            prompt_tokens, response_tokens, prefill, decode = self._timings(prompt, response)
+            time.sleep(prefill + decode)
+            generations.append([Generation(text=response, generation_info={
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prefill * 1e9),
+                "eval_count": response_tokens,
+                "eval_duration": int(decode * 1e9),
+            })])
+        return LLMResult(generations=generations)
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        response = self._next_response(**kwargs)
+        _, _, prefill, _ = self._timings(prompt, response)
+        time.sleep(prefill)
+        for i, word in enumerate(response.split(" ")):
+            time.sleep(self.decode_ms_per_token / 1000)
+            yield GenerationChunk(text=word if i == 0 else " " + word)
@@ -0,0 +1,120 @@
+import json
+import time
+import httpx
+
+
+class MedicalInteractionClient:
+    """Thin HTTP client for server.py with the same interface as MedicalInteractionApp.
+
+    The Streamlit UI (set MEDINTERACT_API_URL) and other integrations can use
+    it in place of an in-process engine. Requests rejected with 429/503 by
+    the server's backpressure are retried after the Retry-After delay.
+    """
+
+    def __init__(self, base_url="http://localhost:8000", timeout=300.0, retries=3):
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self._client = httpx.Client(base_url=self.base_url, timeout=httpx.Timeout(timeout, connect=5.0))
+
+    def _post(self, path, payload, stream=False, params=None):
+        for attempt in range(self.retries + 1):
+            request = self._client.build_request("POST", path, json=payload, params=params)
+            response = self._client.send(request, stream=stream)
+            if response.status_code not in (429, 503) or attempt == self.retries:
+                return response
+            response.close()
+            time.sleep(float(response.headers.get("Retry-After", 1)))
+        return response
+
+    @staticmethod
+    def _profile(current_meds, allergies, conditions, new_meds, patient_info, additional_info):
+        return {
+            "current_meds": current_meds, "allergies": allergies, "conditions": conditions,
+            "new_meds": new_meds, "patient_info": patient_info, "additional_info": additional_info,
+        }
+
+    @staticmethod
+    def _error_message(response):
+        try:
+            return response.json().get("error", response.text)
+        except ValueError:
+            return f"HTTP {response.status_code}: {response.text[:200]}"
+
+    def status(self):
+        """Readiness of the server as {"state", "message", ...}."""
+        try:
+            return self._client.get("/ready").json()
+        except (httpx.HTTPError, ValueError) as e:
+            return {"state": "failed", "message": f"Server unreachable: {str(e)}", "init_seconds": None}
+
+    @property
+    def is_initialized(self):
+        return self.status()["state"] == "ready"
+
+    def start_warmup(self):
+        """The server warms itself up; nothing to do on the client."""
+
+    def initialize(self, timeout=600.0):
+        """Wait until the server is ready; returns (success, message) like the engine."""
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.status()
+            if status["state"] == "ready":
+                return True, "System initialized successfully!"
+            if status["state"] == "failed" or time.monotonic() > deadline:
+                return False, status["message"]
+            time.sleep(1)
+
+    def create_session(self):
+        """The server retrieves on demand; prefetch sessions are in-process only."""
+        return None
+
+    def prefetch(self, session, current_meds, allergies, conditions, new_meds):
+        return {"started": 0, "cancelled": 0}
+
+    def analyze_interactions(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info="",
+                             session=None, priority="interactive", output_format="prose"):
+        """Analyze potential drug interactions on the server."""
+        try:
+            response = self._post("/analyze", self._profile(
+                current_meds, allergies, conditions, new_meds, patient_info, additional_info
+            ), params={"priority": priority, "format": output_format})
+        except httpx.HTTPError as e:
+            return {"error": f"Error contacting the analysis server: {str(e)}"}
+        if response.status_code != 200:
+            return {"error": self._error_message(response)}
+        return response.json()
+
+    def stream_analysis(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info="",
+                        session=None, priority="interactive"):
+        """Yield the server's streamed analysis events; see MedicalInteractionModel.stream_analysis."""
+        try:
+            response = self._post("/analyze/stream", self._profile(
+                current_meds, allergies, conditions, new_meds, patient_info, additional_info
+            ), stream=True, params={"priority": priority})
+            try:
+                if response.status_code != 200:
+                    response.read()
+                    yield {"type": "error", "error": self._error_message(response)}
+                    return
+                for line in response.iter_lines():
+                    if line:
+                        yield json.loads(line)
+            finally:
+                response.close()
+        except httpx.HTTPError as e:
+            yield {"type": "error", "error": f"Error contacting the analysis server: {str(e)}"}
+
+    def stats(self):
+        """Engine statistics of whichever worker answers."""
+        try:
+            return self._client.get("/stats").json()
+        except (httpx.HTTPError, ValueError):
+            status = self.status()
+            return {"initialized": False, "state": status["state"], "init_seconds": None,
+                    "init_memory_mb": None, "rss_mb": None, "peak_rss_mb": None,
+                    "embedding": {}, "answer_cache": None, "embedding_cache": None,
+                    "index_snapshot": None, "scheduler": None}
+
+    def close(self):
+        self._client.close()
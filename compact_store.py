@@ -0,0 +1,269 @@
+import argparse
+import json
+import mmap
+import os
+import shutil
+import numpy as np
+from langchain_core.documents import Document
+from manifest import corpus_fingerprint
+
+META_FILE = "meta.json"
+
+
+def _kmeans(data, clusters, iterations=20, seed=0):
+    """Plain Lloyd's k-means; returns (clusters, dim) float32 centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (
+            (data ** 2).sum(axis=1, keepdims=True)
+            - 2 * data @ centroids.T
+            + (centroids ** 2).sum(axis=1)
+        )
+        assignment = distances.argmin(axis=1)
+        for c in range(clusters):
+            members = data[assignment == c]
+            # Re-seed empty clusters so every code stays in use
+            centroids[c] = members.mean(axis=0) if len(members) else data[rng.integers(len(data))]
+    return centroids.astype(np.float32)
+
+
+class ProductQuantizer:
+    """Splits vectors into ``subvectors`` slices and codes each slice as one byte."""
+
+    def __init__(self, codebooks):
+        self.codebooks = codebooks  # (subvectors, codes, slice_dim)
+
+    @classmethod
+    def train(cls, vectors, subvectors, codes=256, sample=20000, seed=0):
+        dim = vectors.shape[1]
+        if dim % subvectors:
+            raise ValueError(f"Vector size {dim} is not divisible into {subvectors} subvectors")
+        rng = np.random.default_rng(seed)
+        if len(vectors) > sample:
+            vectors = vectors[rng.choice(len(vectors), sample, replace=False)]
+        codes = min(codes, len(vectors))
+        slices = vectors.reshape(len(vectors), subvectors, -1)
+        return cls(np.stack([_kmeans(slices[:, j], codes, seed=seed) for j in range(subvectors)]))
+
+    def encode(self, vectors, batch_size=4096):
+        codes = np.empty((len(vectors), len(self.codebooks)), dtype=np.uint8)
+        for start in range(0, len(vectors), batch_size):
+            slices = vectors[start:start + batch_size].reshape(-1, len(self.codebooks), self.codebooks.shape[2])
+            for j, codebook in enumerate(self.codebooks):
+                distances = ((slices[:, j, None, :] - codebook[None]) ** 2).sum(axis=2)
+                codes[start:start + batch_size, j] = distances.argmin(axis=1)
+        return codes
+
+    def distances(self, query, codes):
+        """Approximate squared L2 distance from ``query`` to every coded vector (ADC)."""
+        slices = query.reshape(len(self.codebooks), 1, -1)
+        tables = ((slices - self.codebooks) ** 2).sum(axis=2)  # (subvectors, codes)
+        return tables[np.arange(len(self.codebooks)), codes].sum(axis=1)
+
+
+class CompactVectorStore:
+    """Read-only, memory-mapped copy of the vector store for serving.
+
+    Vectors are kept as float16 and, in "pq" mode, also as product-quantized
+    codes (one byte per subvector). A query scores every chunk from the PQ
+    codes, then re-ranks the best ``rerank_candidates`` exactly against the
+    float16 vectors; "f16" mode scores the float16 vectors directly. Every
+    array and the chunk texts are opened with mmap, so worker processes on
+    one machine share a single page-cached copy instead of each loading the
+    HNSW index. Distances are L2, matching the Chroma collection it is built from.
+
+    Implements the subset of the vector store API that ``EntityRetriever`` uses.
+    """
+
+    def __init__(self, directory, embeddings, rerank_candidates=100):
+        self.directory = directory
+        self.embeddings = embeddings
+        self.rerank_candidates = rerank_candidates
+        with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, "ids.json"), "r", encoding="utf-8") as f:
+            self.ids = json.load(f)
+        self.positions = {cid: i for i, cid in enumerate(self.ids)}
+        self.fingerprint = self.meta["fingerprint"]
+        self.mode = self.meta["mode"]
+
+        self.vectors = np.load(os.path.join(directory, "vectors_f16.npy"), mmap_mode="r")
+        self.doc_offsets = np.load(os.path.join(directory, "doc_offsets.npy"), mmap_mode="r")
+        self.quantizer = None
+        if self.mode == "pq":
+            self.codes = np.load(os.path.join(directory, "pq_codes.npy"), mmap_mode="r")
+            self.quantizer = ProductQuantizer(np.load(os.path.join(directory, "pq_codebooks.npy")))
+        self._docs_file = open(os.path.join(directory, "documents.jsonl"), "rb")
+        self._docs = mmap.mmap(self._docs_file.fileno(), 0, access=mmap.ACCESS_READ) if self.ids else b""
+
+    @classmethod
+    def load(cls, directory, embeddings, rerank_candidates=100):
+        """Open a built store, or return None if there is none."""
+        if not os.path.exists(os.path.join(directory, META_FILE)):
+            return None
+        return cls(directory, embeddings, rerank_candidates)
+
+    @staticmethod
+    def build(vectorstore, directory, mode="pq", subvectors=None, batch_size=1000):
+        """Export every chunk of a Chroma store into a compact store at ``directory``.
+
+        The new files are written next to the old ones and swapped in with a
+        rename, so processes that still have the old store mapped keep working.
+        """
+        if mode not in ("pq", "f16"):
+            raise ValueError(f"Unknown compact store mode: {mode}")
+        tmp_dir = directory + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        ids, vectors, offsets = [], [], [0]
+        with open(os.path.join(tmp_dir, "documents.jsonl"), "wb") as docs:
+            total = vectorstore._collection.count()
+            for offset in range(0, total, batch_size):
+                stored = vectorstore.get(
+                    limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"]
+                )
+                for cid, vector, text, metadata in zip(
+                    stored["ids"], stored["embeddings"], stored["documents"], stored["metadatas"]
+                ):
+                    ids.append(cid)
+                    vectors.append(np.asarray(vector, dtype=np.float32))
+                    docs.write(json.dumps({"text": text, "metadata": metadata or {}}).encode("utf-8") + b"\n")
+                    offsets.append(docs.tell())
+
+        matrix = np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        np.save(os.path.join(tmp_dir, "vectors_f16.npy"), matrix.astype(np.float16))
+        np.save(os.path.join(tmp_dir, "doc_offsets.npy"), np.array(offsets, dtype=np.int64))
+        if mode == "pq" and len(matrix):
+            dim = matrix.shape[1]
+            subvectors = subvectors or next(m for m in (dim // 8, dim // 4, dim // 2, dim) if m and dim % m == 0)
+            quantizer = ProductQuantizer.train(matrix, subvectors)
+            np.save(os.path.join(tmp_dir, "pq_codebooks.npy"), quantizer.codebooks)
+            np.save(os.path.join(tmp_dir, "pq_codes.npy"), quantizer.encode(matrix))
+        elif mode == "pq":
+            mode = "f16"
+        with open(os.path.join(tmp_dir, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump(ids, f)
+        with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "mode": mode,
+                "count": len(ids),
+                "dim": int(matrix.shape[1]) if len(matrix) else 0,
+                "fingerprint": corpus_fingerprint(ids),
+            }, f)
+
+        old_dir = directory + ".old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(directory):
+            os.replace(directory, old_dir)
+        os.replace(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        print(f"Built compact vector store ({mode}) with {len(ids)} chunks in {directory}")
+
+    def _document(self, position):
+        record = json.loads(self._docs[self.doc_offsets[position]:self.doc_offsets[position + 1]])
+        return Document(page_content=record["text"], metadata=record["metadata"])
+
+    def _exact_distances(self, query, positions):
+        candidates = np.asarray(self.vectors[positions], dtype=np.float32)
+        return ((candidates - query) ** 2).sum(axis=1)
+
+    def search_positions(self, vector, k):
+        """Return the positions of the ``k`` nearest chunks, nearest first."""
+        if not self.ids:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        if self.quantizer is not None:
+            approximate = self.quantizer.distances(query, self.codes)
+            shortlist = min(len(self.ids), max(k, self.rerank_candidates))
+            candidates = np.argpartition(approximate, shortlist - 1)[:shortlist]
+        else:
+            candidates = np.arange(len(self.ids))
+        distances = self._exact_distances(query, np.sort(candidates))
+        order = np.argsort(distances, kind="stable")[:k]
+        return np.sort(candidates)[order].tolist()
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        return [self._document(position) for position in self.search_positions(embedding, k)]
+
+    def similarity_search(self, query, k=4):
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k)
+
+    def get(self, ids):
+        """Fetch chunks by ID in the same shape as ``Chroma.get``."""
+        found = {"ids": [], "documents": [], "metadatas": []}
+        for cid in ids:
+            position = self.positions.get(cid)
+            if position is None:
+                continue
+            doc = self._document(position)
+            found["ids"].append(cid)
+            found["documents"].append(doc.page_content)
+            found["metadatas"].append(doc.metadata)
+        return found
+
+    def close(self):
+        """Unmap the chunk texts; the numpy arrays are released with the object."""
+        if self.ids:
+            self._docs.close()
+        self._docs_file.close()
+
+    def size_on_disk(self):
+        """Bytes per component, for comparison with float32 storage."""
+        sizes = {name: os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory)}
+        sizes["float32_equivalent"] = self.meta["count"] * self.meta["dim"] * 4
+        return sizes
+
+
+def evaluate(vectorstore, store, queries=200, k=10, seed=0):
+    """Recall@k of the compact store against exact float32 search.
+
+    Queries are stored chunk vectors; each query's own chunk is excluded
+    from both result lists.
+    """
+    stored = vectorstore.get(include=["embeddings"])
+    exact = np.asarray(stored["embeddings"], dtype=np.float32)
+    order = [store.positions[cid] for cid in stored["ids"]]
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(exact), min(queries, len(exact)), replace=False)
+
+    recalls = []
+    for index in sample:
+        query = exact[index]
+        truth = np.argsort(((exact - query) ** 2).sum(axis=1))[1:k + 1]
+        truth = {order[i] for i in truth}
+        found = [p for p in store.search_positions(query, k + 1) if p != order[index]][:k]
+        recalls.append(len(truth & set(found)) / k)
+    return {"queries": len(sample), f"recall_at_{k}": round(float(np.mean(recalls)), 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or evaluate the compact memory-mapped vector store.")
+    parser.add_argument("command", choices=["build", "evaluate"])
+    parser.add_argument("--persist-dir", default="chroma_db", help="Chroma directory to export from")
+    parser.add_argument("--mode", default="pq", choices=["pq", "f16"])
+    parser.add_argument("--subvectors", type=int, help="PQ subvectors (default: vector size / 8)")
+    parser.add_argument("--rerank-candidates", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    from langchain_community.vectorstores import Chroma
+
+    vectorstore = Chroma(persist_directory=args.persist_dir)
+    directory = os.path.join(args.persist_dir, "compact_store")
+    if args.command == "build":
+        CompactVectorStore.build(vectorstore, directory, mode=args.mode, subvectors=args.subvectors)
+        return
+
+    store = CompactVectorStore.load(directory, None, rerank_candidates=args.rerank_candidates)
+    if store is None:
+        raise SystemExit(f"No compact store in {directory}; run the build command first")
+    report = dict(evaluate(vectorstore, store, queries=args.queries, k=args.k),
+                  mode=store.mode, rerank_candidates=args.rerank_candidates, bytes=store.size_on_disk())
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
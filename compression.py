@@ -0,0 +1,90 @@
+import re
+from langchain.docstore.document import Document
+from tokens import count_tokens
+
+# Sentence ends at ., ! or ? followed by whitespace, or at a blank line
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+
+def _normalize(text):
+    return " ".join(text.split()).lower()
+
+
+def split_sentences(text):
+    """Split chunk text into sentences, rejoining words hyphenated across line breaks."""
+    text = re.sub(r"-\n(?=[a-z])", "", text)
+    return [" ".join(s.split()) for s in SENTENCE_RE.split(text) if s and s.strip()]
+
+
+def entity_terms(entities):
+    """Lower-cased match terms for the extracted entities: full names and their longer words."""
+    terms = set()
+    for names in entities.values():
+        for name in names:
+            terms.add(name)
+            terms.update(word for word in re.findall(r"[a-z0-9\-]+", name) if len(word) >= 4)
+    return terms
+
+
+class ContextCompressor:
+    """Shrinks retrieved chunks to the sentences that matter before prompting.
+
+    Keeps sentences that mention a query entity (plus ``neighbor_sentences``
+    on either side for context), drops sentences already seen in an earlier
+    chunk (chunks overlap by ``chunk_overlap`` characters), and stops adding
+    text once ``token_budget`` tokens are used. Chunks with no matching
+    sentence are dropped, unless no chunk matches at all.
+    """
+
+    def __init__(self, token_budget=900, neighbor_sentences=1):
+        self.token_budget = token_budget
+        self.neighbor_sentences = neighbor_sentences
+
+    def _select(self, sentences, terms):
+        if not terms:
+            return list(range(len(sentences)))
+        hits = [i for i, s in enumerate(sentences) if any(term in s.lower() for term in terms)]
+        keep = set()
+        for i in hits:
+            keep.update(range(max(0, i - self.neighbor_sentences),
+                              min(len(sentences), i + self.neighbor_sentences + 1)))
+        return sorted(keep)
+
+    def compress(self, docs, terms):
+        """Return (compressed_docs, report) where report counts tokens before and after."""
+        tokens_before = sum(count_tokens(doc.page_content) for doc in docs)
+        candidates = [(doc, split_sentences(doc.page_content)) for doc in docs]
+        selected = [(doc, sentences, self._select(sentences, terms)) for doc, sentences in candidates]
+        if not any(indices for _, _, indices in selected):
+            # Nothing mentions the entities; fall back to deduplication and the budget only
+            selected = [(doc, sentences, list(range(len(sentences)))) for doc, sentences in candidates]
+
+        seen = set()
+        seen_text = ""
+        used_tokens = 0
+        compressed = []
+        for doc, sentences, indices in selected:
+            kept = []
+            for i in indices:
+                norm = _normalize(sentences[i])
+                # The head of an overlapping chunk is a fragment of a sentence seen before
+                if norm in seen or (i == 0 and norm in seen_text):
+                    continue
+                tokens = count_tokens(sentences[i])
+                if used_tokens + tokens > self.token_budget:
+                    break
+                seen.add(norm)
+                used_tokens += tokens
+                kept.append(sentences[i])
+            seen_text += " " + _normalize(doc.page_content)
+            if kept:
+                compressed.append(Document(page_content=" ".join(kept), metadata=doc.metadata))
+            if used_tokens >= self.token_budget:
+                break
+
+        report = {
+            "tokens_before": tokens_before,
+            "tokens_after": used_tokens,
+            "tokens_saved": max(0, tokens_before - used_tokens),
+        }
+        return compressed, report
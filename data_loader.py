@@ -1,21 +1,202 @@
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from langchain.docstore.document import Document
 from langchain.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from pypdf import PdfReader
+from manifest import chunk_id, file_sha256
+from monograph_splitter import MonographSplitter
+from tracing import tracer
+
+
+def _parse_page_range(file_path, start, end):
+    """Extract text for pages [start, end) of a PDF. Runs in a worker process.
+    
+    Returns (pages, seconds) so the parent can record the parse time.
+    """
+    started = time.perf_counter()
+    reader = PdfReader(file_path)
+    pages = [(i, reader.pages[i].extract_text()) for i in range(start, end)]
+    return pages, time.perf_counter() - started
+
 
 class MedicalDataLoader:
     """Handles loading and processing of medical PDF documents."""
     
-    def __init__(self, data_dir="data"):
+    def __init__(self, data_dir="data", max_workers=None, pages_per_task=32, splitter=None):
         self.data_dir = data_dir
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+        # "recursive" splits each page into overlapping fixed-size windows;
+        # "monograph" into section-aligned chunks with drug metadata and offsets
+        self.splitter = splitter or os.environ.get("CHUNK_SPLITTER", "recursive")
+        if self.splitter not in ("recursive", "monograph"):
+            raise ValueError(f"Unknown splitter: {self.splitter}")
         
-    def load_and_split(self, chunk_size=1000, chunk_overlap=200):
-        """Load and split documents in one step."""
+    def list_pdf_files(self):
+        """Return the PDF file names in the data directory, creating it if missing."""
         if not os.path.exists(self.data_dir):
             print(f"Creating data directory '{self.data_dir}'")
             os.makedirs(self.data_dir)
             return []
+        return sorted(f for f in os.listdir(self.data_dir) if f.endswith('.pdf'))
+    
+    def _split_params(self, chunk_size, chunk_overlap):
+        """Splitting settings recorded in the manifest; changing them re-ingests a file."""
+        if self.splitter == "monograph":
+            return {"chunk_size": chunk_size, "splitter": "monograph"}
+        return {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    
+    def _make_splitter(self, chunk_size, chunk_overlap):
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+        )
+    
+    def _iter_file_events(self, pdf_files, chunk_size, chunk_overlap):
+        """Parse PDFs page-range by page-range on a process pool.
+        
+        Yields ("chunk", pdf_file, chunk) as soon as each range is parsed and
+        split, in page order, then ("done", pdf_file, chunk_ids) once a file is
+        complete; chunk_ids is None if any part of the file failed to parse.
+        Only a bounded number of page ranges is in flight at any time, so
+        memory does not grow with the size of the corpus.
+        """
+        text_splitter = self._make_splitter(chunk_size, chunk_overlap)
+        monographs = {} if self.splitter == "monograph" else None
+        
+        tasks = []
+        for pdf_file in pdf_files:
+            file_path = os.path.join(self.data_dir, pdf_file)
+            try:
+                page_count = len(PdfReader(file_path).pages)
+            except Exception as e:
+                print(f"✗ Error loading {pdf_file}: {str(e)}")
+                yield "done", pdf_file, None
+                continue
+            if page_count == 0:
+                yield "done", pdf_file, set()
+                continue
+            for start in range(0, page_count, self.pages_per_task):
+                end = min(start + self.pages_per_task, page_count)
+                tasks.append((pdf_file, file_path, start, end, end == page_count))
+        
+        if not tasks:
+            return
+        
+        seen_ids = {}
+        failed = set()
+        task_iter = iter(tasks)
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = deque()
+            
+            def submit_next():
+                task = next(task_iter, None)
+                if task is not None:
+                    _, file_path, start, end, _ = task
+                    pending.append((task, pool.submit(_parse_page_range, file_path, start, end)))
             
-        pdf_files = [f for f in os.listdir(self.data_dir) if f.endswith('.pdf')]
+            for _ in range(self.max_workers * 2):
+                submit_next()
+            
+            while pending:
+                (pdf_file, file_path, start, end, is_last), future = pending.popleft()
+                submit_next()
+                
+                try:
+                    pages, parse_seconds = future.result()
+                    tracer.record("pdf_parse", parse_seconds, pages=end - start,
+                                  bytes=sum(len(text.encode("utf-8")) for _, text in pages))
+                except Exception as e:
+                    print(f"✗ Error loading {pdf_file} pages {start}-{end}: {str(e)}")
+                    failed.add(pdf_file)
+                    pages = []
+                
+                ids = seen_ids.setdefault(pdf_file, set())
+                if pdf_file not in failed:
+                    range_chunks = []
+                    with tracer.span("split", pages=len(pages)) as span:
+                        if monographs is not None:
+                            # Ranges arrive in page order, so sections carry over between them
+                            splitter = monographs.setdefault(pdf_file, MonographSplitter(file_path, chunk_size))
+                            split = [chunk for page, text in pages for chunk in splitter.feed(page, text)]
+                            if is_last:
+                                split.extend(monographs.pop(pdf_file).finish())
+                        else:
+                            split = [
+                                chunk for page, text in pages
+                                for chunk in text_splitter.split_documents(
+                                    [Document(page_content=text, metadata={"source": file_path, "page": page})]
+                                )
+                            ]
+                        for chunk in split:
+                            cid = chunk_id(pdf_file, chunk.metadata["page"], chunk.page_content)
+                            if cid in ids:
+                                continue
+                            ids.add(cid)
+                            chunk.metadata["chunk_id"] = cid
+                            range_chunks.append(chunk)
+                        span.set(chunks=len(range_chunks))
+                    for chunk in range_chunks:
+                        yield "chunk", pdf_file, chunk
+                
+                if is_last:
+                    if monographs is not None:
+                        monographs.pop(pdf_file, None)
+                    yield "done", pdf_file, None if pdf_file in failed else seen_ids.pop(pdf_file)
+    
+    def iter_chunks(self, chunk_size=1000, chunk_overlap=200):
+        """Yield split chunks for every PDF in the data directory as they are parsed."""
+        for event, _, chunk in self._iter_file_events(self.list_pdf_files(), chunk_size, chunk_overlap):
+            if event == "chunk":
+                yield chunk
+    
+    def sync(self, manifest, chunk_size=1000, chunk_overlap=200):
+        """Compare the data directory against the ingestion manifest.
+        
+        Returns (new_chunks, stale_ids). ``new_chunks`` is a generator of the
+        chunks that must be embedded, streamed while the PDFs are parsed.
+        ``stale_ids`` holds the IDs of stored chunks that no longer exist; it is
+        only complete once ``new_chunks`` has been exhausted. The manifest is
+        updated in memory as files finish; the caller saves it once the vector
+        store has been written.
+        """
+        pdf_files = self.list_pdf_files()
+        params = self._split_params(chunk_size, chunk_overlap)
+        stale_ids = set()
+        changed = {}
+        
+        for pdf_file in pdf_files:
+            sha256 = file_sha256(os.path.join(self.data_dir, pdf_file))
+            if manifest.is_current(pdf_file, sha256, params):
+                print(f"✓ Unchanged {pdf_file}, skipping")
+            else:
+                changed[pdf_file] = sha256
+        
+        for removed_file in set(manifest.files) - set(pdf_files):
+            stale_ids |= manifest.remove(removed_file)
+            print(f"✓ Removed {removed_file} from the index")
+        
+        def new_chunks():
+            old_ids = {pdf_file: manifest.chunk_ids(pdf_file) for pdf_file in changed}
+            for event, pdf_file, payload in self._iter_file_events(list(changed), chunk_size, chunk_overlap):
+                if event == "chunk":
+                    if payload.metadata["chunk_id"] not in old_ids[pdf_file]:
+                        yield payload
+                elif payload is not None:
+                    stale_ids.update(old_ids[pdf_file] - payload)
+                    manifest.update(pdf_file, changed[pdf_file], params, payload)
+                    print(f"✓ Loaded {pdf_file}: {len(payload - old_ids[pdf_file])} new, "
+                          f"{len(old_ids[pdf_file] - payload)} removed chunks")
+        
+        return new_chunks(), stale_ids
+    
+    def load_and_split(self, chunk_size=1000, chunk_overlap=200):
+        """Load and split documents in one step."""
+        pdf_files = self.list_pdf_files()
         
         if not pdf_files:
             print(f"No PDF files found in '{self.data_dir}'. Please add some medical PDFs.")
@@ -37,13 +218,33 @@ class MedicalDataLoader:
             return []
         
         print(f"Splitting {len(documents)} documents into chunks...")
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-        )
-        
-        chunks = text_splitter.split_documents(documents)
+        if self.splitter == "monograph":
+            chunks = []
+            splitters = {}
+            for doc in documents:
+                source = doc.metadata["source"]
+                splitter = splitters.setdefault(source, MonographSplitter(source, chunk_size))
+                chunks.extend(splitter.feed(doc.metadata["page"], doc.page_content))
+            for splitter in splitters.values():
+                chunks.extend(splitter.finish())
+        else:
+            chunks = self._make_splitter(chunk_size, chunk_overlap).split_documents(documents)
         print(f"Created {len(chunks)} chunks for processing")
         
-        return chunks
\ No newline at end of file
+        return chunks
+
+
+def read_excerpt(source, page, start_offset, end_page=None, end_offset=None):
+    """Re-extract the text a chunk was cut from, using its page and offset metadata.
+    
+    Lets the UI show a source passage in full without storing it twice.
+    """
+    end_page = page if end_page is None else end_page
+    reader = PdfReader(source)
+    parts = []
+    for number in range(page, end_page + 1):
+        text = reader.pages[number].extract_text() or ""
+        start = start_offset if number == page else 0
+        end = end_offset if number == end_page and end_offset is not None else len(text)
+        parts.append(text[start:end])
+    return "\n".join(parts)
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embeddings object with a two-level (memory + SQLite) LRU cache.
+
+    Vectors are keyed by a hash of ``namespace`` (the embedding model and its
+    settings) and the exact text, so switching models never serves stale
+    vectors. Queries and ingestion chunks share the cache. Entries added with
+    ``precompute`` are pinned: they are never evicted and count as lexicon hits;
+    the next ``precompute`` unpins texts no longer in the set. The memory
+    level holds float32 arrays, about 3 KB per 768-dimensional vector.
+    Assumes the wrapped model embeds a text the same way as a query and as a
+    document, which holds for the symmetric sentence-transformers models used here.
+    """
+
+    def __init__(self, embeddings, path, namespace, max_entries=20000, memory_entries=4096):
+        self.embeddings = embeddings
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "lexicon_hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Server workers share this file; wait for another process's write instead of failing
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            " key TEXT PRIMARY KEY, namespace TEXT, vector BLOB, pinned INTEGER, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS vectors_lru ON vectors (pinned, last_used)")
+        # Lexicon entries of a previous model are ordinary LRU entries now
+        self._conn.execute("UPDATE vectors SET pinned = 0 WHERE namespace != ?", (namespace,))
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def _key(self, text):
+        return hashlib.sha1(f"{self.namespace}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector, pinned):
+        # float32 like the SQLite copy, a quarter of the size of a list of floats
+        self._memory[key] = (array("f", vector), pinned)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _select(self, columns, keys):
+        # SQLite limits the number of bound parameters, so query in slices
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            yield from self._conn.execute(
+                f"SELECT {columns} FROM vectors WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+
+    def _lookup(self, keys):
+        """Return {key: vector} for every cached key, counting hits and misses."""
+        found = {}
+        with self._lock:
+            disk_keys = []
+            for key in dict.fromkeys(keys):
+                if key in self._memory:
+                    vector, pinned = self._memory[key]
+                    self._memory.move_to_end(key)
+                    found[key] = vector.tolist()
+                    self.counters["lexicon_hits" if pinned else "memory_hits"] += 1
+                else:
+                    disk_keys.append(key)
+
+            rows = list(self._select("key, vector, pinned", disk_keys))
+            for key, blob, pinned in rows:
+                vector = array("f", blob)
+                found[key] = vector.tolist()
+                self._remember(key, vector, bool(pinned))
+                self.counters["lexicon_hits" if pinned else "disk_hits"] += 1
+            if rows:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE vectors SET last_used = ? WHERE key = ?", [(now, row[0]) for row in rows]
+                )
+                self._conn.commit()
+            self.counters["misses"] += len(disk_keys) - sum(1 for key in disk_keys if key in found)
+        return found
+
+    def _insert(self, items, pinned=False):
+        now = time.time()
+        with self._lock:
+            for key, vector in items:
+                exists = self._conn.execute("SELECT 1 FROM vectors WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?, ?)",
+                    (key, self.namespace, array("f", vector).tobytes(), int(pinned), now),
+                )
+                self._size += 0 if exists else 1
+                self._remember(key, vector, pinned)
+            overflow = self._size - self.max_entries
+            if overflow > 0:
+                deleted = self._conn.execute(
+                    "DELETE FROM vectors WHERE key IN"
+                    " (SELECT key FROM vectors WHERE pinned = 0 ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,),
+                ).rowcount
+                self._size -= deleted
+                self.counters["evictions"] += deleted
+            self._conn.commit()
+
+    def embed_documents(self, texts):
+        """Embed texts, calling the model once for all cache misses."""
+        texts = list(texts)
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(keys)
+        missing = OrderedDict((key, text) for key, text in zip(keys, texts) if key not in found)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self._insert(zip(missing, vectors))
+            found.update(zip(missing, vectors))
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        """Embed a query, served from the cache when possible."""
+        key = self._key(text)
+        vector = self._lookup([key]).get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._insert([(key, vector)])
+        return vector
+
+    def precompute(self, texts):
+        """Embed and pin ``texts`` (e.g. per-drug lookup queries); returns how many were new.
+
+        Texts pinned by an earlier call but missing from ``texts`` become
+        ordinary LRU entries.
+        """
+        keys = OrderedDict((self._key(text), text) for text in texts)
+        with self._lock:
+            stale = [
+                row[0] for row in self._conn.execute(
+                    "SELECT key FROM vectors WHERE pinned = 1 AND namespace = ?", (self.namespace,)
+                ) if row[0] not in keys
+            ]
+            self._conn.executemany("UPDATE vectors SET pinned = 0 WHERE key = ?", [(key,) for key in stale])
+            for key in stale:
+                self._memory.pop(key, None)
+            self._conn.executemany("UPDATE vectors SET pinned = 1 WHERE key = ?", [(key,) for key in keys])
+            self._conn.commit()
+            existing = {row[0] for row in self._select("key", list(keys))}
+            # Entries already in memory pick up their pinned flag on the next disk read
+            for key in existing:
+                self._memory.pop(key, None)
+        missing = [(key, text) for key, text in keys.items() if key not in existing]
+        if missing:
+            vectors = self.embeddings.embed_documents([text for _, text in missing])
+            self._insert(((key, vector) for (key, _), vector in zip(missing, vectors)), pinned=True)
+        return len(missing)
+
+    def stats(self):
+        """Return hit/miss counters, the hit rate and the number of stored vectors."""
+        with self._lock:
+            pinned = self._conn.execute("SELECT COUNT(*) FROM vectors WHERE pinned = 1").fetchone()[0]
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["lexicon_hits"]
+        lookups = hits + self.counters["misses"]
+        return dict(
+            self.counters,
+            size=self._size,
+            pinned=pinned,
+            hit_rate=round(hits / lookups, 3) if lookups else 0.0,
+        )
@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from manifest import chunk_id
+from tracing import tracer
+
+
+def batched(iterable, batch_size):
+    """Yield lists of up to ``batch_size`` items from any iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class EmbeddingPipeline:
+    """Streams chunks into a vector store in batches, encoding ahead of the writes.
+
+    Batches are encoded on a pool of worker threads (the model releases the GIL
+    while it computes) and written to the store in order, so batch N is written
+    while batches N+1..N+workers are still being encoded.
+    """
+
+    def __init__(self, embeddings, batch_size=64, num_workers=None, on_batch=None):
+        self.embeddings = embeddings
+        # Called with each batch after it is written, e.g. to update a lexical index
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.num_workers = num_workers or max(1, min(4, (os.cpu_count() or 1) // 2))
+        self.stats = {}
+
+    def _limit_torch_threads(self):
+        """Returns the previous thread count, or None if torch is not loaded."""
+        # Split the CPU cores between workers instead of letting each one
+        # spin up a full set of intra-op threads. Only applies when the
+        # embeddings already loaded torch; the ONNX backend must not import it.
+        torch = sys.modules.get("torch")
+        if torch is None:
+            return None
+        previous = torch.get_num_threads()
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.num_workers))
+        return previous
+
+    @staticmethod
+    def _restore_torch_threads(previous):
+        # Query embeddings after ingestion get every core again
+        if previous is not None:
+            sys.modules["torch"].set_num_threads(previous)
+
+    def _encode(self, batch):
+        start = time.perf_counter()
+        vectors = self.embeddings.embed_documents([chunk.page_content for chunk in batch])
+        return vectors, time.perf_counter() - start
+
+    def _write(self, vectorstore, batch, vectors):
+        # Untagged chunks get a content ID here, before on_batch, so the
+        # vector store and the lexical index file them under the same ID
+        for chunk in batch:
+            if not chunk.metadata.get("chunk_id"):
+                chunk.metadata["chunk_id"] = chunk_id(
+                    chunk.metadata.get("source", ""), chunk.metadata.get("page"), chunk.page_content
+                )
+        ids = [chunk.metadata["chunk_id"] for chunk in batch]
+        vectorstore._collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            documents=[chunk.page_content for chunk in batch],
+            metadatas=[chunk.metadata for chunk in batch],
+        )
+
+    def run(self, vectorstore, chunks):
+        """Embed ``chunks`` (any iterable, consumed lazily) and write them to ``vectorstore``."""
+        previous_threads = self._limit_torch_threads()
+        start = time.perf_counter()
+        totals = {"chunks": 0, "embed_seconds": 0.0, "write_seconds": 0.0}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+                in_flight = deque()
+                for batch in batched(chunks, self.batch_size):
+                    in_flight.append((batch, pool.submit(self._encode, batch)))
+                    if len(in_flight) > self.num_workers:
+                        self._write_next(vectorstore, in_flight, totals)
+                while in_flight:
+                    self._write_next(vectorstore, in_flight, totals)
+        finally:
+            self._restore_torch_threads(previous_threads)
+
+        elapsed = time.perf_counter() - start
+        total = totals["chunks"]
+        self.stats = {
+            "chunks": total,
+            "seconds": round(elapsed, 3),
+            "chunks_per_second": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+            "embed_seconds": round(totals["embed_seconds"], 3),
+            "write_seconds": round(totals["write_seconds"], 3),
+            "batch_size": self.batch_size,
+            "num_workers": self.num_workers,
+        }
+        if total:
+            print(f"Embedded {total} chunks in {elapsed:.1f}s ({self.stats['chunks_per_second']} chunks/s)")
+        return self.stats
+
+    def _write_next(self, vectorstore, in_flight, totals):
+        batch, future = in_flight.popleft()
+        vectors, encode_seconds = future.result()
+        tracer.record("embed", encode_seconds, chunks=len(batch),
+                      bytes=sum(len(chunk.page_content.encode("utf-8")) for chunk in batch))
+        write_start = time.perf_counter()
+        with tracer.span("store_write", chunks=len(batch)):
+            self._write(vectorstore, batch, vectors)
+            if self.on_batch is not None:
+                self.on_batch(batch)
+        totals["chunks"] += len(batch)
+        totals["embed_seconds"] += encode_seconds
+        totals["write_seconds"] += time.perf_counter() - write_start
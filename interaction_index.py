@@ -0,0 +1,289 @@
+import argparse
+import json
+import os
+import re
+from collections import Counter, defaultdict
+from itertools import combinations
+import numpy as np
+from manifest import corpus_fingerprint
+
+# Canonical drug name -> synonyms and common brand names. The reference text
+# uses British/Indian names, so both spellings are listed.
+SEED_LEXICON = {
+    "acetaminophen": ["paracetamol", "tylenol", "crocin", "calpol"],
+    "aspirin": ["acetylsalicylic acid", "ecosprin", "disprin"],
+    "ibuprofen": ["brufen", "advil", "motrin"],
+    "diclofenac": ["voveran", "voltaren"],
+    "naproxen": ["naprosyn", "aleve"],
+    "warfarin": ["coumadin"],
+    "heparin": [],
+    "clopidogrel": ["plavix"],
+    "digoxin": ["lanoxin"],
+    "amiodarone": ["cordarone"],
+    "furosemide": ["frusemide", "lasix"],
+    "hydrochlorothiazide": ["hctz"],
+    "spironolactone": ["aldactone"],
+    "lisinopril": ["zestril", "prinivil"],
+    "enalapril": ["vasotec"],
+    "losartan": ["cozaar"],
+    "amlodipine": ["norvasc"],
+    "verapamil": ["calan"],
+    "diltiazem": ["cardizem"],
+    "metoprolol": ["lopressor", "toprol"],
+    "propranolol": ["inderal"],
+    "atenolol": ["tenormin"],
+    "atorvastatin": ["lipitor"],
+    "simvastatin": ["zocor"],
+    "metformin": ["glucophage"],
+    "glyburide": ["glibenclamide", "daonil"],
+    "insulin": [],
+    "levothyroxine": ["thyroxine", "eltroxin", "synthroid"],
+    "prednisolone": [],
+    "prednisone": [],
+    "dexamethasone": [],
+    "salbutamol": ["albuterol", "ventolin", "asthalin"],
+    "theophylline": [],
+    "omeprazole": ["prilosec", "omez"],
+    "ranitidine": ["zantac"],
+    "metoclopramide": ["reglan", "perinorm"],
+    "ondansetron": ["zofran"],
+    "amoxicillin": ["amoxil"],
+    "ciprofloxacin": ["cipro", "ciplox"],
+    "erythromycin": [],
+    "clarithromycin": ["biaxin"],
+    "doxycycline": [],
+    "rifampicin": ["rifampin"],
+    "isoniazid": ["inh"],
+    "fluconazole": ["diflucan"],
+    "ketoconazole": [],
+    "metronidazole": ["flagyl"],
+    "phenytoin": ["dilantin", "eptoin"],
+    "carbamazepine": ["tegretol"],
+    "valproate": ["valproic acid", "depakote"],
+    "lithium": [],
+    "fluoxetine": ["prozac"],
+    "sertraline": ["zoloft"],
+    "amitriptyline": ["elavil"],
+    "diazepam": ["valium"],
+    "alprazolam": ["xanax"],
+    "morphine": [],
+    "tramadol": ["ultram"],
+    "sildenafil": ["viagra"],
+    "epinephrine": ["adrenaline"],
+    "lidocaine": ["lignocaine", "xylocaine"],
+    "allopurinol": ["zyloprim"],
+    "methotrexate": [],
+}
+
+# Drug-class stems used to discover further drug names in the corpus
+DRUG_STEMS = (
+    "olol", "pril", "sartan", "statin", "azole", "cillin", "mycin", "floxacin",
+    "cycline", "dipine", "tidine", "prazole", "triptan", "oxetine", "triptyline",
+    "azepam", "azolam", "setron", "gliptin", "glitazone", "parin", "xaban",
+    "gatran", "profen", "fenac", "barbital", "caine", "thiazide", "semide",
+    "lukast", "terol", "tropium", "pramine", "azosin", "dronate",
+)
+
+WORD_RE = re.compile(r"[a-z][a-z0-9\-]+")
+
+# Chunks naming more drugs than this are indexes or tables of contents;
+# they are kept in the per-drug postings but not expanded into pairs.
+MAX_DRUGS_FOR_PAIRS = 25
+
+
+_SEED_NAMES = frozenset(
+    [name for name in SEED_LEXICON] + [synonym for synonyms in SEED_LEXICON.values() for synonym in synonyms]
+)
+
+
+def lexicon_names(index=None):
+    """Every drug name and alias: from a built index's lexicon, else from the seed lexicon."""
+    if index is not None:
+        return sorted(index.aliases)
+    return sorted(set(SEED_LEXICON) | {name for synonyms in SEED_LEXICON.values() for name in synonyms})
+
+
+def _tokens(text):
+    return WORD_RE.findall(text.lower())
+
+
+def _looks_like_drug(token):
+    # The stem must follow a real prefix: "cycline" alone is a class, not a drug
+    return any(token.endswith(stem) and len(token) >= len(stem) + 3 for stem in DRUG_STEMS)
+
+
+def is_drug_name(name):
+    """True for a seed-lexicon drug, synonym or brand, or a word with a drug-class stem."""
+    name = " ".join(name.lower().split())
+    return name in _SEED_NAMES or any(_looks_like_drug(token) for token in _tokens(name))
+
+
+def _mentions(tokens, aliases):
+    found = set()
+    for i, token in enumerate(tokens):
+        if token in aliases:
+            found.add(aliases[token])
+        if i + 1 < len(tokens):
+            bigram = f"{token} {tokens[i + 1]}"
+            if bigram in aliases:
+                found.add(aliases[bigram])
+    return found
+
+
+def _postings(groups, size):
+    """Flatten {key: [chunk indices]} into CSR-style offsets and postings arrays."""
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    for key, items in groups.items():
+        offsets[key + 1] = len(items)
+    offsets = np.cumsum(offsets)
+    postings = np.zeros(offsets[-1], dtype=np.int32)
+    for key, items in groups.items():
+        postings[offsets[key]:offsets[key + 1]] = sorted(items)
+    return offsets, postings
+
+
+class InteractionIndex:
+    """Drug lexicon plus drug -> chunk and drug-pair -> chunk co-mention indexes.
+
+    Arrays are stored as .npy files and opened memory-mapped, so loading is
+    instant and several processes share one page-cached copy. A pair lookup
+    is an alias resolution plus a binary search over sorted pair keys.
+    """
+
+    FILES = ("drug_offsets", "drug_postings", "pair_keys", "pair_offsets", "pair_postings", "chunk_drug_counts")
+
+    def __init__(self, drugs, aliases, chunk_ids, arrays):
+        self.drugs = drugs
+        self.aliases = aliases
+        self.chunk_ids = chunk_ids
+        self.drug_offsets = arrays["drug_offsets"]
+        self.drug_postings = arrays["drug_postings"]
+        self.pair_keys = arrays["pair_keys"]
+        self.pair_offsets = arrays["pair_offsets"]
+        self.pair_postings = arrays["pair_postings"]
+        self.chunk_drug_counts = arrays["chunk_drug_counts"]
+        self.fingerprint = corpus_fingerprint(chunk_ids)
+
+    @classmethod
+    def build(cls, chunks, min_discovered_chunks=3):
+        """Build the index from chunks tagged with ``chunk_id`` metadata."""
+        chunk_ids = []
+        chunk_tokens = []
+        stem_counts = Counter()
+        for chunk in chunks:
+            tokens = _tokens(chunk.page_content)
+            chunk_ids.append(chunk.metadata["chunk_id"])
+            chunk_tokens.append(tokens)
+            stem_counts.update({t for t in tokens if _looks_like_drug(t)})
+
+        drugs = sorted(set(SEED_LEXICON) | {
+            word for word, count in stem_counts.items() if count >= min_discovered_chunks
+        })
+        drug_ids = {name: i for i, name in enumerate(drugs)}
+        aliases = dict(drug_ids)
+        for name, synonyms in SEED_LEXICON.items():
+            for synonym in synonyms:
+                aliases[synonym] = drug_ids[name]
+
+        by_drug = defaultdict(list)
+        by_pair = defaultdict(list)
+        counts = np.zeros(len(chunk_ids), dtype=np.int32)
+        for index, tokens in enumerate(chunk_tokens):
+            mentioned = sorted(_mentions(tokens, aliases))
+            counts[index] = len(mentioned)
+            for drug in mentioned:
+                by_drug[drug].append(index)
+            if len(mentioned) <= MAX_DRUGS_FOR_PAIRS:
+                for a, b in combinations(mentioned, 2):
+                    by_pair[a * len(drugs) + b].append(index)
+
+        drug_offsets, drug_postings = _postings(by_drug, len(drugs))
+        pair_keys = np.array(sorted(by_pair), dtype=np.int64)
+        pair_offsets, pair_postings = _postings(
+            {i: by_pair[int(key)] for i, key in enumerate(pair_keys)}, len(pair_keys)
+        )
+        return cls(drugs, aliases, chunk_ids, {
+            "drug_offsets": drug_offsets,
+            "drug_postings": drug_postings,
+            "pair_keys": pair_keys,
+            "pair_offsets": pair_offsets,
+            "pair_postings": pair_postings,
+            "chunk_drug_counts": counts,
+        })
+
+    def save(self, directory):
+        """Write the lexicon (JSON) and the arrays (.npy) to ``directory``."""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "lexicon.json"), "w", encoding="utf-8") as f:
+            json.dump({"drugs": self.drugs, "aliases": self.aliases, "chunk_ids": self.chunk_ids}, f)
+        for name in self.FILES:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory):
+        """Open a saved index with memory-mapped arrays, or return None if absent."""
+        lexicon_path = os.path.join(directory, "lexicon.json")
+        if not os.path.exists(lexicon_path):
+            return None
+        with open(lexicon_path, "r", encoding="utf-8") as f:
+            lexicon = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in cls.FILES
+        }
+        return cls(lexicon["drugs"], lexicon["aliases"], lexicon["chunk_ids"], arrays)
+
+    def resolve(self, name):
+        """Map a drug name, synonym or brand to its drug ID (None if unknown)."""
+        name = " ".join(str(name or "").lower().split())
+        if name in self.aliases:
+            return self.aliases[name]
+        # Form entries often carry a strength or salt, e.g. "metoprolol succinate"
+        for token in _tokens(name):
+            if token in self.aliases:
+                return self.aliases[token]
+        return None
+
+    def _ranked_chunks(self, postings):
+        # Chunks that mention fewer drugs are more specific evidence
+        order = np.argsort(self.chunk_drug_counts[postings], kind="stable")
+        return [self.chunk_ids[i] for i in postings[order]]
+
+    def drug_chunks(self, name):
+        """Chunk IDs mentioning a drug, most specific first."""
+        drug = self.resolve(name)
+        if drug is None:
+            return []
+        return self._ranked_chunks(self.drug_postings[self.drug_offsets[drug]:self.drug_offsets[drug + 1]])
+
+    def pair_chunks(self, name_a, name_b):
+        """Chunk IDs mentioning both drugs, most specific first."""
+        a, b = self.resolve(name_a), self.resolve(name_b)
+        if a is None or b is None or a == b:
+            return []
+        key = min(a, b) * len(self.drugs) + max(a, b)
+        position = int(np.searchsorted(self.pair_keys, key))
+        if position >= len(self.pair_keys) or self.pair_keys[position] != key:
+            return []
+        start, end = self.pair_offsets[position], self.pair_offsets[position + 1]
+        return self._ranked_chunks(self.pair_postings[start:end])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the drug interaction index from the reference PDFs.")
+    parser.add_argument("--data-dir", default="data", help="Directory with the reference PDFs")
+    parser.add_argument("--output", default=os.path.join("chroma_db", "interaction_index"),
+                        help="Directory to write the index to")
+    args = parser.parse_args()
+
+    from data_loader import MedicalDataLoader
+
+    chunks = MedicalDataLoader(data_dir=args.data_dir).iter_chunks()
+    index = InteractionIndex.build(chunks)
+    index.save(args.output)
+    print(f"Indexed {len(index.drugs)} drugs, {len(index.pair_keys)} drug pairs "
+          f"over {len(index.chunk_ids)} chunks into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
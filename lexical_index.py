@@ -0,0 +1,150 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from langchain.docstore.document import Document
+
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9\-]*")
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do for from has have in is it its may of on or
+such that the their there these this to was were which will with not no also
+than other into if use used using should been being more most some any all
+""".split())
+
+
+def tokenize(text):
+    """Lower-case word tokens without stopwords; hyphenated drug names stay whole."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def reciprocal_rank_fusion(ranked_lists, key, k=60):
+    """Fuse several ranked lists with RRF: score(d) = sum(1 / (k + rank)).
+
+    ``key`` maps an item to its identity so the same chunk found by different
+    retrievers is merged. Returns items ordered by fused score.
+    """
+    scores = defaultdict(float)
+    items = {}
+    for ranked in ranked_lists:
+        for rank, item in enumerate(ranked, 1):
+            item_key = key(item)
+            scores[item_key] += 1.0 / (k + rank)
+            items.setdefault(item_key, item)
+    return [items[item_key] for item_key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class BM25Index:
+    """Incrementally updatable Okapi BM25 index persisted in SQLite.
+
+    Stores chunk text and metadata alongside the postings, so lexical hits
+    can be returned as Documents without a round trip to the vector store.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75, read_only=False):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._stats = None
+        if read_only:
+            # Snapshot copies are shared and never written to
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, length INTEGER, text TEXT, metadata TEXT);"
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT, doc_id TEXT, tf INTEGER, PRIMARY KEY (term, doc_id));"
+            "CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);"
+        )
+        self._conn.commit()
+
+    def _delete_ids(self, ids):
+        for doc_id in ids:
+            self._conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+            self._conn.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+
+    def add(self, chunks):
+        """Index (or re-index) chunks tagged with ``chunk_id`` metadata."""
+        with self._lock:
+            self._delete_ids(chunk.metadata["chunk_id"] for chunk in chunks)
+            for chunk in chunks:
+                doc_id = chunk.metadata["chunk_id"]
+                terms = Counter(tokenize(chunk.page_content))
+                self._conn.execute(
+                    "INSERT INTO docs VALUES (?, ?, ?, ?)",
+                    (doc_id, sum(terms.values()), chunk.page_content, json.dumps(chunk.metadata)),
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in terms.items()],
+                )
+            self._conn.commit()
+            self._stats = None
+
+    def delete(self, ids):
+        """Remove chunks by ID."""
+        with self._lock:
+            self._delete_ids(ids)
+            self._conn.commit()
+            self._stats = None
+
+    def clear(self):
+        """Remove every chunk."""
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+            self._conn.commit()
+            self._stats = None
+
+    def export(self, path):
+        """Write a consistent copy of the index to ``path``."""
+        target = sqlite3.connect(path)
+        with self._lock:
+            self._conn.backup(target)
+        target.close()
+
+    def count(self):
+        """Number of indexed chunks."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def search(self, query, k=10):
+        """Return up to ``k`` Documents ranked by BM25 score for ``query``."""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            if self._stats is None:
+                count, avg_length = self._conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+                self._stats = (count, avg_length or 1.0)
+            count, avg_length = self._stats
+            if not count:
+                return []
+
+            scores = defaultdict(float)
+            for term in terms:
+                rows = self._conn.execute(
+                    "SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id"
+                    " WHERE p.term = ?",
+                    (term,),
+                ).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + (count - len(rows) + 0.5) / (len(rows) + 0.5))
+                for doc_id, tf, length in rows:
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+
+            top = sorted(scores, key=scores.get, reverse=True)[:k]
+            docs = []
+            for doc_id in top:
+                text, metadata = self._conn.execute(
+                    "SELECT text, metadata FROM docs WHERE id = ?", (doc_id,)
+                ).fetchone()
+                docs.append(Document(page_content=text, metadata=json.loads(metadata)))
+            return docs
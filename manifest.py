@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+
+
+def file_sha256(file_path, block_size=1 << 20):
+    """Compute the SHA-256 digest of a file without reading it into memory at once."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(source_name, page, content):
+    """Build a stable ID for a chunk from its file, page and text."""
+    key = f"{source_name}\x00{page}\x00{content}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def corpus_fingerprint(chunk_ids):
+    """Hash a set of chunk IDs, identifying exactly which chunks a derived index covers."""
+    digest = hashlib.sha1()
+    for cid in sorted(chunk_ids):
+        digest.update(cid.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IngestionManifest:
+    """Persisted record of which PDFs have been embedded, and with which chunk IDs."""
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.exists = False
+        self.load()
+
+    def load(self):
+        """Load the manifest from disk if present."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"✗ Ignoring unreadable ingestion manifest {self.path}: {str(e)}")
+            return
+        if data.get("version") != self.VERSION:
+            return
+        self.files = data.get("files", {})
+        self.exists = True
+
+    def save(self):
+        """Atomically write the manifest next to the vector store."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Per-process temp file: several server workers may save at once
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
+        self.exists = True
+
+    def is_current(self, name, sha256, params):
+        """Return True if a file with this hash was ingested with the same chunk parameters."""
+        entry = self.files.get(name)
+        return bool(entry) and entry["sha256"] == sha256 and entry["params"] == params
+
+    def chunk_ids(self, name):
+        """Return the chunk IDs recorded for a file."""
+        entry = self.files.get(name)
+        return set(entry["chunk_ids"]) if entry else set()
+
+    def update(self, name, sha256, params, chunk_ids):
+        """Record the chunks currently stored for a file."""
+        self.files[name] = {
+            "sha256": sha256,
+            "params": params,
+            "chunk_ids": sorted(chunk_ids),
+        }
+
+    def fingerprint(self):
+        """Fingerprint of every chunk currently recorded, see ``corpus_fingerprint``."""
+        return corpus_fingerprint(cid for entry in self.files.values() for cid in entry["chunk_ids"])
+
+    def remove(self, name):
+        """Forget a file and return the chunk IDs it owned."""
+        entry = self.files.pop(name, None)
+        return set(entry["chunk_ids"]) if entry else set()
@@ -1,9 +1,65 @@
+import asyncio
+import hashlib
 import os
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain.chains import RetrievalQA
+import time
 from langchain.prompts import PromptTemplate
-from langchain_community.llms import Ollama
+from langchain.docstore.document import Document
+from embedding_pipeline import EmbeddingPipeline
+from answer_cache import AnswerCache, canonical_profile
+from retrieval import DRUG_QUERY, EntityRetriever, extract_entities
+from compression import ContextCompressor, entity_terms
+from tokens import count_tokens
+from tracing import tracer
+from ollama_pool import OllamaEndpointPool
+from interaction_index import InteractionIndex, lexicon_names
+from embedding_cache import CachedEmbeddings
+from manifest import IngestionManifest, corpus_fingerprint
+from compact_store import CompactVectorStore
+from lexical_index import BM25Index
+from snapshot import IndexSnapshot, current_version
+from scheduler import GenerationScheduler
+from routing import ModelRouter
+from structured_output import DISCLAIMER, OUTPUT_FORMATS, STRUCTURED_INSTRUCTIONS, parse_structured_analysis
+
+DEFAULT_OLLAMA_BASE_URL = "http://10.145.138.115:11434"
+SOURCE_LOCATION_KEYS = ("section", "drug", "end_page", "start_offset", "end_offset")
+
+# Every prompt is a fixed instruction prefix for its output format followed by
+# a variable tail (retrieved context and patient information), so the prefix
+# is identical across requests and Ollama's prompt cache can reuse its evaluation
+PROSE_PREFIX = """
+        You are a friendly medical assistant focusing on drug interactions and safety concerns.
+        You will be given context information from medical literature and a patient's information.
+        Based on the context information and your knowledge, identify any potential negative interactions
+        or concerns, considering:
+        1. Drug-drug interactions between current and new medications
+        2. Allergy concerns with any medications
+        3. Drug-condition interactions
+        4. Age, gender, or blood pressure related concerns
+        
+        Focus on identifying potential negative interactions, side effects, or concerns.
+        Don't provide treatment suggestions or next steps.
+        Be conversational and educational, explain in simple terms, but be comprehensive. Organize your answer
+        in clear sections but don't use numbering or bullet points unless necessary. Explain any medical terms you use.
+        End with a disclaimer that you are NOT a doctor and this analysis is for informational purposes only.
+        """
+STRUCTURED_PREFIX = """
+        You are a medical assistant screening for drug interactions and safety concerns.
+        You will be given context information from medical literature and a patient's information.
+        Based on the context information and your knowledge, screen the patient for potential negative
+        interactions or concerns.
+        """ + STRUCTURED_INSTRUCTIONS
+PROMPT_TAIL = """
+        Context information from medical literature:
+        {context}
+        
+        Patient Information:
+        {question}
+        
+        Answer:
+        """
+# Part of every cached answer's namespace, so editing a prompt invalidates them
+PROMPT_VERSION = hashlib.sha1((PROSE_PREFIX + STRUCTURED_PREFIX + PROMPT_TAIL).encode("utf-8")).hexdigest()[:12]
 
 class MedicalInteractionModel:
     """Manages the RAG model and interactions with the vector database."""
@@ -11,96 +67,456 @@ class MedicalInteractionModel:
     def __init__(self, 
                 model_name="llama3.1", 
                 embedding_model="pritamdeka/S-PubMedBert-MS-MARCO",
-                persist_dir="./chroma_db"):
+                persist_dir="./chroma_db",
+                embedding_device="cpu",
+                embedding_batch_size=64,
+                embedding_workers=None,
+                normalize_embeddings=False,
+                embedding_backend=None,
+                onnx_model_dir=None,
+                embedding_cache_size=20000,
+                vector_store=None,
+                compact_store_mode="pq",
+                rerank_candidates=100,
+                snapshot_dir=None,
+                read_only=False,
+                verify_snapshot=True,
+                answer_cache_ttl=24 * 3600,
+                answer_cache_size=1000,
+                answer_cache_similarity=None,
+                retrieval_k_per_lookup=2,
+                context_token_budget=1500,
+                compressed_token_budget=900,
+                ollama_base_urls=None,
+                ollama_concurrency=8,
+                per_endpoint_concurrency=4,
+                model_tiers=None,
+                token_budgets=None,
+                ollama_timeout=300.0,
+                embeddings=None,
+                llm=None):
         self.model_name = model_name
         self.embedding_model = embedding_model
         self.persist_dir = persist_dir
+        self.embedding_device = embedding_device
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_workers = embedding_workers
+        self.normalize_embeddings = normalize_embeddings
+        # "huggingface" runs the PyTorch model; "onnx" an export from onnx_embeddings.py
+        self.embedding_backend = embedding_backend or os.environ.get("EMBEDDING_BACKEND", "huggingface")
+        self.onnx_model_dir = onnx_model_dir or os.environ.get(
+            "ONNX_EMBEDDING_DIR", os.path.join("models", "pubmedbert-onnx-int8")
+        )
+        self.embedding_stats = {}
+        # Disk-backed cache of query and chunk vectors; None disables it
+        self.embedding_cache_size = embedding_cache_size
+        self.embedding_cache = None
+        self.manifest_path = os.path.join(persist_dir, "ingest_manifest.json")
+        self.interaction_index_dir = os.path.join(persist_dir, "interaction_index")
+        # "chroma" serves queries from Chroma's HNSW index; "compact" from a
+        # memory-mapped float16/PQ copy shared by every process on the machine
+        self.vector_store = vector_store or os.environ.get("VECTOR_STORE", "chroma")
+        self.compact_store_dir = os.path.join(persist_dir, "compact_store")
+        self.compact_store_mode = compact_store_mode
+        self.rerank_candidates = rerank_candidates
+        # A prebuilt index snapshot (a version or a root with a CURRENT pointer)
+        # replaces ingestion: nothing is parsed or embedded, and the files are only read
+        self.snapshot_dir = snapshot_dir or os.environ.get("INDEX_SNAPSHOT")
+        self.verify_snapshot = verify_snapshot
+        self.snapshot = None
+        self.interaction_index = None
+        # Serve a store another process ingested (server workers after prepare):
+        # nothing is parsed, embedded, rebuilt or pinned
+        self.read_only = read_only
+        self.lexical_index = None if self.snapshot_dir or read_only else BM25Index(
+            os.path.join(persist_dir, "bm25.sqlite")
+        )
+        # Ready-made embeddings / LLM objects replace the HuggingFace and Ollama
+        # defaults, e.g. to benchmark the pipeline offline
+        self.custom_embeddings = embeddings
+        self.custom_llm = llm
         self.llm = None
+        self.base_embeddings = None
         self.vectorstore = None
-        self.qa_chain = None
+        # The Chroma store chunks are ingested into; None when serving a snapshot
+        self.chroma_store = None
+        self.ollama_pool = None
+        # Comma-separated OLLAMA_BASE_URLS spreads async requests over several servers
+        self.ollama_base_urls = ollama_base_urls or [
+            url.strip() for url in os.environ.get("OLLAMA_BASE_URLS", DEFAULT_OLLAMA_BASE_URL).split(",")
+            if url.strip()
+        ]
+        self.ollama_concurrency = ollama_concurrency
+        self.per_endpoint_concurrency = per_endpoint_concurrency
+        self.ollama_timeout = ollama_timeout
+        # Coalesces identical in-flight requests and queues generations by
+        # priority, at most per_endpoint_concurrency per Ollama server
+        self.scheduler = GenerationScheduler(
+            [url.rstrip("/") for url in self.ollama_base_urls], per_endpoint_concurrency
+        )
+        self._endpoint_llms = {}
+        # Picks a model tier and num_predict per request from the form inputs;
+        # OLLAMA_TIER_MODELS="light=llama3.2:3b" gives simple cases a smaller model
+        self.router = ModelRouter.from_env(model_name, model_tiers, token_budgets)
+        self.prompt = None
+        self.retriever = None
+        self.retrieval_k_per_lookup = retrieval_k_per_lookup
+        self.context_token_budget = context_token_budget
+        # None disables compression and sends the retrieved chunks verbatim
+        self.compressor = ContextCompressor(compressed_token_budget) if compressed_token_budget else None
+        # Opt-in near-duplicate matching of additional_info (cosine threshold,
+        # e.g. 0.95); None reuses answers only for exactly matching inputs
+        self.answer_cache_similarity = answer_cache_similarity
+        self.answer_cache = AnswerCache(
+            os.path.join(persist_dir, "answer_cache.sqlite"),
+            ttl_seconds=answer_cache_ttl,
+            max_entries=answer_cache_size,
+            similarity_threshold=answer_cache_similarity,
+        )
+        self._corpus_listeners = [
+            self.answer_cache.invalidate,
+            self._clear_retrieval_cache,
+            self._drop_interaction_index,
+        ]
     
-    def initialize(self, chunks):
-        """Initialize the entire model in one step."""
-        # Create embeddings
-        embeddings = HuggingFaceEmbeddings(model_name=self.embedding_model)
+    def add_corpus_listener(self, callback):
+        """Register a callback fired whenever chunks are added to or removed from the store."""
+        self._corpus_listeners.append(callback)
+    
+    def _clear_retrieval_cache(self):
+        if self.retriever:
+            self.retriever.clear_cache()
+    
+    def _drop_interaction_index(self):
+        if self.interaction_index is not None:
+            print("Corpus changed; interaction index disabled until it is rebuilt "
+                  "(python interaction_index.py)")
+        self.interaction_index = None
+        if self.retriever:
+            self.retriever.interaction_index = None
+    
+    def _load_interaction_index(self):
+        """Open the prebuilt interaction index if it matches the ingested corpus."""
+        index = InteractionIndex.load(self.interaction_index_dir)
+        if index is None:
+            return None
+        manifest = IngestionManifest(self.manifest_path)
+        if manifest.exists and manifest.fingerprint() != index.fingerprint:
+            print("Interaction index is out of date; rebuild it with python interaction_index.py")
+            return None
+        return index
+    
+    def _backfill_lexical_index(self, vectorstore, batch_size=500):
+        """Build the BM25 index from the chunks already in the vector store."""
+        total = vectorstore._collection.count()
+        for offset in range(0, total, batch_size):
+            stored = vectorstore.get(limit=batch_size, offset=offset)
+            self.lexical_index.add([
+                Document(page_content=text, metadata=dict(metadata or {}, chunk_id=cid))
+                for cid, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+            ])
+        print(f"Built lexical index for {total} stored chunks")
+    
+    def _make_embeddings(self):
+        """Create the configured embedding backend."""
+        if self.embedding_backend == "onnx":
+            from onnx_embeddings import OnnxEmbeddings
+            return OnnxEmbeddings(
+                self.onnx_model_dir,
+                batch_size=self.embedding_batch_size,
+                normalize_embeddings=self.normalize_embeddings or None,
+            )
+        if self.embedding_backend != "huggingface":
+            raise ValueError(f"Unknown embedding backend: {self.embedding_backend}")
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(
+            model_name=self.embedding_model,
+            model_kwargs={"device": self.embedding_device},
+            encode_kwargs={
+                "batch_size": self.embedding_batch_size,
+                "normalize_embeddings": self.normalize_embeddings,
+            },
+        )
+    
+    def _embedding_namespace(self, embeddings):
+        """Identify the embedding model and settings that produced a vector."""
+        if self.custom_embeddings is not None:
+            return f"custom:{type(embeddings).__name__}"
+        if self.embedding_backend == "onnx":
+            return f"onnx:{embeddings.identity()}:{self.normalize_embeddings}"
+        return f"huggingface:{self.embedding_model}:{self.normalize_embeddings}"
+    
+    def _precompute_lexicon_embeddings(self):
+        """Embed the per-drug lookup query for every known drug name once, pinned in the cache."""
+        added = self.embedding_cache.precompute(
+            DRUG_QUERY.format(name) for name in lexicon_names(self.interaction_index)
+        )
+        if added:
+            print(f"Precomputed {added} drug lexicon embeddings")
+    
+    def _open_compact_store(self, vectorstore, embeddings):
+        """Open the compact store, rebuilding it from Chroma if it is missing or out of date."""
+        store = CompactVectorStore.load(self.compact_store_dir, embeddings, self.rerank_candidates)
+        stored_ids = vectorstore.get(include=[])["ids"]
+        if (store is None or store.mode != self.compact_store_mode
+                or store.fingerprint != corpus_fingerprint(stored_ids)):
+            CompactVectorStore.build(vectorstore, self.compact_store_dir, mode=self.compact_store_mode)
+            store = CompactVectorStore.load(self.compact_store_dir, embeddings, self.rerank_candidates)
+        return store
+    
+    def _notify_corpus_changed(self):
+        for callback in self._corpus_listeners:
+            callback()
+    
+    def _sync_chroma(self, embeddings, chunks, stale_ids, reset):
+        """Bring the Chroma store and the derived indexes up to date with the ingested chunks."""
+        from langchain_community.vectorstores import Chroma
         
         # Create or load vector store
-        if os.path.exists(self.persist_dir) and os.listdir(self.persist_dir):
+        vectorstore = Chroma(persist_directory=self.persist_dir, embedding_function=embeddings)
+        if reset:
+            vectorstore.delete_collection()
             vectorstore = Chroma(persist_directory=self.persist_dir, embedding_function=embeddings)
-            
-            # Add new chunks if provided
-            if chunks:
-                vectorstore.add_documents(chunks)
-                vectorstore.persist()
-        else:
-            vectorstore = Chroma.from_documents(
-                documents=chunks,
-                embedding=embeddings,
-                persist_directory=self.persist_dir
+            self.lexical_index.clear()
+        
+        # Embed and add new chunks in streamed batches, indexing them for BM25 as well
+        changed = False
+        if chunks:
+            pipeline = EmbeddingPipeline(
+                embeddings,
+                batch_size=self.embedding_batch_size,
+                num_workers=self.embedding_workers,
+                on_batch=self.lexical_index.add,
             )
+            self.embedding_stats = pipeline.run(vectorstore, chunks)
+            changed = self.embedding_stats["chunks"] > 0
+        
+        # Stale IDs are only known once a streamed chunk iterable is exhausted
+        if stale_ids:
+            vectorstore.delete(ids=list(stale_ids))
+            self.lexical_index.delete(stale_ids)
+            changed = True
+        
+        # Stores written before the lexical index existed are backfilled once
+        if self.lexical_index.count() == 0 and vectorstore._collection.count() > 0:
+            self._backfill_lexical_index(vectorstore)
+        
+        if changed:
             vectorstore.persist()
+            self._notify_corpus_changed()
+        
+        self.vectorstore = self.chroma_store = vectorstore
+        if self.vector_store == "compact":
+            self.vectorstore = self._open_compact_store(vectorstore, embeddings)
+        if not changed:
+            self.interaction_index = self._load_interaction_index()
+    
+    def _open_prepared(self, embeddings):
+        """Serve the store and indexes left by an earlier ingestion without writing to them."""
+        from langchain_community.vectorstores import Chroma
+        
+        lexical_path = os.path.join(self.persist_dir, "bm25.sqlite")
+        if not os.path.exists(lexical_path):
+            raise ValueError(f"No ingested index in {self.persist_dir}; ingest the PDFs first")
+        self.lexical_index = BM25Index(lexical_path, read_only=True)
+        vectorstore = Chroma(persist_directory=self.persist_dir, embedding_function=embeddings)
+        self.vectorstore = self.chroma_store = vectorstore
+        if self.vector_store == "compact":
+            store = CompactVectorStore.load(self.compact_store_dir, embeddings, self.rerank_candidates)
+            if (store is not None and store.mode == self.compact_store_mode
+                    and store.fingerprint == corpus_fingerprint(vectorstore.get(include=[])["ids"])):
+                self.vectorstore = store
+            else:
+                print("Compact store is missing or out of date; serving from Chroma")
+        self.interaction_index = self._load_interaction_index()
+    
+    def _open_snapshot(self, snapshot, embeddings):
+        """Serve the vector, BM25 and interaction indexes of a prebuilt snapshot."""
+        snapshot.check_embeddings(self._embedding_namespace(self.base_embeddings), embeddings)
+        self.snapshot = snapshot
+        self.vectorstore = snapshot.vector_store(embeddings, self.rerank_candidates)
+        self.lexical_index = snapshot.lexical_index()
+        self.interaction_index = snapshot.interaction_index()
+        print(f"Opened index snapshot {snapshot.version} ({snapshot.meta['chunks']} chunks)")
+    
+    def snapshot_pending(self):
+        """True when the snapshot root's CURRENT pointer names a version other than the one served."""
+        if self.snapshot is None or self.snapshot.root is None:
+            return False
+        return current_version(self.snapshot.root) != self.snapshot.version
+    
+    def switch_snapshot(self):
+        """Move to the snapshot version the root's CURRENT pointer names now.
         
+        The new version is opened and checked completely before a single
+        reference swap of the retriever, so requests in flight finish on the
+        old index and later ones use the new one. Returns (switched, message).
+        """
+        if not self.snapshot_pending():
+            return False, "No new index snapshot to switch to"
+        version = current_version(self.snapshot.root)
+        try:
+            snapshot = IndexSnapshot(self.snapshot.root, verify=self.verify_snapshot)
+            embeddings = self.vectorstore.embeddings
+            snapshot.check_embeddings(self._embedding_namespace(self.base_embeddings), embeddings)
+            vectorstore = snapshot.vector_store(embeddings, self.rerank_candidates)
+            lexical_index = snapshot.lexical_index()
+            interaction_index = snapshot.interaction_index()
+        except (OSError, ValueError) as e:
+            return False, f"Could not switch to index snapshot {version}: {str(e)}"
+        retriever = self._make_retriever(vectorstore, lexical_index, interaction_index)
+        self.snapshot = snapshot
         self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.interaction_index = interaction_index
+        previous, self.retriever = self.retriever, retriever
+        previous.close()
+        return True, f"Switched to index snapshot {snapshot.version}"
+    
+    @property
+    def answer_namespace(self):
+        """Answers are cached per LLM, prompt template and index snapshot."""
+        namespace = f"{self.model_name}#{PROMPT_VERSION}"
+        return f"{namespace}@{self.snapshot.version}" if self.snapshot else namespace
+    
+    def _route(self, current_meds, allergies, conditions, new_meds, patient_info, output_format):
+        """Pick the model tier and token budget for one request."""
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}")
+        with tracer.span("route") as span:
+            route = self.router.route(current_meds, allergies, conditions, new_meds, patient_info,
+                                      output_format, self.interaction_index)
+            span.set(tier=route["tier"], model=route["model"], num_predict=route["num_predict"])
+        return route
+    
+    def _route_namespace(self, route, output_format):
+        """Answers differ per routed model, token budget and output format."""
+        return f"{self.answer_namespace}/{route['model']}/{route['num_predict']}/{output_format}"
+    
+    @staticmethod
+    def _generation_kwargs(route, output_format):
+        kwargs = {"model": route["model"], "num_predict": route["num_predict"]}
+        if output_format == "structured":
+            kwargs["format"] = "json"
+        return kwargs
+    
+    @staticmethod
+    def _analysis_fields(text, output_format):
+        """Response fields for the generated text; structured answers are parsed."""
+        if output_format != "structured":
+            return {"analysis": text}
+        try:
+            structured = parse_structured_analysis(text)
+        except ValueError as e:
+            # Keep the raw text so nothing is lost; callers can retry in prose
+            return {"analysis": text, "interactions": None, "disclaimer": DISCLAIMER,
+                    "parse_error": str(e)}
+        return {"analysis": structured["summary"], "interactions": structured["interactions"],
+                "disclaimer": DISCLAIMER}
+    
+    def _llm_for(self, endpoint):
+        """The LLM that generates on ``endpoint``; a custom LLM serves every slot."""
+        if self.custom_llm or endpoint == self.scheduler.endpoints[0]:
+            return self.llm
+        if endpoint not in self._endpoint_llms:
+            from langchain_community.llms import Ollama
+            self._endpoint_llms[endpoint] = Ollama(
+                model=self.model_name,
+                temperature=0.1,
+                num_predict=2048,
+                keep_alive="5m",
+                base_url=endpoint
+            )
+        return self._endpoint_llms[endpoint]
+    
+    def _make_retriever(self, vectorstore, lexical_index, interaction_index):
+        return EntityRetriever(
+            vectorstore,
+            k_per_lookup=self.retrieval_k_per_lookup,
+            token_budget=self.context_token_budget,
+            interaction_index=interaction_index,
+            lexical_index=lexical_index,
+        )
+    
+    def initialize(self, chunks, stale_ids=None, reset=False):
+        """Initialize the entire model in one step.
+        
+        ``chunks`` (a list or a lazy iterable) are only the chunks that still
+        need embedding; each is stored under its ``chunk_id`` (derived from its
+        source, page and text when untagged) so re-ingesting it never creates
+        duplicates. ``stale_ids`` are removed from the store, and
+        ``reset`` drops a store that predates the ingestion manifest. With
+        ``snapshot_dir`` or ``read_only`` set, the snapshot or the existing
+        store is opened instead and the arguments are ignored.
+        """
+        # The Ollama (and in _sync_chroma the Chroma) stack is imported where
+        # it is used, not at module level, so importing this module stays cheap
+        from langchain_community.llms import Ollama
+        
+        # Create embeddings
+        embeddings = self.base_embeddings = self.custom_embeddings or self._make_embeddings()
+        if self.embedding_cache_size:
+            embeddings = self.embedding_cache = CachedEmbeddings(
+                embeddings,
+                os.path.join(self.persist_dir, "embedding_cache.sqlite"),
+                self._embedding_namespace(embeddings),
+                max_entries=self.embedding_cache_size,
+            )
+        
+        if self.snapshot_dir:
+            self._open_snapshot(IndexSnapshot(self.snapshot_dir, verify=self.verify_snapshot), embeddings)
+        elif self.read_only:
+            self._open_prepared(embeddings)
+        else:
+            self._sync_chroma(embeddings, chunks, stale_ids, reset)
+        # Only a node that ingests warms the cache; snapshot and read-only nodes leave it to queries
+        if self.embedding_cache is not None and not (self.read_only or self.snapshot_dir):
+            self._precompute_lexicon_embeddings()
+        if self.answer_cache_similarity:
+            self.answer_cache.embed_fn = embeddings.embed_query
         
         # Initialize LLM
-        self.llm = Ollama(
+        self.llm = self.custom_llm or Ollama(
             model=self.model_name,
             temperature=0.1,
             num_predict=2048,
             keep_alive="5m",
-            base_url="http://10.145.138.115:11434" 
+            base_url=self.ollama_base_urls[0]
         )
         
-        # Configure retriever
-        retriever = self.vectorstore.as_retriever(
-            search_type="mmr",
-            search_kwargs={
-                "k": 5,
-                "fetch_k": 15,
-                "lambda_mult": 0.7
-            }
+        # Pooled async client over every configured Ollama endpoint
+        self.ollama_pool = OllamaEndpointPool(
+            self.ollama_base_urls,
+            self.model_name,
+            max_concurrency=self.ollama_concurrency,
+            per_endpoint_concurrency=self.per_endpoint_concurrency,
+            timeout=self.ollama_timeout,
+            keep_alive="5m",
+            options={"temperature": 0.1, "num_predict": 2048}
         )
         
-        # Create custom prompt template
-        prompt_template = """
-        You are a friendly medical assistant focusing on drug interactions and safety concerns.
-        
-        Context information from medical literature:
-        {context}
-        
-        Based on the context information and your knowledge, answer the following query:
-        {question}
-        
-        Focus on identifying potential negative interactions, side effects, or concerns.
-        Don't provide treatment suggestions or next steps.
-        Be conversational and explain in simple terms, but be comprehensive.
-        Include a disclaimer that you are NOT a doctor and this is for informational purposes only.
-        """
+        # Configure targeted per-drug / per-pair retrieval
+        self.retriever = self._make_retriever(self.vectorstore, self.lexical_index, self.interaction_index)
         
+        # Fixed instruction prefix per output format (prose, or the structured
+        # JSON severity list), then the per-request tail
+        self.prompt_prefixes = {"prose": PROSE_PREFIX, "structured": STRUCTURED_PREFIX}
         PROMPT = PromptTemplate(
-            template=prompt_template, 
+            template=PROMPT_TAIL,
             input_variables=["context", "question"]
         )
-        
-        # Create the QA chain
-        self.qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=retriever,
-            return_source_documents=True,
-            chain_type_kwargs={"prompt": PROMPT}
-        )
+        self.prompt = PROMPT
         
         return True
     
-    def format_medical_query(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info=""):
-        """Format structured medical data into a query for the LLM."""
-        query = """
-        You are a friendly medical assistant. Please analyze the following patient information and identify any potential 
-        negative interactions or concerns in a conversational, easy-to-understand way.
+    def format_medical_query(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info="",
+                             word_limit=None):
+        """Format structured medical data into the patient part of the prompt.
         
-        Patient Information:
+        The instructions live in the fixed prompt prefixes; ``word_limit``
+        asks a prose answer to fit the routed token budget.
         """
+        query = ""
         
         if patient_info.get("age") or patient_info.get("gender") or patient_info.get("bp"):
             query += "\nBasic Information:\n"
@@ -144,50 +560,327 @@ class MedicalInteractionModel:
         if additional_info:
             query += f"\nAdditional Information:\n{additional_info}\n"
         
-        # Add specific instructions for the analysis
-        query += """
-        Please analyze for potential interactions and concerns, considering:
-        1. Drug-drug interactions between current and new medications
-        2. Allergy concerns with any medications
-        3. Drug-condition interactions
-        4. Age, gender, or blood pressure related concerns
+        if word_limit:
+            query += f"\nKeep the whole answer under {word_limit} words.\n"
         
-        Be conversational and educational in your response. Organize your answer in clear sections but don't use 
-        numbering or bullet points unless necessary. Explain any medical terms you use.
+        return query
+    
+    def prefetch(self, session, current_meds, allergies, conditions, new_meds):
+        """Run retrieval for the entries entered so far in the background.
         
-        End with a disclaimer that you are NOT a doctor and this analysis is for informational purposes only.
+        ``session`` is a ``retrieval.PrefetchSession``. Call whenever the form
+        changes; lookups for removed entries are cancelled. Pass the session
+        to the analysis to reuse the results.
         """
+        if not self.retriever:
+            return {"started": 0, "cancelled": 0}
+        return self.retriever.update_session(session, current_meds, allergies, conditions, new_meds)
+    
+    def _retrieve_context(self, query, current_meds, allergies, conditions, new_meds, session=None):
+        # Retrieve context per drug, allergy, condition and drug pair
+        docs = self.retriever.retrieve(current_meds, allergies, conditions, new_meds, session=session)
+        if not docs:
+            docs = self.retriever.search(query, k=4)
+        return docs
+    
+    def _build_context(self, docs, current_meds, allergies, conditions, new_meds):
+        """Compress retrieved docs for the prompt; returns (context_docs, token report)."""
+        if self.compressor is None:
+            return docs, {}
+        with tracer.span("compress") as span:
+            terms = entity_terms(extract_entities(current_meds, allergies, conditions, new_meds))
+            context_docs, report = self.compressor.compress(docs, terms)
+            span.set(chunks=len(docs), **report)
+        return context_docs, report
+    
+    def _format_prompt(self, context_docs, query, output_format="prose"):
+        """The fixed prefix for ``output_format`` followed by the per-request tail."""
+        with tracer.span("prompt_build") as span:
+            prefix = self.prompt_prefixes[output_format]
+            prompt = prefix + self.prompt.format(
+                context="\n\n".join(doc.page_content for doc in context_docs),
+                question=query
+            )
+            span.set(tokens=count_tokens(prompt), prefix_tokens=count_tokens(prefix),
+                     bytes=len(prompt.encode("utf-8")))
+        return prompt
+    
+    def _record_llm_timings(self, info, trace=None):
+        """Turn Ollama's prompt_eval/eval statistics into prefill and decode spans."""
+        if info.get("prompt_eval_duration") is not None:
+            tracer.record("llm_prefill", info["prompt_eval_duration"] / 1e9, trace=trace,
+                          tokens=info.get("prompt_eval_count", 0))
+        if info.get("eval_duration") is not None:
+            tracer.record("llm_decode", info["eval_duration"] / 1e9, trace=trace,
+                          tokens=info.get("eval_count", 0))
+    
+    def _format_sources(self, docs):
+        return [
+            dict(
+                {
+                    "source": doc.metadata.get("source", "Unknown"),
+                    "page": doc.metadata.get("page", "Unknown"),
+                    "content": doc.page_content[:150] + "..." if len(doc.page_content) > 150 else doc.page_content
+                },
+                # Monograph chunks locate their full passage for lazy display
+                **{key: doc.metadata[key] for key in SOURCE_LOCATION_KEYS if doc.metadata.get(key) not in (None, "")}
+            )
+            for doc in docs
+        ]
+    
+    def analyze_interactions(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info="",
+                             session=None, priority="interactive", output_format="prose"):
+        """Analyze potential drug interactions based on patient information.
         
-        return query
+        An identical request already in flight is shared rather than repeated,
+        and generation waits for a ``priority`` ("interactive" or "batch")
+        slot; see scheduler.py. The model and token budget are routed by case
+        complexity (routing.py). With ``output_format="structured"`` the
+        answer is a per-pair severity list in "interactions" and a short
+        summary in "analysis".
+        """
+        if not self.llm:
+            return {"error": "System not initialized. Please initialize the system first."}
+        
+        try:
+            with tracer.trace("analyze_interactions") as trace:
+                route = self._route(current_meds, allergies, conditions, new_meds, patient_info, output_format)
+                namespace = self._route_namespace(route, output_format)
+                # Reuse a recent answer for the same (canonicalized) inputs
+                profile = canonical_profile(current_meds, allergies, conditions, new_meds, patient_info)
+                cached = self.answer_cache.get(namespace, profile, additional_info)
+                if cached is not None:
+                    cached["cached"] = True
+                    cached["timings"] = trace.breakdown()
+                    return cached
+                
+                # Identical requests arriving together share one retrieval and generation
+                key = self.scheduler.flight_key(namespace, profile, additional_info)
+                leader, flight = self.scheduler.begin(key)
+                if not leader:
+                    with tracer.span("coalesced_wait"):
+                        response = self.scheduler.shared_result(flight)
+                    response["coalesced"] = True
+                    response["timings"] = trace.breakdown()
+                    return response
+                
+                try:
+                    # Format query
+                    query = self.format_medical_query(
+                        current_meds, allergies, conditions, new_meds, patient_info, additional_info,
+                        route["word_limit"]
+                    )
+                    docs = self._retrieve_context(query, current_meds, allergies, conditions, new_meds, session)
+                    context_docs, compression = self._build_context(
+                        docs, current_meds, allergies, conditions, new_meds
+                    )
+                    prompt = self._format_prompt(context_docs, query, output_format)
+                    
+                    # Get response
+                    with self.scheduler.slot(priority) as endpoint, tracer.span("llm_generate") as span:
+                        span.set(endpoint=endpoint, priority=priority, tier=route["tier"])
+                        generation = self._llm_for(endpoint).generate(
+                            [prompt], **self._generation_kwargs(route, output_format)
+                        ).generations[0][0]
+                    self._record_llm_timings(generation.generation_info or {})
+                    
+                    # Format response with sources
+                    response = dict(
+                        self._analysis_fields(generation.text, output_format),
+                        sources=self._format_sources(docs),
+                        context_tokens=compression,
+                        route=route,
+                    )
+                except BaseException as e:
+                    self.scheduler.finish(key, flight, error=e)
+                    raise
+                self.scheduler.finish(key, flight, result=response)
+
+                # A structured answer that failed to parse is not pinned for later requests
+                if not response.get("parse_error"):
+                    self.answer_cache.put(namespace, profile, additional_info, response)
+                response["timings"] = trace.breakdown()
+                return response
+            
+        except Exception as e:
+            return {"error": f"Error analyzing interactions: {str(e)}"}
     
-    def analyze_interactions(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info=""):
-        """Analyze potential drug interactions based on patient information."""
-        if not self.qa_chain:
+    async def aanalyze_interactions(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info="",
+                                    session=None, priority="interactive", output_format="prose"):
+        """Asyncio version of analyze_interactions using the pooled Ollama client.
+        
+        Retrieval runs in a worker thread; generation is a non-blocking HTTP
+        call, so many concurrent requests can share the Ollama servers from one
+        event loop.
+        """
+        if not self.llm:
             return {"error": "System not initialized. Please initialize the system first."}
         
         try:
-            # Format query
-            query = self.format_medical_query(
-                current_meds, allergies, conditions, new_meds, patient_info, additional_info
-            )
+            with tracer.trace("aanalyze_interactions") as trace:
+                route = self._route(current_meds, allergies, conditions, new_meds, patient_info, output_format)
+                namespace = self._route_namespace(route, output_format)
+                profile = canonical_profile(current_meds, allergies, conditions, new_meds, patient_info)
+                cached = self.answer_cache.get(namespace, profile, additional_info)
+                if cached is not None:
+                    cached["cached"] = True
+                    cached["timings"] = trace.breakdown()
+                    return cached
+                
+                key = self.scheduler.flight_key(namespace, profile, additional_info)
+                leader, flight = self.scheduler.begin(key)
+                if not leader:
+                    with tracer.span("coalesced_wait"):
+                        response = await self.scheduler.ashared_result(flight)
+                    response["coalesced"] = True
+                    response["timings"] = trace.breakdown()
+                    return response
+                
+                try:
+                    query = self.format_medical_query(
+                        current_meds, allergies, conditions, new_meds, patient_info, additional_info,
+                        route["word_limit"]
+                    )
+                    docs = await asyncio.to_thread(
+                        self._retrieve_context, query, current_meds, allergies, conditions, new_meds, session
+                    )
+                    context_docs, compression = self._build_context(
+                        docs, current_meds, allergies, conditions, new_meds
+                    )
+                    prompt = self._format_prompt(context_docs, query, output_format)
+                    async with self.scheduler.aslot(priority) as endpoint:
+                        with tracer.span("llm_generate") as span:
+                            kwargs = self._generation_kwargs(route, output_format)
+                            result = await self.ollama_pool.generate(
+                                prompt, options={"num_predict": kwargs.pop("num_predict")}, endpoint=endpoint, **kwargs
+                            )
+                            span.set(endpoint=result.get("endpoint"), priority=priority, tier=route["tier"])
+                    self._record_llm_timings(result)
+                    
+                    response = dict(
+                        self._analysis_fields(result["response"], output_format),
+                        sources=self._format_sources(docs),
+                        context_tokens=compression,
+                        route=route,
+                    )
+                except BaseException as e:
+                    self.scheduler.finish(key, flight, error=e)
+                    raise
+                self.scheduler.finish(key, flight, result=response)
+                # A structured answer that failed to parse is not pinned for later requests
+                if not response.get("parse_error"):
+                    self.answer_cache.put(namespace, profile, additional_info, response)
+                response["timings"] = trace.breakdown()
+                return response
             
-            # Get response
-            result = self.qa_chain({"query": query})
+        except Exception as e:
+            return {"error": f"Error analyzing interactions: {str(e)}"}
+    
+    def stream_analysis(self, current_meds, allergies, conditions, new_meds, patient_info, additional_info="",
+                        session=None, priority="interactive"):
+        """Stream the analysis as it is generated.
+        
+        Yields event dicts: one {"type": "sources"} event as soon as retrieval
+        is done, then {"type": "token", "text": ...} events as Ollama produces
+        them, and finally {"type": "done", "analysis": ..., "metrics": ...}
+        with time-to-first-token, tokens/sec and the timing breakdown. A reused
+        answer has ``"cached": True`` metrics with only the replay's own timing.
+        Failures yield a single {"type": "error"} event.
+        """
+        if not self.llm:
+            yield {"type": "error", "error": "System not initialized. Please initialize the system first."}
+            return
+        
+        flight = None
+        try:
+            start = time.perf_counter()
+            # The trace context is only entered around code that does not yield,
+            # so it never leaks into the consumer between events
+            with tracer.trace("stream_analysis") as trace:
+                # Streams are read as they arrive, so they are always prose
+                output_format = "prose"
+                route = self._route(current_meds, allergies, conditions, new_meds, patient_info, output_format)
+                namespace = self._route_namespace(route, output_format)
+                profile = canonical_profile(current_meds, allergies, conditions, new_meds, patient_info)
+                cached = self.answer_cache.get(namespace, profile, additional_info)
+                reused = "cached"
+                if cached is None:
+                    # A follower replays the leader's finished answer like a cache hit
+                    key = self.scheduler.flight_key(namespace, profile, additional_info)
+                    leader, shared = self.scheduler.begin(key)
+                    if leader:
+                        flight = shared
+                    else:
+                        # Not ours to finish: a failed leader already published its error
+                        with tracer.span("coalesced_wait"):
+                            cached = self.scheduler.shared_result(shared)
+                        reused = "coalesced"
+                if cached is None:
+                    query = self.format_medical_query(
+                        current_meds, allergies, conditions, new_meds, patient_info, additional_info,
+                        route["word_limit"]
+                    )
+                    docs = self._retrieve_context(query, current_meds, allergies, conditions, new_meds, session)
+                    sources = self._format_sources(docs)
+                    context_docs, compression = self._build_context(
+                        docs, current_meds, allergies, conditions, new_meds
+                    )
+                    prompt = self._format_prompt(context_docs, query, output_format)
             
-            # Format response with sources
-            response = {
-                "analysis": result["result"],
-                "sources": [
-                    {
-                        "source": doc.metadata.get("source", "Unknown"),
-                        "page": doc.metadata.get("page", "Unknown"),
-                        "content": doc.page_content[:150] + "..." if len(doc.page_content) > 150 else doc.page_content
-                    }
-                    for doc in result.get("source_documents", [])
-                ]
-            }
+            if cached is not None:
+                yield {"type": "sources", "sources": cached.get("sources", [])}
+                yield {"type": "token", "text": cached["analysis"]}
+                # Nothing was generated, so only this replay's own timing is reported
+                elapsed = round(time.perf_counter() - start, 3)
+                metrics = {"cached": True, "ttft_seconds": elapsed, "total_seconds": elapsed,
+                           "route": cached.get("metrics", {}).get("route"), "timings": trace.breakdown()}
+                yield {"type": "done", "analysis": cached["analysis"], reused: True, "metrics": metrics}
+                return
+            
+            yield {"type": "sources", "sources": sources}
             
-            return response
+            parts = []
+            llm_start = time.perf_counter()
+            first_token_at = None
+            # The slot is held while the consumer reads, as Ollama keeps generating
+            with self.scheduler.slot(priority) as endpoint:
+                for text in self._llm_for(endpoint).stream(prompt, **self._generation_kwargs(route, output_format)):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    parts.append(text)
+                    yield {"type": "token", "text": text}
+            end = time.perf_counter()
+            
+            # Ollama's own prefill/decode split is not exposed by llm.stream();
+            # time to first token (prefill) and the remainder (decode) are measured here
+            decode_seconds = end - first_token_at if first_token_at else 0.0
+            if first_token_at:
+                tracer.record("llm_prefill", first_token_at - llm_start, trace=trace,
+                              tokens=count_tokens(prompt))
+            tracer.record("llm_decode", decode_seconds, trace=trace, tokens=len(parts))
+            
+            analysis = "".join(parts)
+            metrics = {
+                "ttft_seconds": round(first_token_at - start, 3) if first_token_at else None,
+                "total_seconds": round(end - start, 3),
+                "tokens": len(parts),
+                "tokens_per_second": round(len(parts) / decode_seconds, 2) if decode_seconds > 0 else None,
+                "context_tokens": compression,
+                "route": route,
+            }
+            result = {"analysis": analysis, "sources": sources, "metrics": metrics}
+            self.scheduler.finish(key, flight, result=result)
+            flight = None
+            self.answer_cache.put(namespace, profile, additional_info, result)
+            metrics["timings"] = trace.breakdown()
+            yield {"type": "done", "analysis": analysis, "metrics": metrics}
             
         except Exception as e:
-            return {"error": f"Error analyzing interactions: {str(e)}"}
\ No newline at end of file
+            if flight is not None:
+                self.scheduler.finish(key, flight, error=e)
+                flight = None
+            yield {"type": "error", "error": f"Error analyzing interactions: {str(e)}"}
+        finally:
+            # Closed by the consumer before the answer was complete
+            if flight is not None:
+                self.scheduler.finish(key, flight, error=GeneratorExit())
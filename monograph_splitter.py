@@ -0,0 +1,231 @@
+import re
+from langchain.docstore.document import Document
+from interaction_index import is_drug_name
+
+# Running page header of the reference book: page number, "CHAPTER 51" or
+# "SECTION 12", then the chapter or section title
+PAGE_NUMBER_RE = re.compile(r"^\d{1,4}$")
+RUNNING_HEAD_RE = re.compile(r"^(CHAPTER|SECTION)\s+\d+$")
+HEADING_RE = re.compile(r"^[A-Z][A-Z \-()/&'β]{3,}$")
+NUMBERED_HEADING_RE = re.compile(r"^\d{1,2}\.\s+[A-Z][A-Za-z\-() ]{2,48}$")
+TABLE_RE = re.compile(r"^TABLE\s+\d+\.\d+\b")
+TABLE_ROW_RE = re.compile(r"^\d{1,2}\.\s")
+# A paragraph that opens with a drug name, e.g. "Amoxicillin It is a close congener..."
+RUN_IN_DRUG_RE = re.compile(r"^([A-Z][a-z][a-z\-]+(?: [a-z][a-z\-]+)?)\s+(?=[A-Z(])")
+SENTENCE_END = (".", ":", ";", "?", "!")
+
+
+class _Line:
+    __slots__ = ("text", "page", "start", "end", "chapter")
+
+    def __init__(self, text, page, start, end, chapter):
+        self.text = text
+        self.page = page
+        self.start = start
+        self.end = end
+        self.chapter = chapter
+
+
+class MonographSplitter:
+    """Splits drug-monograph text into section-aligned chunks.
+
+    Pages are fed in order (``feed``) and chunks come out as soon as their
+    section is complete, so a section can run across pages. Running page
+    headers are dropped. A chunk never spans two headed sections or two drug
+    monographs unless the earlier one is shorter than ``min_chunk_size``;
+    sections longer than ``chunk_size`` are cut at sentence-ending lines, and
+    nothing is repeated between chunks. Tables become chunks of their own.
+
+    Each chunk carries ``chapter``, ``section``, ``drug`` (the monograph it
+    belongs to) and ``drugs`` (every monograph it covers), ``chunk_type``
+    ("text", "table" or "interaction_table"), and its location: ``page`` /
+    ``end_page`` and ``start_offset`` / ``end_offset``, character offsets into
+    pypdf's extracted text of those pages (see ``data_loader.read_excerpt``).
+    """
+
+    def __init__(self, source, chunk_size=1000, min_chunk_size=None):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.min_chunk_size = chunk_size // 3 if min_chunk_size is None else min_chunk_size
+        self.chapter = ""
+        self.section = ""
+        self.drug = ""
+        self._lines = []
+        self._drugs = []
+        self._size = 0
+        self._table = None
+        self._prose_run = []
+        self._last_text = ""
+
+    # Page handling
+
+    def _content_lines(self, page, text):
+        """Lines of a page with their offsets, minus the running header."""
+        lines = []
+        position = 0
+        for raw in text.split("\n"):
+            stripped = raw.strip()
+            if stripped:
+                start = position + raw.index(stripped)
+                lines.append((" ".join(stripped.split()), start, start + len(stripped)))
+            position += len(raw) + 1
+        if len(lines) >= 3 and PAGE_NUMBER_RE.match(lines[0][0]) and RUNNING_HEAD_RE.match(lines[1][0]):
+            if lines[1][0].startswith("CHAPTER"):
+                self.chapter = lines[2][0].title()
+            lines = lines[3:]
+        return [_Line(text, page, start, end, self.chapter) for text, start, end in lines]
+
+    def feed(self, page, text):
+        """Add the next page's text; returns the chunks completed by it."""
+        chunks = []
+        for line in self._content_lines(page, text or ""):
+            chunks.extend(self._add_line(line))
+        return chunks
+
+    def finish(self):
+        """Flush whatever is left at the end of the document."""
+        chunks = self._close_table()
+        chunks.extend(self._flush())
+        return chunks
+
+    # Structure detection
+
+    def _is_heading(self, text):
+        # Brand-name lists in capitals carry strengths or several commas
+        return bool(HEADING_RE.match(text)) and text.count(",") < 2 and len(text.replace(" ", "")) >= 5
+
+    def _paragraph_start(self):
+        return not self._last_text or self._last_text.endswith(SENTENCE_END) or self._is_heading(self._last_text)
+
+    def _run_in_drug(self, text):
+        if not self._paragraph_start():
+            return None
+        match = RUN_IN_DRUG_RE.match(text)
+        if match and is_drug_name(match.group(1)):
+            return match.group(1).lower()
+        return None
+
+    def _table_like(self, text):
+        return bool(TABLE_ROW_RE.match(text)) or len(text) < 45 or bool(re.search(r"\d", text))
+
+    # Chunk assembly
+
+    def _add_line(self, line):
+        chunks = []
+        text = line.text
+        if self._table is not None:
+            if self._table_like(text) and not self._is_heading(text):
+                self._table["lines"].extend(self._prose_run)
+                self._prose_run = []
+                self._table["lines"].append(line)
+                self._last_text = text
+                return chunks
+            # Two prose lines in a row end the table; they belong to the text again
+            self._prose_run.append(line)
+            if len(self._prose_run) < 2 and not self._is_heading(text):
+                return chunks
+            held, self._prose_run = self._prose_run, []
+            chunks.extend(self._close_table())
+            for held_line in held:
+                chunks.extend(self._add_line(held_line))
+            return chunks
+
+        if TABLE_RE.match(text):
+            chunks.extend(self._flush())
+            self._table = {"caption": text, "lines": [line]}
+            self._last_text = text
+            return chunks
+
+        if self._is_heading(text) or NUMBERED_HEADING_RE.match(text) and self._paragraph_start():
+            if (self._is_heading(text) and self._is_heading(self._last_text)
+                    and self._lines and self._lines[-1].text == self._last_text):
+                # A heading set over two lines
+                self.section = f"{self.section} {text.title()}"
+                if is_drug_name(text):
+                    self.drug = text.lower()
+            else:
+                if self._size >= self.min_chunk_size:
+                    chunks.extend(self._flush())
+                self.section = text.title() if self._is_heading(text) else text
+                self.drug = text.lower() if is_drug_name(text) else ""
+                self._note_drug()
+        else:
+            drug = self._run_in_drug(text)
+            if drug and drug != self.drug:
+                if self._size >= self.min_chunk_size:
+                    chunks.extend(self._flush())
+                self.drug = drug
+                self._note_drug()
+
+        if self._lines and self._size + len(text) + 1 > self.chunk_size:
+            chunks.extend(self._flush_oversized())
+        self._lines.append(line)
+        self._size += len(text) + 1
+        self._last_text = text
+        return chunks
+
+    def _note_drug(self):
+        if self.drug and self.drug not in self._drugs:
+            self._drugs.append(self.drug)
+
+    def _flush_oversized(self):
+        """Cut a section that outgrew ``chunk_size`` after its last sentence-ending line."""
+        cut = len(self._lines)
+        for i in range(len(self._lines) - 1, 0, -1):
+            if self._lines[i].text.endswith(SENTENCE_END):
+                cut = i + 1
+                break
+        head, tail = self._lines[:cut], self._lines[cut:]
+        chunk = self._make_chunk(head, "text", self._drugs)
+        self._lines = tail
+        self._size = sum(len(line.text) + 1 for line in tail)
+        self._drugs = [self.drug] if self.drug else []
+        return [chunk]
+
+    def _flush(self):
+        if not self._lines:
+            self._drugs = []
+            return []
+        chunk = self._make_chunk(self._lines, "text", self._drugs)
+        self._lines = []
+        self._size = 0
+        self._drugs = []
+        return [chunk]
+
+    def _close_table(self):
+        if self._table is None:
+            return []
+        table, self._table = self._table, None
+        caption = table["caption"]
+        kind = "interaction_table" if "interaction" in caption.lower() else "table"
+        drugs = [self.drug] if self.drug else []
+        chunks = []
+        part = []
+        size = 0
+        for line in table["lines"]:
+            if part and size + len(line.text) + 1 > self.chunk_size:
+                chunks.append(self._make_chunk(part, kind, drugs, caption=caption))
+                part, size = [], len(caption) + 1
+            part.append(line)
+            size += len(line.text) + 1
+        if part:
+            chunks.append(self._make_chunk(part, kind, drugs, caption=caption))
+        return chunks
+
+    def _make_chunk(self, lines, kind, drugs, caption=None):
+        text = "\n".join(line.text for line in lines)
+        if caption and lines[0].text != caption:
+            # Later parts of a long table repeat its caption so they stand alone
+            text = f"{caption}\n{text}"
+        return Document(page_content=text, metadata={
+            "source": self.source,
+            "page": lines[0].page,
+            "end_page": lines[-1].page,
+            "start_offset": lines[0].start,
+            "end_offset": lines[-1].end,
+            "chapter": lines[0].chapter,
+            "section": caption or self.section,
+            "drug": drugs[0] if drugs else "",
+            "drugs": ", ".join(drugs),
+            "chunk_type": kind,
+        })
@@ -0,0 +1,146 @@
+import asyncio
+import itertools
+import json
+import time
+import httpx
+
+
+class OllamaEndpointPool:
+    """Asyncio client for one or more Ollama servers over pooled keep-alive connections.
+
+    Requests go to the endpoint with the fewest requests in flight (round-robin
+    on ties). ``max_concurrency`` caps requests across all endpoints and
+    ``per_endpoint_concurrency`` caps each server. An endpoint that fails to
+    connect is skipped for ``cooldown_seconds`` and the request is retried
+    once on another endpoint.
+
+    The HTTP client and semaphores belong to the event loop that first uses
+    them; they are recreated if the pool is used from a different loop.
+    """
+
+    def __init__(self, endpoints, model, max_concurrency=8, per_endpoint_concurrency=4,
+                 timeout=300.0, connect_timeout=5.0, keep_alive="5m", options=None,
+                 cooldown_seconds=30.0):
+        if not endpoints:
+            raise ValueError("At least one Ollama endpoint is required")
+        self.endpoints = [url.rstrip("/") for url in endpoints]
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.per_endpoint_concurrency = per_endpoint_concurrency
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.keep_alive = keep_alive
+        self.options = options or {}
+        self.cooldown_seconds = cooldown_seconds
+        self.in_flight = {url: 0 for url in self.endpoints}
+        self.down_until = {url: 0.0 for url in self.endpoints}
+        self._round_robin = itertools.count()
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+        self._endpoint_semaphores = None
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.per_endpoint_concurrency * len(self.endpoints),
+                    max_keepalive_connections=self.per_endpoint_concurrency * len(self.endpoints),
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._endpoint_semaphores = {
+                url: asyncio.Semaphore(self.per_endpoint_concurrency) for url in self.endpoints
+            }
+        return self._client
+
+    def _pick_endpoint(self, exclude=()):
+        now = time.monotonic()
+        candidates = [url for url in self.endpoints if url not in exclude and self.down_until[url] <= now]
+        if not candidates:
+            candidates = [url for url in self.endpoints if url not in exclude] or self.endpoints
+        offset = next(self._round_robin)
+        rotated = candidates[offset % len(candidates):] + candidates[:offset % len(candidates)]
+        return min(rotated, key=lambda url: self.in_flight[url])
+
+    def _payload(self, prompt, stream, options, model=None, format=None):
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": dict(self.options, **(options or {})),
+        }
+        if format:
+            payload["format"] = format
+        return payload
+
+    async def generate(self, prompt, options=None, endpoint=None, model=None, format=None):
+        """Generate a full completion; returns Ollama's response dict (text in "response").
+
+        ``endpoint`` (e.g. assigned by the scheduler) is tried first; ``model``
+        overrides the pool's model and ``format="json"`` constrains the output.
+        """
+        client = self._bind_loop()
+        tried = []
+        async with self._semaphore:
+            while True:
+                if endpoint and not tried and endpoint.rstrip("/") in self.in_flight:
+                    url = endpoint.rstrip("/")
+                else:
+                    url = self._pick_endpoint(exclude=tried)
+                tried.append(url)
+                self.in_flight[url] += 1
+                try:
+                    async with self._endpoint_semaphores[url]:
+                        response = await client.post(
+                            f"{url}/api/generate", json=self._payload(prompt, False, options, model, format)
+                        )
+                    response.raise_for_status()
+                    result = response.json()
+                    result["endpoint"] = url
+                    return result
+                except httpx.TransportError:
+                    self.down_until[url] = time.monotonic() + self.cooldown_seconds
+                    if len(tried) >= min(2, len(self.endpoints)):
+                        raise
+                finally:
+                    self.in_flight[url] -= 1
+
+    async def stream(self, prompt, options=None, model=None, format=None):
+        """Yield Ollama's streamed response objects; the last one has "done": true."""
+        client = self._bind_loop()
+        async with self._semaphore:
+            url = self._pick_endpoint()
+            self.in_flight[url] += 1
+            try:
+                async with self._endpoint_semaphores[url]:
+                    async with client.stream(
+                        "POST", f"{url}/api/generate", json=self._payload(prompt, True, options, model, format)
+                    ) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if line:
+                                yield json.loads(line)
+            except httpx.TransportError:
+                self.down_until[url] = time.monotonic() + self.cooldown_seconds
+                raise
+            finally:
+                self.in_flight[url] -= 1
+
+    def stats(self):
+        """Report in-flight requests and endpoints currently skipped after failures."""
+        now = time.monotonic()
+        return {
+            "in_flight": dict(self.in_flight),
+            "down": [url for url, until in self.down_until.items() if until > now],
+        }
+
+    async def aclose(self):
+        """Close pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
@@ -0,0 +1,239 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+CONFIG_FILE = "embedding_config.json"
+MODEL_FILE = "model.onnx"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class OnnxEmbeddings(Embeddings):
+    """Sentence embeddings from an exported ONNX model, without torch.
+
+    Loads a directory written by ``export_onnx``: the (optionally int8
+    quantized) transformer graph, its fast tokenizer and the pooling
+    settings of the original sentence-transformers model. Only
+    onnxruntime, tokenizers and numpy are needed at run time.
+    """
+
+    def __init__(self, model_dir, batch_size=32, num_threads=None, normalize_embeddings=None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.normalize_embeddings = (
+            self.config["normalize"] if normalize_embeddings is None else normalize_embeddings
+        )
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_id"], pad_token=self.config["pad_token"])
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def identity(self):
+        """Source model, weight type and graph hash; the same for a copy of the export anywhere."""
+        # Exports made before the hash was recorded are hashed here
+        digest = self.config.get("model_sha256") or file_sha256(os.path.join(self.model_dir, MODEL_FILE))
+        self.config["model_sha256"] = digest
+        weights = "int8" if self.config.get("quantized") else "fp32"
+        return f"{self.config['source_model']}:{weights}:{digest[:16]}"
+
+    def _encode(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {k: v for k, v in inputs.items() if k in self.input_names})[0]
+        if self.config["pooling"] == "cls":
+            vectors = hidden[:, 0]
+        else:
+            mask = inputs["attention_mask"][..., None].astype(hidden.dtype)
+            vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize_embeddings:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors
+
+    def embed_documents(self, texts):
+        """Embed a list of texts in batches of ``batch_size``."""
+        vectors = [
+            self._encode([text.replace("\n", " ") for text in texts[i:i + self.batch_size]])
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        return np.concatenate(vectors).tolist() if vectors else []
+
+    def embed_query(self, text):
+        """Embed a single query."""
+        return self.embed_documents([text])[0]
+
+
+def export_onnx(model_name, output_dir, quantize=True, opset=14):
+    """Export a sentence-transformers model to ONNX, with int8 dynamic quantization by default.
+
+    Needs torch and sentence-transformers; the exported directory does not.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    source = SentenceTransformer(model_name, device="cpu")
+    transformer = source[0].auto_model.eval()
+    tokenizer = source.tokenizer
+    # Module classes moved between sentence-transformers releases, so match by name
+    modules = {type(module).__name__: module for module in source}
+    pooling = modules["Pooling"].get_config_dict() if "Pooling" in modules else {}
+    is_cls = pooling.get("pooling_mode") == "cls" or pooling.get("pooling_mode_cls_token")
+
+    os.makedirs(output_dir, exist_ok=True)
+    sample = tokenizer(["warfarin increases the anticoagulant effect"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    fp32_path = os.path.join(output_dir, "model_fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]},
+            opset_version=opset,
+            dynamo=False,
+        )
+
+    model_path = os.path.join(output_dir, MODEL_FILE)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    else:
+        os.replace(fp32_path, model_path)
+
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "source_model": model_name,
+            "quantized": quantize,
+            "model_sha256": file_sha256(model_path),
+            "max_length": source.max_seq_length,
+            "pooling": "cls" if is_cls else "mean",
+            "normalize": "Normalize" in modules,
+            "pad_id": tokenizer.pad_token_id,
+            "pad_token": tokenizer.pad_token,
+        }, f, indent=2)
+    size_mb = os.path.getsize(model_path) / (1024 * 1024)
+    print(f"Exported {model_name} to {model_path} ({size_mb:.1f} MB, {'int8' if quantize else 'fp32'})")
+    return output_dir
+
+
+def _median_ms(fn, texts):
+    timings = []
+    for text in texts:
+        start = time.perf_counter()
+        fn(text)
+        timings.append(time.perf_counter() - start)
+    return round(float(np.median(timings)) * 1000, 2)
+
+
+def _top_k(query_vectors, doc_vectors, k):
+    def unit(m):
+        return m / np.clip(np.linalg.norm(m, axis=1, keepdims=True), 1e-12, None)
+    scores = unit(query_vectors) @ unit(doc_vectors).T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def check_parity(reference, candidate, documents, queries, k=5):
+    """Compare a candidate embedding backend against the fp32 reference.
+
+    Reports the cosine similarity between the two backends' vectors for the
+    same documents, recall@k of the candidate's top-k documents against the
+    reference top-k for every query, and median query-embedding latency.
+    """
+    reference_docs = np.array(reference.embed_documents(documents))
+    candidate_docs = np.array(candidate.embed_documents(documents))
+    cosine = np.sum(reference_docs * candidate_docs, axis=1) / (
+        np.linalg.norm(reference_docs, axis=1) * np.linalg.norm(candidate_docs, axis=1)
+    )
+
+    reference_top = _top_k(np.array([reference.embed_query(q) for q in queries]), reference_docs, k)
+    candidate_top = _top_k(np.array([candidate.embed_query(q) for q in queries]), candidate_docs, k)
+    recall = [len(set(r) & set(c)) / len(r) for r, c in zip(reference_top, candidate_top)]
+
+    return {
+        "documents": len(documents),
+        "queries": len(queries),
+        "cosine_mean": round(float(cosine.mean()), 4),
+        "cosine_min": round(float(cosine.min()), 4),
+        f"recall_at_{k}": round(float(np.mean(recall)), 4),
+        "reference_query_ms": _median_ms(reference.embed_query, queries),
+        "candidate_query_ms": _median_ms(candidate.embed_query, queries),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and validate the ONNX embedding backend.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export the embedding model to ONNX")
+    export.add_argument("--model", default="pritamdeka/S-PubMedBert-MS-MARCO")
+    export.add_argument("--output", default=os.path.join("models", "pubmedbert-onnx-int8"))
+    export.add_argument("--no-quantize", action="store_true", help="Keep fp32 weights")
+
+    check = commands.add_parser("check", help="Compare the ONNX model with the fp32 PyTorch model")
+    check.add_argument("--onnx-dir", default=os.path.join("models", "pubmedbert-onnx-int8"))
+    check.add_argument("--data-dir", default="data", help="Directory with the reference PDFs")
+    check.add_argument("--documents", type=int, default=500, help="Corpus chunks to compare on")
+    check.add_argument("--k", type=int, default=5)
+    check.add_argument("--min-cosine", type=float, default=0.98)
+    check.add_argument("--min-recall", type=float, default=0.9)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model, args.output, quantize=not args.no_quantize)
+        return
+
+    from itertools import islice
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from data_loader import MedicalDataLoader
+    from interaction_index import SEED_LEXICON
+
+    candidate = OnnxEmbeddings(args.onnx_dir)
+    reference = HuggingFaceEmbeddings(
+        model_name=candidate.config["source_model"], model_kwargs={"device": "cpu"},
+        encode_kwargs={"normalize_embeddings": candidate.normalize_embeddings},
+    )
+    documents = [c.page_content for c in islice(MedicalDataLoader(data_dir=args.data_dir).iter_chunks(), args.documents)]
+    drugs = sorted(SEED_LEXICON)
+    queries = drugs + [f"{a} and {b} drug interaction" for a, b in zip(drugs, drugs[1:])]
+
+    report = check_parity(reference, candidate, documents, queries, k=args.k)
+    print(json.dumps(report, indent=2))
+    if report["cosine_min"] < args.min_cosine or report[f"recall_at_{args.k}"] < args.min_recall:
+        print("✗ ONNX embeddings diverge from the reference model; keep the huggingface backend")
+        raise SystemExit(1)
+    print("✓ ONNX embeddings match the reference model")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import zip_longest
+from langchain.docstore.document import Document
+from lexical_index import reciprocal_rank_fusion
+from tokens import count_tokens
+from tracing import run_in_context, tracer
+
+
+# Cache generations are unique across retrievers, so a session never mixes two indexes
+_epochs = itertools.count()
+
+# Per-drug lookup query; also used to precompute embeddings for the drug lexicon
+DRUG_QUERY = "{} adverse effects, contraindications and interactions"
+
+
+def _unique(names):
+    seen = []
+    for name in names:
+        name = " ".join(str(name or "").split()).lower()
+        if name and name not in seen:
+            seen.append(name)
+    return seen
+
+
+def extract_entities(current_meds, allergies, conditions, new_meds):
+    """Pull the normalized drug, allergy and condition names out of the form inputs."""
+    return {
+        "new_meds": _unique(med.get("name") for med in new_meds or []),
+        "current_meds": _unique(med.get("name") for med in current_meds or []),
+        "allergies": _unique(allergy.get("name") for allergy in allergies or []),
+        "conditions": _unique(conditions or []),
+    }
+
+
+def build_lookups(entities):
+    """Return (cache_key, query) pairs: pair lookups first, then single-entity lookups.
+
+    Pairs are every new medication against every current medication and
+    against the other new medications. Pair keys are order-independent, so
+    a pair is looked up once no matter which list its drugs came from.
+    """
+    new_meds = entities["new_meds"]
+    current_meds = [m for m in entities["current_meds"] if m not in new_meds]
+
+    pair_lookups = []
+    seen_pairs = set()
+    for i, drug in enumerate(new_meds):
+        for other in current_meds + new_meds[i + 1:]:
+            pair = tuple(sorted((drug, other)))
+            if pair in seen_pairs:
+                continue
+            seen_pairs.add(pair)
+            pair_lookups.append((("pair",) + pair, f"{pair[0]} and {pair[1]} drug interaction"))
+
+    entity_lookups = []
+    for drug in new_meds + current_meds:
+        entity_lookups.append((("drug", drug), DRUG_QUERY.format(drug)))
+    for allergy in entities["allergies"]:
+        entity_lookups.append((("allergy", allergy), f"{allergy} allergy and cross-sensitivity"))
+    for condition in entities["conditions"]:
+        entity_lookups.append((("condition", condition), f"drugs to avoid or use with caution in {condition}"))
+
+    return pair_lookups + entity_lookups
+
+
+class PrefetchSession:
+    """Lookups started for one patient form while it is still being filled in.
+
+    Holds a future per lookup key; ``EntityRetriever.update_session`` keeps
+    it in step with the form and ``EntityRetriever.retrieve`` reuses its
+    futures, so only generation is left when the analysis is requested.
+    """
+
+    def __init__(self):
+        self.futures = {}
+        self.epoch = None
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        """Cancel every lookup that has not started yet and forget the rest."""
+        with self.lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures.clear()
+
+
+def document_key(doc):
+    """Identify a chunk by its stored ID, falling back to a hash of its text."""
+    return doc.metadata.get("chunk_id") or hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+class EntityRetriever:
+    """Targeted per-entity and per-drug-pair retrieval with an LRU result cache.
+
+    Every lookup runs concurrently against the vector store; results are
+    interleaved so each lookup contributes its best chunk before any gets a
+    second one, deduplicated, and cut off at ``token_budget`` context tokens.
+    Lookups are cached by entity/pair, so adding a drug only costs its new pairs.
+    With an ``interaction_index``, drug pairs the reference text mentions
+    together are answered from the co-mention index without a vector search.
+    With a ``lexical_index``, each search fuses BM25 and dense rankings with
+    reciprocal rank fusion, which keeps rare drug names from being blurred
+    together by the embedding model.
+    """
+
+    def __init__(self, vectorstore, k_per_lookup=2, token_budget=1500, max_workers=8, cache_size=512,
+                 interaction_index=None, lexical_index=None, candidates_per_retriever=8):
+        self.vectorstore = vectorstore
+        self.interaction_index = interaction_index
+        self.lexical_index = lexical_index
+        self.candidates_per_retriever = candidates_per_retriever
+        self.k_per_lookup = k_per_lookup
+        self.token_budget = token_budget
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # Prefetched keys (with a count of prefetched blocks needing them) are
+        # not evicted until released; the cache may exceed cache_size meanwhile
+        self._pinned = {}
+        # Changes whenever the cache is cleared, so prefetch sessions notice the corpus changed
+        self.epoch = next(_epochs)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _submit(self, fn, *args):
+        """Run ``fn`` on the lookup pool, or inline once ``close`` has shut the pool down."""
+        try:
+            return run_in_context(self._pool, fn, *args)
+        except RuntimeError:
+            # A request still holding this retriever when a snapshot switch closed it
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+    def close(self):
+        """Stop the lookup threads once the lookups already running finish."""
+        self._pool.shutdown(wait=False)
+
+    def _cached(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def _store(self, key, docs):
+        with self._lock:
+            self._cache[key] = docs
+            self._cache.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        """Drop least-recently-used unpinned entries beyond ``cache_size``; call with the lock held."""
+        excess = len(self._cache) - self.cache_size
+        if excess <= 0:
+            return
+        victims = []
+        for key in self._cache:
+            if len(victims) >= excess:
+                break
+            if key not in self._pinned:
+                victims.append(key)
+        for key in victims:
+            del self._cache[key]
+
+    def _indexed_docs(self, key):
+        """Fetch co-mention evidence for a pair lookup from the interaction index."""
+        if self.interaction_index is None or key[0] != "pair":
+            return None
+        with tracer.span("interaction_index_lookup") as span:
+            ids = self.interaction_index.pair_chunks(key[1], key[2])[:self.k_per_lookup]
+            span.set(results=len(ids))
+        if not ids:
+            return None
+        found = self.vectorstore.get(ids=ids)
+        by_id = {
+            cid: Document(page_content=text, metadata=metadata or {})
+            for cid, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+        }
+        docs = [by_id[cid] for cid in ids if cid in by_id]
+        return docs or None
+
+    def search(self, query, k, vector=None):
+        """Hybrid search: dense (by text or precomputed ``vector``) fused with BM25."""
+        fetch = k if self.lexical_index is None else max(k, self.candidates_per_retriever)
+        with tracer.span("vector_search") as span:
+            if vector is not None:
+                dense = self.vectorstore.similarity_search_by_vector(vector, k=fetch)
+            else:
+                dense = self.vectorstore.similarity_search(query, k=fetch)
+            span.set(results=len(dense))
+        if self.lexical_index is None:
+            return dense
+
+        with tracer.span("lexical_search") as span:
+            lexical = self.lexical_index.search(query, k=fetch)
+            span.set(results=len(lexical))
+        return reciprocal_rank_fusion([lexical, dense], key=document_key)[:k]
+
+    def lookup(self, key, query):
+        """Run one targeted lookup, served from the cache when possible."""
+        docs = self._cached(key)
+        if docs is None:
+            docs = self._indexed_docs(key)
+            if docs is None:
+                docs = self.search(query, self.k_per_lookup)
+            self._store(key, docs)
+        return docs
+
+    def prefetch(self, profiles):
+        """Warm the lookup cache for many profiles at once.
+
+        ``profiles`` yields (current_meds, allergies, conditions, new_meds)
+        tuples. All uncached lookups are embedded in one batched call and
+        searched by vector. The block's lookups stay pinned in the cache until
+        ``release`` is called with the same profiles, so they survive until
+        the profiles are analyzed. Returns the number of lookups run.
+        """
+        lookups = OrderedDict()
+        for profile in profiles:
+            lookups.update(build_lookups(extract_entities(*profile)))
+        with self._lock:
+            for key in lookups:
+                self._pinned[key] = self._pinned.get(key, 0) + 1
+
+        pending = OrderedDict()
+        for key, query in lookups.items():
+            if self._cached(key) is not None:
+                continue
+            docs = self._indexed_docs(key)
+            if docs is not None:
+                self._store(key, docs)
+            else:
+                pending[key] = query
+        if not pending:
+            return 0
+
+        with tracer.span("query_embed", texts=len(pending)):
+            vectors = self.vectorstore.embeddings.embed_documents(list(pending.values()))
+        futures = [
+            self._submit(self.search, query, self.k_per_lookup, vector)
+            for query, vector in zip(pending.values(), vectors)
+        ]
+        for key, future in zip(pending, futures):
+            self._store(key, future.result())
+        return len(pending)
+
+    def release(self, profiles):
+        """Unpin the lookups of a block passed to ``prefetch`` once it has been analyzed."""
+        keys = set()
+        for profile in profiles:
+            keys.update(key for key, _ in build_lookups(extract_entities(*profile)))
+        with self._lock:
+            for key in keys:
+                count = self._pinned.get(key, 0) - 1
+                if count > 0:
+                    self._pinned[key] = count
+                else:
+                    self._pinned.pop(key, None)
+            self._evict()
+
+    def clear_cache(self):
+        """Forget cached lookups, e.g. because the corpus changed."""
+        with self._lock:
+            self._cache.clear()
+            self.epoch = next(_epochs)
+
+    def update_session(self, session, current_meds, allergies, conditions, new_meds):
+        """Start the lookups a partly filled form needs and cancel the ones it no longer does.
+
+        Lookups already running cannot be interrupted; their results still
+        land in the shared cache. Returns {"started": n, "cancelled": n}.
+        """
+        lookups = dict(build_lookups(extract_entities(current_meds, allergies, conditions, new_meds)))
+        with tracer.span("prefetch") as span, session.lock:
+            if session.epoch != self.epoch:
+                # Results fetched before the corpus changed are stale
+                for future in session.futures.values():
+                    future.cancel()
+                session.futures.clear()
+                session.epoch = self.epoch
+            stale = [key for key in session.futures if key not in lookups]
+            for key in stale:
+                session.futures.pop(key).cancel()
+            started = 0
+            for key, query in lookups.items():
+                if key not in session.futures:
+                    session.futures[key] = self._submit(self.lookup, key, query)
+                    started += 1
+            span.set(started=started, cancelled=len(stale))
+        return {"started": started, "cancelled": len(stale)}
+
+    def retrieve(self, current_meds, allergies, conditions, new_meds, session=None):
+        """Return the merged, deduplicated context documents for a patient profile.
+
+        Lookups a ``PrefetchSession`` already started are reused instead of run again.
+        """
+        lookups = build_lookups(extract_entities(current_meds, allergies, conditions, new_meds))
+        prefetched = {}
+        if session is not None:
+            with session.lock:
+                if session.epoch == self.epoch:
+                    prefetched = dict(session.futures)
+        futures = [
+            prefetched.get(key) or self._submit(self.lookup, key, query)
+            for key, query in lookups
+        ]
+        with tracer.span("retrieve", lookups=len(lookups)) as span:
+            docs = self.merge([future.result() for future in futures])
+            span.set(chunks=len(docs), prefetched=sum(1 for key, _ in lookups if key in prefetched))
+        return docs
+
+    def merge(self, result_lists):
+        """Interleave ranked result lists, dropping duplicates, within the token budget."""
+        merged = []
+        seen = set()
+        used_tokens = 0
+        for rank in zip_longest(*result_lists):
+            for doc in rank:
+                if doc is None:
+                    continue
+                key = document_key(doc)
+                if key in seen:
+                    continue
+                tokens = count_tokens(doc.page_content)
+                if merged and used_tokens + tokens > self.token_budget:
+                    continue
+                seen.add(key)
+                used_tokens += tokens
+                merged.append(doc)
+        return merged
@@ -0,0 +1,91 @@
+import os
+from retrieval import build_lookups, extract_entities
+
+TIERS = ("light", "standard", "complex")
+# Generation budgets (Ollama num_predict) per tier; prose answers are also
+# asked to stay within about WORDS_PER_TOKEN words per token of budget
+DEFAULT_TOKEN_BUDGETS = {"light": 512, "standard": 1024, "complex": 2048}
+WORDS_PER_TOKEN = 0.6
+# Structured answers are a few short fields per checked item
+STRUCTURED_BASE_TOKENS = 160
+STRUCTURED_TOKENS_PER_ITEM = 70
+
+
+def parse_tier_models(value):
+    """Parse "light=llama3.2:3b,complex=llama3.1:70b" into {tier: model}."""
+    models = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        tier, model = (part.strip() for part in item.split("=", 1))
+        if tier not in TIERS:
+            raise ValueError(f"Unknown model tier {tier!r}; expected one of {', '.join(TIERS)}")
+        if model:
+            models[tier] = model
+    return models
+
+
+class ModelRouter:
+    """Picks a model tier and generation budget from the structured form inputs.
+
+    The complexity score counts the drug pairs to check (pairs the reference
+    text documents together count twice), half a point per allergy and
+    condition, and one point for a patient under 18 or over 64. Scores up
+    to ``light_max`` go to the light tier, up to ``standard_max`` to the
+    standard tier and anything above to the complex tier. Tiers without a
+    model of their own use ``default_model``, so out of the box only the
+    token budget changes.
+    """
+
+    def __init__(self, default_model, tier_models=None, token_budgets=None, light_max=1.5, standard_max=6.0):
+        self.tier_models = {tier: default_model for tier in TIERS}
+        self.tier_models.update(tier_models or {})
+        self.token_budgets = dict(DEFAULT_TOKEN_BUDGETS, **(token_budgets or {}))
+        self.light_max = light_max
+        self.standard_max = standard_max
+
+    @classmethod
+    def from_env(cls, default_model, tier_models=None, token_budgets=None):
+        """Tier models from ``tier_models`` or OLLAMA_TIER_MODELS (see ``parse_tier_models``)."""
+        if tier_models is None:
+            tier_models = parse_tier_models(os.environ.get("OLLAMA_TIER_MODELS", ""))
+        return cls(default_model, tier_models, token_budgets)
+
+    def complexity(self, current_meds, allergies, conditions, new_meds, patient_info, interaction_index=None):
+        """Score a request; ``interaction_index`` tells which pairs the reference text covers."""
+        entities = extract_entities(current_meds, allergies, conditions, new_meds)
+        pairs = [key[1:] for key, _ in build_lookups(entities) if key[0] == "pair"]
+        documented = 0
+        if interaction_index is not None:
+            documented = sum(1 for a, b in pairs if interaction_index.pair_chunks(a, b))
+        try:
+            age = int(str((patient_info or {}).get("age") or "").strip())
+        except ValueError:
+            age = None
+        age_risk = 1 if age is not None and (age < 18 or age > 64) else 0
+        score = (len(pairs) + documented
+                 + 0.5 * (len(entities["allergies"]) + len(entities["conditions"])) + age_risk)
+        return {
+            "score": score,
+            "pairs": len(pairs),
+            "documented_pairs": documented,
+            "items": len(pairs) + len(entities["allergies"]) + len(entities["conditions"]),
+        }
+
+    def route(self, current_meds, allergies, conditions, new_meds, patient_info, output_format="prose",
+              interaction_index=None):
+        """Return {"tier", "model", "num_predict", "word_limit", "score", ...} for one request."""
+        route = self.complexity(current_meds, allergies, conditions, new_meds, patient_info, interaction_index)
+        if route["score"] <= self.light_max:
+            tier = "light"
+        elif route["score"] <= self.standard_max:
+            tier = "standard"
+        else:
+            tier = "complex"
+        num_predict = self.token_budgets[tier]
+        word_limit = int(num_predict * WORDS_PER_TOKEN)
+        if output_format == "structured":
+            num_predict = min(num_predict, STRUCTURED_BASE_TOKENS + STRUCTURED_TOKENS_PER_ITEM * max(1, route["items"]))
+            word_limit = None
+        route.update(tier=tier, model=self.tier_models[tier], num_predict=num_predict, word_limit=word_limit)
+        return route
@@ -0,0 +1,190 @@
+import asyncio
+import copy
+import hashlib
+import heapq
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from tracing import percentile, tracer
+
+# Lower rank is served first; batch work only gets a slot no interactive request is waiting for
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class GenerationScheduler:
+    """Coalesces identical requests and admits generations by priority.
+
+    Single-flight: the first request for a key (``begin``) does the work and
+    every identical request arriving while it runs waits for the same result
+    instead of repeating retrieval and generation.
+
+    Admission: each LLM endpoint runs at most ``per_endpoint_concurrency``
+    generations. Requests beyond that wait in one queue ordered by priority
+    ("interactive" before "batch") and then arrival, so a long batch job can
+    fill idle capacity but never delays an interactive user by more than the
+    generations already running. Slots are plain ``concurrent.futures``
+    futures, so threads (``slot``) and asyncio tasks (``aslot``) share one queue.
+    """
+
+    def __init__(self, endpoints, per_endpoint_concurrency=4, wait_window=1024):
+        self.endpoints = list(endpoints)
+        self.per_endpoint_concurrency = per_endpoint_concurrency
+        self.in_flight = {url: 0 for url in self.endpoints}
+        self.counters = {"leaders": 0, "coalesced": 0}
+        self.counters.update({f"served_{name}": 0 for name in PRIORITIES})
+        self._waits = {name: deque(maxlen=wait_window) for name in PRIORITIES}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    # Single-flight
+
+    @staticmethod
+    def flight_key(namespace, profile, additional_info=""):
+        payload = json.dumps([namespace, profile, additional_info], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def begin(self, key):
+        """Return (is_leader, future). The leader must call ``finish``; followers wait on the future."""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.counters["coalesced"] += 1
+                return False, future
+            future = self._flights[key] = Future()
+            self.counters["leaders"] += 1
+            return True, future
+
+    def finish(self, key, future, result=None, error=None):
+        """Publish the leader's result (or exception) to its followers.
+
+        The result is copied, so the leader may keep adding to its own dict.
+        """
+        with self._lock:
+            self._flights.pop(key, None)
+        if error is not None:
+            if not isinstance(error, Exception):
+                # A cancelled or closed leader must not cancel its followers
+                error = RuntimeError("The identical request this one was waiting for was cancelled")
+            future.set_exception(error)
+        else:
+            future.set_result(copy.deepcopy(result))
+
+    @staticmethod
+    def shared_result(future, timeout=None):
+        """A follower's own copy of the leader's result."""
+        return copy.deepcopy(future.result(timeout))
+
+    @staticmethod
+    async def ashared_result(future):
+        """Asyncio version of ``shared_result``."""
+        # Shielded: a cancelled follower must not cancel the shared future
+        return copy.deepcopy(await asyncio.shield(asyncio.wrap_future(future)))
+
+    # Priority admission
+
+    def _free_endpoint(self):
+        free = [url for url in self.endpoints if self.in_flight[url] < self.per_endpoint_concurrency]
+        return min(free, key=lambda url: self.in_flight[url]) if free else None
+
+    def _acquire(self, priority):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        future = Future()
+        with self._lock:
+            heapq.heappush(
+                self._queue, (PRIORITIES[priority], next(self._sequence), priority, time.perf_counter(), future)
+            )
+            self._dispatch()
+        return future
+
+    def _release(self, endpoint):
+        with self._lock:
+            self.in_flight[endpoint] -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to the best waiters; call with the lock held."""
+        while self._queue:
+            endpoint = self._free_endpoint()
+            if endpoint is None:
+                break
+            _, _, priority, enqueued, future = heapq.heappop(self._queue)
+            # Waiters that gave up (cancelled asyncio tasks) are skipped
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.in_flight[endpoint] += 1
+            waited = time.perf_counter() - enqueued
+            self.counters[f"served_{priority}"] += 1
+            self._waits[priority].append(waited)
+            future.set_result((endpoint, waited))
+
+    @contextmanager
+    def slot(self, priority="interactive"):
+        """Block until a generation slot is free; yields the endpoint to use."""
+        endpoint, waited = self._acquire(priority).result()
+        tracer.record(f"queue_wait_{priority}", waited)
+        try:
+            yield endpoint
+        finally:
+            self._release(endpoint)
+
+    @asynccontextmanager
+    async def aslot(self, priority="interactive"):
+        """Asyncio version of ``slot``; a cancelled task leaves the queue."""
+        future = self._acquire(priority)
+        try:
+            endpoint, waited = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Leave the queue, or hand the slot on if it was granted meanwhile
+            if not future.cancel():
+                self._release(future.result()[0])
+            raise
+        tracer.record(f"queue_wait_{priority}", waited)
+        try:
+            yield endpoint
+        finally:
+            self._release(endpoint)
+
+    # Metrics
+
+    def stats(self):
+        """Queue depth and wait times per priority, slots in use and coalescing counters."""
+        with self._lock:
+            queued = {name: 0 for name in PRIORITIES}
+            for _, _, priority, _, future in self._queue:
+                if not future.cancelled():
+                    queued[priority] += 1
+            in_flight = dict(self.in_flight)
+            waits = {name: list(values) for name, values in self._waits.items()}
+        return dict(
+            self.counters,
+            queued=queued,
+            in_flight=in_flight,
+            wait_ms={
+                name: {
+                    "p50": round(percentile(values, 50) * 1000, 2) if values else None,
+                    "p99": round(percentile(values, 99) * 1000, 2) if values else None,
+                }
+                for name, values in waits.items()
+            },
+        )
+
+    def render_metrics(self, prefix="medinteract_scheduler"):
+        """Prometheus gauges and counters for ``/metrics``."""
+        stats = self.stats()
+        lines = [f"# TYPE {prefix}_queue_depth gauge"]
+        lines += [f'{prefix}_queue_depth{{priority="{name}"}} {depth}' for name, depth in stats["queued"].items()]
+        lines.append(f"# TYPE {prefix}_in_flight gauge")
+        lines += [f'{prefix}_in_flight{{endpoint="{url}"}} {count}' for url, count in stats["in_flight"].items()]
+        for name in ("leaders", "coalesced"):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {stats[name]}")
+        lines.append(f"# TYPE {prefix}_served_total counter")
+        lines += [f'{prefix}_served_total{{priority="{name}"}} {stats[f"served_{name}"]}' for name in PRIORITIES]
+        return "\n".join(lines) + "\n"
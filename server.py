@@ -0,0 +1,321 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import time
+from aiohttp import web
+from app import MedicalInteractionApp
+from tracing import PrometheusExporter, tracer
+
+PROFILE_FIELDS = ("current_meds", "allergies", "conditions", "new_meds", "patient_info", "additional_info")
+PROFILE_DEFAULTS = {"current_meds": [], "allergies": [], "conditions": [], "new_meds": [],
+                    "patient_info": {}, "additional_info": ""}
+PRIORITIES = ("interactive", "batch")
+OUTPUT_FORMATS = ("prose", "structured")
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; carries the HTTP status to send."""
+
+    def __init__(self, status, reason):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class AdmissionControl:
+    """Bounded request queue in front of the engine.
+
+    At most ``concurrency`` requests run at once and at most ``queue_size``
+    wait behind them; anything beyond that is rejected straight away (429),
+    and a request that waits longer than ``queue_timeout`` seconds gives up
+    (503). Clients are expected to retry after the Retry-After header.
+    """
+
+    def __init__(self, concurrency=8, queue_size=32, queue_timeout=30.0):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = 0
+        self.counters = {"admitted": 0, "rejected": 0, "timed_out": 0}
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        if self.running >= self.concurrency and self.waiting >= self.queue_size:
+            self.counters["rejected"] += 1
+            raise Overloaded(429, "Server is at capacity, retry later")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counters["timed_out"] += 1
+            raise Overloaded(503, "Timed out waiting in the request queue")
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        self.counters["admitted"] += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.running -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return dict(self.counters, running=self.running, waiting=self.waiting,
+                    concurrency=self.concurrency, queue_size=self.queue_size)
+
+
+def _error(status, message, retry_after=None):
+    headers = {"Retry-After": str(retry_after)} if retry_after else None
+    return web.json_response({"error": message}, status=status, headers=headers)
+
+
+async def _read_profile(request):
+    try:
+        body = await request.json()
+    except (ValueError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "Request body must be JSON"}),
+                                 content_type="application/json")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "Request body must be a JSON object"}),
+                                 content_type="application/json")
+    return [body.get(field, PROFILE_DEFAULTS[field]) for field in PROFILE_FIELDS]
+
+
+def _query_choice(request, name, choices):
+    """A query parameter restricted to ``choices``; the first choice is the default."""
+    value = request.query.get(name, choices[0])
+    if value not in choices:
+        raise web.HTTPBadRequest(text=json.dumps({"error": f"{name} must be one of {', '.join(choices)}"}),
+                                 content_type="application/json")
+    return value
+
+
+def _not_ready(engine):
+    status = engine.status()
+    if status["state"] == "ready":
+        return None
+    return _error(503, f"Engine is {status['state']}: {status['message']}", retry_after=5)
+
+
+async def health(request):
+    """Liveness: the worker process is up and serving HTTP."""
+    return web.json_response({"status": "ok", "pid": os.getpid()})
+
+
+async def ready(request):
+    """Readiness: 200 once the engine has warmed up, 503 before that or after a failure."""
+    status = dict(request.app["engine"].status(), pid=os.getpid())
+    return web.json_response(status, status=200 if status["state"] == "ready" else 503)
+
+
+async def analyze(request):
+    engine = request.app["engine"]
+    profile = await _read_profile(request)
+    # ?priority=batch for bulk screening, ?format=structured for a JSON severity list
+    priority = _query_choice(request, "priority", PRIORITIES)
+    output_format = _query_choice(request, "format", OUTPUT_FORMATS)
+    not_ready = _not_ready(engine)
+    if not_ready is not None:
+        return not_ready
+    try:
+        async with request.app["admission"]:
+            result = await engine.aanalyze_interactions(*profile, priority=priority, output_format=output_format)
+    except Overloaded as e:
+        return _error(e.status, e.reason, retry_after=1)
+    return web.json_response(result, status=500 if "error" in result else 200)
+
+
+async def analyze_stream(request):
+    """Stream analysis events as newline-delimited JSON."""
+    engine = request.app["engine"]
+    profile = await _read_profile(request)
+    priority = _query_choice(request, "priority", PRIORITIES)
+    not_ready = _not_ready(engine)
+    if not_ready is not None:
+        return not_ready
+    try:
+        async with request.app["admission"]:
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+            events = engine.stream_analysis(*profile, priority=priority)
+            # The engine's stream is a blocking generator; advance it off the event loop
+            step = None
+            try:
+                while True:
+                    step = asyncio.ensure_future(asyncio.to_thread(next, events, None))
+                    event = await asyncio.shield(step)
+                    if event is None:
+                        break
+                    await response.write(json.dumps(event).encode("utf-8") + b"\n")
+                await response.write_eof()
+                return response
+            finally:
+                # On disconnect or cancellation, close the generator so its scheduler
+                # slot and single-flight leadership are released now, not at garbage
+                # collection. A generator cannot be closed while next() runs in its
+                # thread, so in that case it is closed once that step finishes.
+                if step is None or step.done():
+                    await asyncio.to_thread(events.close)
+                else:
+                    loop = asyncio.get_running_loop()
+                    step.add_done_callback(lambda _: loop.run_in_executor(None, events.close))
+    except Overloaded as e:
+        return _error(e.status, e.reason, retry_after=1)
+
+
+async def stats(request):
+    engine = request.app["engine"]
+    return web.json_response(dict(engine.stats(), pid=os.getpid(), admission=request.app["admission"].stats()))
+
+
+async def metrics(request):
+    """Prometheus text format: span timings plus this worker's queue and scheduler gauges."""
+    engine = request.app["engine"]
+    admission = request.app["admission"].stats()
+    lines = [f'medinteract_requests_{name}{{pid="{os.getpid()}"}} {value}' for name, value in admission.items()]
+    prometheus = tracer.find_exporter(PrometheusExporter)
+    text = (prometheus.render() if prometheus else "") + "\n".join(lines) + "\n"
+    if engine.is_initialized:
+        text += engine.model.scheduler.render_metrics()
+    return web.Response(text=text, content_type="text/plain")
+
+
+async def watch_snapshots(engine, interval):
+    """Switch to a newly activated index snapshot while serving; see snapshot.py."""
+    while True:
+        await asyncio.sleep(interval)
+        if engine.is_initialized and engine.model.snapshot_pending():
+            switched, message = await asyncio.to_thread(engine.switch_snapshot)
+            print(("✓ " if switched else "✗ ") + message)
+
+
+def create_app(engine, concurrency=8, queue_size=32, queue_timeout=30.0, snapshot_poll=30.0):
+    """Build the aiohttp application around an engine; warmup starts with the server."""
+    app = web.Application(client_max_size=1024 * 1024)
+    app["engine"] = engine
+
+    async def on_startup(app):
+        # Created here so the semaphore belongs to the server's event loop
+        app["admission"] = AdmissionControl(concurrency, queue_size, queue_timeout)
+        engine.start_warmup()
+        if engine.model.snapshot_dir and snapshot_poll:
+            app["snapshot_watcher"] = asyncio.create_task(watch_snapshots(engine, snapshot_poll))
+
+    async def on_cleanup(app):
+        if "snapshot_watcher" in app:
+            app["snapshot_watcher"].cancel()
+        pool = getattr(engine.model, "ollama_pool", None) if engine.is_initialized else None
+        if pool is not None:
+            await pool.aclose()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_get("/health", health)
+    app.router.add_get("/ready", ready)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_post("/analyze", analyze)
+    app.router.add_post("/analyze/stream", analyze_stream)
+    return app
+
+
+def _engine(config, read_only=False):
+    return MedicalInteractionApp(
+        model_name=config["model"], data_dir=config["data_dir"], vector_store=config["vector_store"],
+        snapshot_dir=config["snapshot"], read_only=read_only,
+    )
+
+
+def prepare(config):
+    """Ingest changed PDFs and build the shared read-only index before any worker starts."""
+    success, message = _engine(config).initialize()
+    print(("✓ " if success else "✗ ") + message)
+    raise SystemExit(0 if success else 1)
+
+
+def run_worker(config):
+    """Serve on the shared port; the kernel spreads connections over workers (SO_REUSEPORT).
+
+    Workers only read the store ``prepare`` ingested; the PDFs are not re-hashed.
+    """
+    app = create_app(
+        _engine(config, read_only=True),
+        concurrency=config["concurrency"],
+        queue_size=config["queue_size"],
+        queue_timeout=config["queue_timeout"],
+        snapshot_poll=config["snapshot_poll"],
+    )
+    web.run_app(app, host=config["host"], port=config["port"], reuse_port=config["workers"] > 1,
+                shutdown_timeout=config["shutdown_timeout"], print=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the interaction checker over HTTP/JSON.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help="Worker processes sharing the port")
+    parser.add_argument("--model", default="llama3", help="Ollama model name")
+    parser.add_argument("--data-dir", default="data", help="Directory with the reference PDFs")
+    parser.add_argument("--vector-store", default="compact", choices=["chroma", "compact"],
+                        help="compact shares one memory-mapped index between workers")
+    parser.add_argument("--snapshot", help="Serve a prebuilt index snapshot (root or version directory) "
+                                           "instead of ingesting the PDFs")
+    parser.add_argument("--snapshot-poll", type=float, default=30.0,
+                        help="Seconds between checks for a newly activated snapshot (0 disables)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests processed at once per worker")
+    parser.add_argument("--queue-size", type=int, default=32, help="Requests allowed to wait per worker")
+    parser.add_argument("--queue-timeout", type=float, default=30.0, help="Seconds a request may wait")
+    parser.add_argument("--shutdown-timeout", type=float, default=30.0,
+                        help="Seconds to let in-flight requests finish on shutdown")
+    parser.add_argument("--skip-prepare", action="store_true", help="Do not ingest before starting workers")
+    config = vars(parser.parse_args())
+
+    ctx = multiprocessing.get_context("spawn")
+    if not config["skip_prepare"] and not config["snapshot"]:
+        # Ingest in a short-lived process so the supervisor never holds the model
+        preparer = ctx.Process(target=prepare, args=(config,), name="prepare")
+        preparer.start()
+        preparer.join()
+        if preparer.exitcode != 0:
+            raise SystemExit("Ingestion failed; not starting workers")
+
+    if config["workers"] == 1:
+        run_worker(config)
+        return
+
+    workers = []
+    for i in range(config["workers"]):
+        worker = ctx.Process(target=run_worker, args=(config,), name=f"worker-{i}")
+        worker.start()
+        workers.append(worker)
+    print(f"Serving on http://{config['host']}:{config['port']} with {len(workers)} workers")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while not stopping:
+        for i, worker in enumerate(workers):
+            if not worker.is_alive() and not stopping:
+                print(f"{worker.name} exited with {worker.exitcode}; restarting")
+                workers[i] = ctx.Process(target=run_worker, args=(config,), name=worker.name)
+                workers[i].start()
+        time.sleep(1)
+    for worker in workers:
+        worker.join(config["shutdown_timeout"] + 5)
+
+
+if __name__ == "__main__":
+    main()
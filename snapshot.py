@@ -0,0 +1,214 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from langchain_core.documents import Document
+from compact_store import CompactVectorStore
+from interaction_index import InteractionIndex
+from lexical_index import BM25Index
+from manifest import file_sha256
+
+SNAPSHOT_FILE = "snapshot.json"
+CURRENT_FILE = "CURRENT"
+
+
+def _file_checksums(directory):
+    """SHA-256 of every file under ``directory``, keyed by relative path."""
+    checksums = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, directory).replace(os.sep, "/")
+            if relative != SNAPSHOT_FILE:
+                checksums[relative] = file_sha256(path)
+    return dict(sorted(checksums.items()))
+
+
+def _overall_checksum(checksums):
+    return hashlib.sha256(json.dumps(checksums, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def current_version(root):
+    """The version the ``CURRENT`` pointer in ``root`` names, or None."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def activate(root, version):
+    """Point ``CURRENT`` at ``version``; readers see either the old or the new pointer."""
+    if not os.path.exists(os.path.join(root, version, SNAPSHOT_FILE)):
+        raise ValueError(f"No snapshot {version} in {root}")
+    tmp_path = os.path.join(root, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+
+def list_versions(root):
+    """Complete snapshot versions in ``root``, oldest first."""
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if os.path.exists(os.path.join(root, name, SNAPSHOT_FILE))
+    )
+
+
+def build_snapshot(model, root, version=None, mode="pq", keep=3):
+    """Export an initialized model's index into a new snapshot version under ``root``.
+
+    The snapshot holds the compact vector store (float16 vectors, PQ codes,
+    chunk text and metadata), a copy of the BM25 index, an interaction index
+    built from the same chunks, and ``snapshot.json`` with the embedding
+    model fingerprint and a SHA-256 of every file. It is written to a
+    temporary directory, renamed into place and only then made current, so
+    nodes never see a partial snapshot. All but the newest ``keep`` versions
+    (and the current one) are removed. Returns the version.
+    """
+    if model.chroma_store is None:
+        raise ValueError("Snapshots are built from an ingested Chroma store, not from another snapshot")
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    target = os.path.join(root, version)
+    if os.path.exists(target):
+        raise ValueError(f"Snapshot {version} already exists in {root}")
+    tmp_dir = target + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    CompactVectorStore.build(model.chroma_store, os.path.join(tmp_dir, "vectors"), mode=mode)
+    store = CompactVectorStore(os.path.join(tmp_dir, "vectors"), None)
+    chunks = (
+        Document(page_content=doc.page_content, metadata=dict(doc.metadata, chunk_id=cid))
+        for cid, doc in ((cid, store._document(position)) for position, cid in enumerate(store.ids))
+    )
+    InteractionIndex.build(chunks).save(os.path.join(tmp_dir, "interaction_index"))
+    model.lexical_index.export(os.path.join(tmp_dir, "bm25.sqlite"))
+
+    checksums = _file_checksums(tmp_dir)
+    with open(os.path.join(tmp_dir, SNAPSHOT_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "embedding": {
+                "fingerprint": model._embedding_namespace(model.base_embeddings),
+                "dim": store.meta["dim"],
+            },
+            "chunks": store.meta["count"],
+            "corpus_fingerprint": store.fingerprint,
+            "vector_mode": store.mode,
+            "files": checksums,
+            "checksum": _overall_checksum(checksums),
+        }, f, indent=2)
+    store.close()
+
+    os.replace(tmp_dir, target)
+    activate(root, version)
+    current = current_version(root)
+    for old in list_versions(root)[:-keep or None]:
+        if old != current:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    print(f"✓ Built index snapshot {version} with {store.meta['count']} chunks in {target}")
+    return version
+
+
+class IndexSnapshot:
+    """A read-only, self-contained index opened from a snapshot version.
+
+    ``path`` is either one version directory or a snapshot root, in which
+    case the version named by its ``CURRENT`` pointer is opened. With
+    ``verify`` every file is checked against the recorded SHA-256 first.
+    Nothing is ever written to the snapshot, so many nodes or processes can
+    open the same copy.
+    """
+
+    def __init__(self, path, verify=True):
+        version = current_version(path)
+        self.root = path if version else None
+        self.directory = os.path.join(path, version) if version else path
+        meta_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if not os.path.exists(meta_path):
+            raise ValueError(f"No index snapshot in {path}")
+        with open(meta_path, "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.version = self.meta["version"]
+        if verify:
+            self.verify()
+
+    def verify(self):
+        """Raise ValueError if any file is missing, extra or differs from its checksum."""
+        checksums = _file_checksums(self.directory)
+        if checksums != self.meta["files"] or _overall_checksum(checksums) != self.meta["checksum"]:
+            damaged = sorted(set(checksums.items()) ^ set(self.meta["files"].items()))
+            raise ValueError(f"Index snapshot {self.version} failed verification: "
+                             f"{', '.join(sorted({name for name, _ in damaged}))}")
+
+    def check_embeddings(self, fingerprint, embeddings):
+        """Refuse to serve with a different embedding model than the one that built the vectors."""
+        expected = self.meta["embedding"]
+        if fingerprint != expected["fingerprint"]:
+            raise ValueError(f"Index snapshot {self.version} was built with {expected['fingerprint']}, "
+                             f"but the configured embedding model is {fingerprint}")
+        dim = len(embeddings.embed_query("warfarin"))
+        if expected["dim"] and dim != expected["dim"]:
+            raise ValueError(f"Index snapshot {self.version} has {expected['dim']}-dimensional vectors, "
+                             f"but the embedding model produces {dim}")
+
+    def vector_store(self, embeddings, rerank_candidates=100):
+        return CompactVectorStore(os.path.join(self.directory, "vectors"), embeddings, rerank_candidates)
+
+    def lexical_index(self):
+        return BM25Index(os.path.join(self.directory, "bm25.sqlite"), read_only=True)
+
+    def interaction_index(self):
+        return InteractionIndex.load(os.path.join(self.directory, "interaction_index"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and manage versioned index snapshots.")
+    parser.add_argument("--root", default="snapshots", help="Directory holding the snapshot versions")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Ingest the PDFs and export a new snapshot version")
+    build.add_argument("--data-dir", default="data", help="Directory with the reference PDFs")
+    build.add_argument("--persist-dir", default="./chroma_db", help="Chroma directory to ingest into")
+    build.add_argument("--version", help="Version name (default: a timestamp)")
+    build.add_argument("--mode", default="pq", choices=["pq", "f16"])
+    build.add_argument("--keep", type=int, default=3, help="Snapshot versions to keep")
+
+    commands.add_parser("list", help="List snapshot versions")
+    verify = commands.add_parser("verify", help="Check a snapshot's files against their checksums")
+    verify.add_argument("version", nargs="?", help="Version to check (default: the current one)")
+    switch = commands.add_parser("activate", help="Make a version current, e.g. to roll back")
+    switch.add_argument("version")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from app import MedicalInteractionApp
+        app = MedicalInteractionApp(data_dir=args.data_dir, persist_dir=args.persist_dir, vector_store="chroma")
+        success, message = app.initialize()
+        if not success:
+            raise SystemExit(f"✗ {message}")
+        build_snapshot(app.model, args.root, version=args.version, mode=args.mode, keep=args.keep)
+    elif args.command == "list":
+        current = current_version(args.root)
+        for version in list_versions(args.root):
+            print(("* " if version == current else "  ") + version)
+    elif args.command == "verify":
+        path = os.path.join(args.root, args.version) if args.version else args.root
+        try:
+            snapshot = IndexSnapshot(path)
+        except ValueError as e:
+            raise SystemExit(f"✗ {e}")
+        print(f"✓ Snapshot {snapshot.version} verified ({snapshot.meta['chunks']} chunks)")
+    else:
+        activate(args.root, args.version)
+        print(f"✓ {args.version} is now the current snapshot")
+
+
+if __name__ == "__main__":
+    main()
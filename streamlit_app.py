@@ -1,7 +1,7 @@
 import streamlit as st
 import os
-from app import MedicalInteractionApp
-import time
+from app import get_shared_app
+from tracing import PrometheusExporter, RingBufferExporter, tracer
 
 # Set page configuration
 st.set_page_config(
@@ -54,9 +54,23 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Initialize session state variables
-if 'app' not in st.session_state:
-    st.session_state.app = MedicalInteractionApp()
+@st.cache_resource
+def get_engine():
+    """One engine per process, shared by every browser session.
+    
+    With MEDINTERACT_API_URL set, the UI is a thin client of server.py instead.
+    """
+    api_url = os.environ.get("MEDINTERACT_API_URL")
+    if api_url:
+        from client import MedicalInteractionClient
+        return MedicalInteractionClient(api_url)
+    return get_shared_app()
+
+engine = get_engine()
+# Load the embedder and vector store in the background; the page renders meanwhile
+engine.start_warmup()
+
+# Initialize per-session form state
 if 'current_meds' not in st.session_state:
     st.session_state.current_meds = []
 if 'allergies' not in st.session_state:
@@ -69,6 +83,10 @@ if 'analysis_done' not in st.session_state:
     st.session_state.analysis_done = False
 if 'result' not in st.session_state:
     st.session_state.result = None
+if 'pending_analysis' not in st.session_state:
+    st.session_state.pending_analysis = None
+if 'prefetch_session' not in st.session_state:
+    st.session_state.prefetch_session = None
 
 # Helper functions for dynamic form elements
 def add_current_med():
@@ -112,6 +130,24 @@ def clear_form():
     st.session_state.analysis_done = False
     st.session_state.result = None
 
+def filled_entries():
+    """The non-empty (current_meds, allergies, conditions, new_meds) entries of the form."""
+    return (
+        [med for med in st.session_state.current_meds if med["name"]],
+        [allergy for allergy in st.session_state.allergies if allergy["name"]],
+        [condition for condition in st.session_state.conditions if condition],
+        [med for med in st.session_state.new_meds if med["name"]],
+    )
+
+def prefetch_entries():
+    """Retrieve evidence for the entries typed so far while the form is still being filled in."""
+    if not engine.is_initialized:
+        return
+    if st.session_state.prefetch_session is None:
+        st.session_state.prefetch_session = engine.create_session()
+    # Lookups for removed or edited entries are cancelled
+    engine.prefetch(st.session_state.prefetch_session, *filled_entries())
+
 def run_analysis():
     """Run the interaction analysis."""
     # Check if we have at least one new medication
@@ -120,10 +156,7 @@ def run_analysis():
         return
         
     # Filter out empty entries
-    filtered_current_meds = [med for med in st.session_state.current_meds if med["name"]]
-    filtered_allergies = [allergy for allergy in st.session_state.allergies if allergy["name"]]
-    filtered_conditions = [condition for condition in st.session_state.conditions if condition]
-    filtered_new_meds = [med for med in st.session_state.new_meds if med["name"]]
+    filtered_current_meds, filtered_allergies, filtered_conditions, filtered_new_meds = filled_entries()
     
     # Collect patient info
     patient_info = {
@@ -135,20 +168,69 @@ def run_analysis():
     # Get additional info
     additional_info = st.session_state.additional_info if 'additional_info' in st.session_state else ""
     
+    # Queue the request; the results tab streams it in as it is generated
+    st.session_state.pending_analysis = (
+        filtered_current_meds,
+        filtered_allergies,
+        filtered_conditions,
+        filtered_new_meds,
+        patient_info,
+        additional_info
+    )
+    st.session_state.result = None
+    st.session_state.analysis_done = False
+
+def stream_pending_analysis():
+    """Render the queued analysis token by token and store the final result."""
+    request = st.session_state.pending_analysis
+    st.session_state.pending_analysis = None
+    
+    st.markdown('<p class="big-font">Analysis Results</p>', unsafe_allow_html=True)
+    placeholder = st.empty()
+    result = {"analysis": "", "sources": []}
+    
     with st.spinner("🔍 Analyzing potential interactions..."):
-        # Run analysis
-        result = st.session_state.app.analyze_interactions(
-            filtered_current_meds, 
-            filtered_allergies, 
-            filtered_conditions, 
-            filtered_new_meds,
-            patient_info,
-            additional_info
-        )
-        
-        # Store result in session state
-        st.session_state.result = result
-        st.session_state.analysis_done = True
+        # Retrieval already prefetched for this form is reused; only generation is left
+        events = engine.stream_analysis(*request, session=st.session_state.prefetch_session)
+        # Wait for retrieval (and the sources) before dropping the spinner
+        first_event = next(events, None)
+    
+    def handle(event):
+        if event["type"] == "error":
+            result["error"] = event["error"]
+        elif event["type"] == "sources":
+            result["sources"] = event["sources"]
+        elif event["type"] == "token":
+            result["analysis"] += event["text"]
+            placeholder.markdown(result["analysis"] + "▌")
+        elif event["type"] == "done":
+            result["analysis"] = event["analysis"]
+            result["metrics"] = event.get("metrics", {})
+    
+    if first_event:
+        handle(first_event)
+    for event in events:
+        handle(event)
+    
+    st.session_state.result = result
+    st.session_state.analysis_done = True
+    # Re-render with the full result, sources and metrics
+    st.rerun()
+
+@st.fragment(run_every=2)
+def engine_status():
+    """Poll the background warmup without re-running the whole page."""
+    status = engine.status()
+    if status["state"] == "ready":
+        # Re-render the page in its initialized state
+        st.rerun()
+    elif status["state"] == "failed":
+        st.error(f"❌ Initialization failed: {status['message']}")
+        if st.button("🔄 Retry initialization"):
+            engine.start_warmup()
+    else:
+        st.info("🔄 Warming up the engine (embedding model and vector store)... "
+                "You can start entering patient information meanwhile.")
 
 # Main UI
 st.title("💊 MedInteract: Drug Interaction Checker")
@@ -305,9 +387,15 @@ with tab1:
         analyze_button = st.button("🔍 Analyze Interactions", type="primary", use_container_width=True, on_click=run_analysis)
     with col2:
         clear_button = st.button("🗑️ Clear Form", use_container_width=True, on_click=clear_form)
+    
+    # Every rerun (an entry added, edited or removed) brings the prefetch in step with the form
+    prefetch_entries()
 
 # Tab 2: Analysis Results
 with tab2:
+    if st.session_state.pending_analysis:
+        stream_pending_analysis()
+    
     if st.session_state.analysis_done and st.session_state.result:
         st.markdown('<p class="big-font">Analysis Results</p>', unsafe_allow_html=True)
         
@@ -320,30 +408,61 @@ with tab2:
             st.markdown(result["analysis"])
             st.markdown('</div>', unsafe_allow_html=True)
             
+            metrics = result.get("metrics")
+            if metrics and metrics.get("cached"):
+                st.caption(f"⏱️ Reused an earlier answer in {metrics['total_seconds']}s")
+            elif metrics and metrics.get("ttft_seconds") is not None:
+                saved = metrics.get("context_tokens", {}).get("tokens_saved")
+                st.caption(
+                    f"⏱️ First token after {metrics['ttft_seconds']}s · "
+                    f"{metrics['tokens_per_second']} tokens/s · {metrics['total_seconds']}s total"
+                    + (f" · {saved} context tokens trimmed" if saved else "")
+                )
+            
             # Display sources
             if result.get("sources"):
                 with st.expander("📚 View Source References"):
                     for i, source in enumerate(result["sources"]):
-                        st.markdown(f"**Source {i+1}:** {source['source']} (Page: {source['page']})")
+                        section = f" · {source['section']}" if source.get("section") else ""
+                        st.markdown(f"**Source {i+1}:** {source['source']} (Page: {source['page']}){section}")
                         st.markdown(f"<div class='sources'>*Excerpt:* {source['content']}</div>", unsafe_allow_html=True)
+                        # Full passages are re-read from the PDF on demand rather than stored
+                        if "start_offset" in source and os.path.exists(source["source"]):
+                            if st.button("📖 Show full passage", key=f"passage_{i}"):
+                                from data_loader import read_excerpt
+                                st.text(read_excerpt(source["source"], source["page"], source["start_offset"],
+                                                     source.get("end_page"), source.get("end_offset")))
                         st.markdown("---")
     else:
-        if st.session_state.app.is_initialized:
+        if engine.is_initialized:
             st.info("👈 Enter patient information and click 'Analyze Interactions' to see results here")
         else:
-            # Simulate initialization automatically when page is loaded
-            if 'auto_init' not in st.session_state:
-                st.session_state.auto_init = True
-                with st.spinner("🔄 Initializing system... Please wait..."):
-                    success, message = st.session_state.app.initialize()
-                    if success:
-                        st.success("✅ System initialized successfully!")
-                        time.sleep(1)
-                        st.info("👈 Enter patient information and click 'Analyze Interactions' to see results here")
-                    else:
-                        st.error(f"❌ Initialization failed: {message}")
-            else:
-                st.info("👈 Enter patient information and click 'Analyze Interactions' to see results here")
+            engine_status()
+
+# Engine status
+with st.sidebar:
+    st.markdown("### ⚙️ Engine")
+    stats = engine.stats()
+    if stats["initialized"]:
+        st.caption(f"Initialized in {stats['init_seconds']}s, holding ~{stats['init_memory_mb']} MB")
+    else:
+        st.caption(f"State: {stats['state']}")
+    st.caption(f"Process RSS: {stats['rss_mb']} MB (peak {stats['peak_rss_mb']} MB)")
+    if stats["embedding_cache"]:
+        cache = stats["embedding_cache"]
+        st.caption(f"Embedding cache: {cache['hit_rate']:.0%} hit rate, {cache['size']} vectors "
+                   f"({cache['pinned']} lexicon)")
+    
+    with st.expander("🐞 Debug: recent spans"):
+        ring = tracer.find_exporter(RingBufferExporter)
+        spans = ring.spans()[-50:] if ring else []
+        if spans:
+            st.dataframe(list(reversed(spans)), use_container_width=True)
+        else:
+            st.caption("No spans recorded yet")
+        prometheus = tracer.find_exporter(PrometheusExporter)
+        if prometheus:
+            st.code(prometheus.render(), language="text")
 
 # Footer
 st.markdown("---")
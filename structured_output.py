@@ -0,0 +1,57 @@
+import json
+import re
+
+OUTPUT_FORMATS = ("prose", "structured")
+SEVERITIES = ("major", "moderate", "minor", "unknown", "none")
+INTERACTION_TYPES = ("drug-drug", "drug-allergy", "drug-condition", "patient-factor")
+DISCLAIMER = "I am NOT a doctor and this analysis is for informational purposes only."
+
+STRUCTURED_INSTRUCTIONS = """
+        Respond with one JSON object and nothing else, in exactly this shape:
+        {"summary": "two or three plain sentences on the most important concerns",
+         "interactions": [{"items": ["first drug", "second drug, allergy or condition"],
+                           "type": "drug-drug | drug-allergy | drug-condition | patient-factor",
+                           "severity": "major | moderate | minor | none",
+                           "note": "one short sentence"}]}
+        Add one entry for every newly prescribed medication paired with each current medication, each other
+        new medication, each allergy and each condition in the patient information, most severe first. Use
+        "none" when no interaction is known. Don't provide treatment suggestions.
+        """
+
+
+def _closest(value, allowed, default):
+    value = " ".join(str(value or "").lower().replace("_", "-").split())
+    for option in allowed:
+        if value == option or value.startswith(option):
+            return option
+    return default
+
+
+def parse_structured_analysis(text):
+    """Parse the model's JSON answer into {"summary", "interactions"}.
+
+    Tolerates text around the object and loose field values; severities and
+    types outside the fixed vocabulary become "unknown" and "drug-drug".
+    Raises ValueError when there is no JSON object to parse.
+    """
+    match = re.search(r"\{.*\}", text or "", re.DOTALL)
+    if not match:
+        raise ValueError("The model did not return a JSON object")
+    data = json.loads(match.group(0))
+    if not isinstance(data, dict):
+        raise ValueError("The model's JSON answer is not an object")
+    interactions = []
+    for entry in data.get("interactions") or []:
+        if not isinstance(entry, dict):
+            continue
+        items = entry.get("items") or []
+        if isinstance(items, str):
+            items = [part.strip() for part in re.split(r"\s*(?:,|\+|/| and )\s*", items) if part.strip()]
+        interactions.append({
+            "items": [str(item) for item in items],
+            "type": _closest(entry.get("type"), INTERACTION_TYPES, "drug-drug"),
+            "severity": _closest(entry.get("severity"), SEVERITIES, "unknown"),
+            "note": str(entry.get("note") or "").strip(),
+        })
+    interactions.sort(key=lambda entry: SEVERITIES.index(entry["severity"]))
+    return {"summary": str(data.get("summary") or "").strip(), "interactions": interactions}
@@ -0,0 +1,19 @@
+_encoding = None
+
+
+def count_tokens(text):
+    """Count tokens with tiktoken's cl100k_base encoding.
+    
+    Falls back to a 4-characters-per-token estimate when the encoding is not
+    available (tiktoken downloads it on first use, which fails offline).
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4) if text else 0
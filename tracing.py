@@ -0,0 +1,196 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+_current_trace = contextvars.ContextVar("medinteract_trace", default=None)
+
+
+class Span:
+    """One timed stage with counters such as chunks, tokens or bytes."""
+
+    def __init__(self, name, trace_id=None, **attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.duration = None
+
+    def set(self, **attrs):
+        """Attach or update counters on the span."""
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "started_at": round(self.started_at, 6),
+            "ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            **self.attrs,
+        }
+
+
+class Trace:
+    """Spans recorded for a single request, in the order they finished."""
+
+    def __init__(self, name):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def breakdown(self):
+        """Per-stage timing for the response dict."""
+        return {
+            "trace_id": self.trace_id,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+
+class JsonLogExporter:
+    """Writes every finished span as one JSON log line."""
+
+    def __init__(self, logger_name="medinteract.trace"):
+        self.logger = logging.getLogger(logger_name)
+
+    def export(self, span):
+        self.logger.info(json.dumps(span.to_dict()))
+
+
+class RingBufferExporter:
+    """Keeps the most recent spans in memory, e.g. for a debug panel."""
+
+    def __init__(self, maxlen=500):
+        self._spans = deque(maxlen=maxlen)
+
+    def export(self, span):
+        self._spans.append(span.to_dict())
+
+    def spans(self):
+        return list(self._spans)
+
+
+class PrometheusExporter:
+    """Aggregates spans into Prometheus text exposition format.
+
+    Every span name gets a ``medinteract_span_seconds`` summary (count and
+    sum), and every numeric counter on the span a ``medinteract_span_<name>_total``.
+    """
+
+    def __init__(self, prefix="medinteract_span"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._count = defaultdict(int)
+        self._seconds = defaultdict(float)
+        self._totals = defaultdict(float)
+
+    def export(self, span):
+        with self._lock:
+            self._count[span.name] += 1
+            self._seconds[span.name] += span.duration or 0.0
+            for key, value in span.attrs.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self._totals[(key, span.name)] += value
+
+    def render(self):
+        with self._lock:
+            lines = [
+                f"# HELP {self.prefix}_seconds Time spent per pipeline stage.",
+                f"# TYPE {self.prefix}_seconds summary",
+            ]
+            for name in sorted(self._count):
+                lines.append(f'{self.prefix}_seconds_count{{span="{name}"}} {self._count[name]}')
+                lines.append(f'{self.prefix}_seconds_sum{{span="{name}"}} {self._seconds[name]:.6f}')
+            for key in sorted({key for key, _ in self._totals}):
+                lines.append(f"# TYPE {self.prefix}_{key}_total counter")
+                for (counter, name), value in sorted(self._totals.items()):
+                    if counter == key:
+                        lines.append(f'{self.prefix}_{key}_total{{span="{name}"}} {value:g}')
+            return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """Records spans to pluggable exporters and to the current request's Trace."""
+
+    def __init__(self, exporters=()):
+        self.exporters = list(exporters)
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+        return exporter
+
+    def find_exporter(self, exporter_type):
+        """Return the first registered exporter of a type, or None."""
+        return next((e for e in self.exporters if isinstance(e, exporter_type)), None)
+
+    def _finish(self, span, trace=None):
+        trace = trace or _current_trace.get()
+        if trace is not None:
+            trace.spans.append(span)
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception:
+                logging.getLogger(__name__).exception("Span exporter failed")
+
+    @contextmanager
+    def trace(self, name):
+        """Collect every span recorded in this context (and tasks copied from it) into a Trace."""
+        trace = Trace(name)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time a block; counters can be added with ``span.set(...)`` inside it."""
+        trace = _current_trace.get()
+        span = Span(name, trace.trace_id if trace else None, **attrs)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - start
+            self._finish(span)
+
+    def record(self, name, seconds, trace=None, **attrs):
+        """Record a stage timed elsewhere, e.g. in a worker process or by the LLM server.
+
+        ``trace`` attaches the span to a specific Trace instead of the current one.
+        """
+        trace = trace or _current_trace.get()
+        span = Span(name, trace.trace_id if trace else None, **attrs)
+        span.duration = seconds
+        self._finish(span, trace)
+
+
+def _default_tracer():
+    tracer = Tracer([RingBufferExporter(), PrometheusExporter()])
+    if os.environ.get("MEDINTERACT_TRACE_LOG"):
+        tracer.add_exporter(JsonLogExporter())
+    return tracer
+
+
+tracer = _default_tracer()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run_in_context(pool, fn, *args):
+    """Submit ``fn`` to an executor so its spans land in the caller's current trace."""
+    return pool.submit(contextvars.copy_context().run, fn, *args)